@@ -4,6 +4,9 @@ from flask_cors import CORS
 from config import config
 from .database import db
 from .api import api_bp
+from .commands import register_commands
+from .migrations import run_migrations, schema_lock
+from .serializers import FastJSONProvider
 
 
 def create_app(config_class=config):
@@ -11,6 +14,9 @@ def create_app(config_class=config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    # jsonify() through orjson when it is installed
+    app.json = FastJSONProvider(app)
+
     # Enable CORS for development
     CORS(app, resources={r"/api/*": {"origins": "*"}})
 
@@ -20,14 +26,22 @@ def create_app(config_class=config):
     # Register blueprints
     app.register_blueprint(api_bp)
 
+    # Register CLI commands
+    register_commands(app)
+
     # Create tables (for development)
+    # One worker at a time: the others wait and find the schema up to date
     with app.app_context():
         try:
-            db.create_all()
-            print(" Database tables created successfully!")
+            with schema_lock():
+                db.create_all()
+                print(" Database tables created successfully!")
+
+                # Apply schema changes to existing tables (indexes, columns)
+                run_migrations()
 
-            # Create initial data if tables are empty
-            create_initial_data()
+                # Create initial data if tables are empty
+                create_initial_data()
 
         except Exception as e:
             print(f" Error creating tables: {e}")
@@ -37,7 +51,8 @@ def create_app(config_class=config):
     @app.after_request
     def after_request(response):
         response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,If-None-Match')
+        response.headers.add('Access-Control-Expose-Headers', 'ETag,Last-Modified')
         response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
         return response
 
@@ -46,7 +61,9 @@ def create_app(config_class=config):
 
 def create_initial_data():
     """Create initial data if tables are empty"""
-    from .models import AccountManager, Customer, Search, Listing, Mailing, Appointment
+    from .models import AccountManager, Customer, Search, Listing, Mailing, Appointment, MessageTemplate
+    from .services import CustomerService
+    from message_templates import DEFAULT_TEMPLATES
     from datetime import datetime, timezone, timedelta
     import json
 
@@ -115,5 +132,18 @@ def create_initial_data():
         if am:
             customer.account_managers.append(am)
 
+        db.session.flush()
+        CustomerService.set_platforms(customer.id, json.loads(customer.platforms))
+
+        db.session.commit()
+        print(" Initial customer created")
+
+    # Shared outreach templates customers start from
+    existing = {name for name, in db.session.query(MessageTemplate.name).filter(MessageTemplate.customer_id.is_(None))}
+    missing = [name for name in DEFAULT_TEMPLATES if name not in existing]
+    if missing:
+        for name in missing:
+            template = DEFAULT_TEMPLATES[name]
+            db.session.add(MessageTemplate(name=name, version=1, subject=template['subject'], body=template['body']))
         db.session.commit()
-        print(" Initial customer created")
\ No newline at end of file
+        print(f" Default message templates created: {', '.join(missing)}")
\ No newline at end of file
@@ -1,8 +1,19 @@
+import csv
+import io
+import json
 from datetime import datetime, timezone
+from functools import wraps
 
-from flask import Blueprint, request, jsonify
-from .services import AccountManagerService, CustomerService, SearchService, ListingService
+from flask import Blueprint, Response, make_response, request, jsonify, stream_with_context
+from sqlalchemy import text
+from .services import (AccountManagerService, CustomerService, SearchService, ListingService, DashboardService,
+                       DedupService, MailService, TemplateService)
 from .models import db, AccountManager, Customer, Search
+from .pagination import DEFAULT_PER_PAGE, clamp_per_page
+from .geo import MAX_RADIUS_KM
+from . import autocomplete, generations
+from .cache import get_cache
+from .serializers import customer_serializer, dumps, listing_serializer, search_serializer
 
 # Create blueprint
 api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
@@ -14,24 +25,138 @@ def error_response(message, status_code=400):
 
 
 # Helper function for success responses
-def success_response(data, message=None, status_code=200):
+def success_response(data, message=None, status_code=200, pagination=None):
     response = {'success': True, 'data': data}
     if message:
         response['message'] = message
+    if pagination is not None:
+        response['pagination'] = pagination
     return jsonify(response), status_code
 
 
+# Helper function for listing filters shared by list and export endpoints
+def parse_listing_filters():
+    filters = {}
+
+    # Customer / search filters
+    for name in ['customer_id', 'search_id']:
+        value = request.args.get(name)
+        if value:
+            try:
+                filters[name] = int(value)
+            except ValueError:
+                raise ValueError(f'{name} must be an integer')
+
+    # Platform / status filters
+    for name in ['platform', 'status']:
+        value = request.args.get(name)
+        if value:
+            filters[name] = value
+
+    # Price range filters
+    for name in ['min_price', 'max_price']:
+        value = request.args.get(name)
+        if value:
+            try:
+                filters[name] = float(value)
+            except ValueError:
+                raise ValueError(f'{name} must be a number')
+
+    # Text search filter
+    search_text = request.args.get('search')
+    if search_text:
+        filters['search_text'] = search_text
+
+    # Radius filter around a postal code
+    postcode = request.args.get('postcode')
+    radius_km = request.args.get('radius_km')
+    if radius_km:
+        if not postcode:
+            raise ValueError('radius_km requires postcode')
+        try:
+            filters['radius_km'] = float(radius_km)
+        except ValueError:
+            raise ValueError('radius_km must be a number')
+        if not 0 < filters['radius_km'] <= MAX_RADIUS_KM:
+            raise ValueError(f'radius_km must be between 0 and {MAX_RADIUS_KM}')
+        filters['postcode'] = postcode.strip()
+
+    return filters
+
+
+# Listing fields returned by list and export endpoints, narrowed with fields= (also the CSV header)
+LISTING_FIELDS = listing_serializer.keys
+
+
+# Decorator for conditional GETs from the change generations of `scopes` (app/generations.py)
+def conditional(*scopes):
+    """
+    Send ETag/Last-Modified and answer a matching If-None-Match (or
+    If-Modified-Since) with 304 before the view runs. A customer_id
+    argument (query string or URL) narrows per-customer scopes.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            customer_id = kwargs.get('customer_id', request.args.get('customer_id', type=int))
+            dependencies = generations.dependencies(scopes, customer_id)
+            # The date bounds how long time-dependent values (e.g. "last 30 days") can stay cached
+            variant = '|'.join([request.full_path, datetime.now(timezone.utc).date().isoformat()])
+            etag, last_modified = generations.validator(dependencies, variant)
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                not_modified = bool(last_modified and request.if_modified_since
+                                    and last_modified.replace(microsecond=0) <= request.if_modified_since)
+            if not_modified:
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+# Helper function for keyset pagination parameters
+def pagination_args():
+    per_page = clamp_per_page(request.args.get('per_page', DEFAULT_PER_PAGE, type=int))
+    cursor = request.args.get('cursor') or None
+    return per_page, cursor
+
+
+# Helper function for sparse fieldsets: ?fields=id,title,price
+def requested_fields(allowed):
+    """Field names listed in the fields argument (None = all), ValueError for names outside `allowed`"""
+    if 'fields' not in request.args:
+        return None
+    fields = list(dict.fromkeys(field.strip() for field in request.args['fields'].split(',') if field.strip()))
+    if not fields:
+        raise ValueError(f"fields must name at least one of: {', '.join(allowed)}")
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(allowed)}")
+    return fields
+
+
 # ==================== #
 # ACCOUNT MANAGER ENDPOINTS
 # ==================== #
 
 @api_bp.route('/account-managers', methods=['GET'])
+@conditional('account_managers', 'customers', 'searches')
 def get_account_managers():
     """Get all account managers"""
     try:
         active_only = request.args.get('active_only', 'true').lower() == 'true'
-        account_managers = AccountManagerService.get_all_account_managers(active_only)
-        return success_response([am.to_dict() for am in account_managers])
+        return success_response(AccountManagerService.get_cached_account_managers(active_only))
     except Exception as e:
         return error_response(str(e), 500)
 
@@ -53,14 +178,15 @@ def create_account_manager():
 
 
 @api_bp.route('/account-managers/<int:account_manager_id>', methods=['GET'])
+@conditional('account_managers', 'customers', 'searches')
 def get_account_manager(account_manager_id):
     """Get account manager by ID"""
     try:
-        account_manager = AccountManagerService.get_account_manager_by_id(account_manager_id)
+        account_manager = AccountManagerService.get_cached_account_manager(account_manager_id)
         if not account_manager:
             return error_response('Account manager not found', 404)
 
-        return success_response(account_manager.to_dict())
+        return success_response(account_manager)
     except Exception as e:
         return error_response(str(e), 500)
 
@@ -102,6 +228,7 @@ def delete_account_manager(account_manager_id):
 # ==================== #
 
 @api_bp.route('/customers', methods=['GET'])
+@conditional('customers', 'account_managers', 'searches', 'listings')
 def get_customers():
     """Get all customers with optional filters"""
     try:
@@ -117,8 +244,15 @@ def get_customers():
         if 'search' in request.args:
             filters['search_text'] = request.args['search']
 
-        customers = CustomerService.get_all_customers(filters)
-        return success_response([customer.to_dict() for customer in customers])
+        fields = requested_fields(CustomerService.FIELDS)
+        serializer, hidden = customer_serializer.narrow(fields, CustomerService.DERIVED_FIELDS)
+
+        per_page, cursor = pagination_args()
+        rows, next_cursor = CustomerService.get_customers_page(filters, per_page, cursor, serializer.columns)
+        return success_response(CustomerService.serialize_customer_rows(rows, serializer, fields, hidden),
+                                pagination={'per_page': per_page, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return error_response(str(e), 400)
     except Exception as e:
         return error_response(str(e), 500)
 
@@ -132,7 +266,7 @@ def create_customer():
             return error_response('No data provided')
 
         customer = CustomerService.create_customer(data)
-        return success_response(customer.to_dict(), 'Customer created successfully', 201)
+        return success_response(CustomerService.serialize_customers([customer])[0], 'Customer created successfully', 201)
     except ValueError as e:
         return error_response(str(e), 400)
     except Exception as e:
@@ -140,6 +274,7 @@ def create_customer():
 
 
 @api_bp.route('/customers/<int:customer_id>', methods=['GET'])
+@conditional('customers', 'account_managers', 'searches', 'listings')
 def get_customer(customer_id):
     """Get customer by ID"""
     try:
@@ -147,7 +282,7 @@ def get_customer(customer_id):
         if not customer:
             return error_response('Customer not found', 404)
 
-        return success_response(customer.to_dict())
+        return success_response(CustomerService.serialize_customers([customer])[0])
     except Exception as e:
         return error_response(str(e), 500)
 
@@ -161,7 +296,7 @@ def update_customer(customer_id):
             return error_response('No data provided')
 
         customer = CustomerService.update_customer(customer_id, data)
-        return success_response(customer.to_dict(), 'Customer updated successfully')
+        return success_response(CustomerService.serialize_customers([customer])[0], 'Customer updated successfully')
     except ValueError as e:
         return error_response(str(e), 400)
     except Exception as e:
@@ -190,7 +325,7 @@ def assign_account_managers(customer_id):
             return error_response('No account manager IDs provided')
 
         customer = CustomerService.assign_account_managers(customer_id, data['account_manager_ids'])
-        return success_response(customer.to_dict(), 'Account managers assigned successfully')
+        return success_response(CustomerService.serialize_customers([customer])[0], 'Account managers assigned successfully')
     except ValueError as e:
         return error_response(str(e), 400)
     except Exception as e:
@@ -202,6 +337,7 @@ def assign_account_managers(customer_id):
 # ==================== #
 
 @api_bp.route('/searches', methods=['GET'])
+@conditional('searches', 'customers')
 def get_searches():
     """Get all searches with optional filters"""
     try:
@@ -214,8 +350,15 @@ def get_searches():
         if 'active' in request.args:
             filters['is_active'] = request.args['active'].lower() == 'true'
 
-        searches = SearchService.get_all_searches(filters)
-        return success_response([search.to_dict() for search in searches])
+        fields = requested_fields(SearchService.FIELDS)
+        serializer, hidden = search_serializer.narrow(fields, SearchService.DERIVED_FIELDS)
+
+        per_page, cursor = pagination_args()
+        rows, next_cursor = SearchService.get_searches_page(filters, per_page, cursor, serializer.columns)
+        return success_response(SearchService.serialize_search_rows(rows, serializer, fields, hidden),
+                                pagination={'per_page': per_page, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return error_response(str(e), 400)
     except Exception as e:
         return error_response(str(e), 500)
 
@@ -229,7 +372,7 @@ def create_search():
             return error_response('No data provided')
 
         search = SearchService.create_search(data)
-        return success_response(search.to_dict(), 'Search created successfully', 201)
+        return success_response(SearchService.serialize_searches([search])[0], 'Search created successfully', 201)
     except ValueError as e:
         return error_response(str(e), 400)
     except Exception as e:
@@ -237,6 +380,7 @@ def create_search():
 
 
 @api_bp.route('/searches/<int:search_id>', methods=['GET'])
+@conditional('searches', 'customers')
 def get_search(search_id):
     """Get search by ID"""
     try:
@@ -244,7 +388,7 @@ def get_search(search_id):
         if not search:
             return error_response('Search not found', 404)
 
-        return success_response(search.to_dict())
+        return success_response(SearchService.serialize_searches([search])[0])
     except Exception as e:
         return error_response(str(e), 500)
 
@@ -258,7 +402,7 @@ def update_search(search_id):
             return error_response('No data provided')
 
         search = SearchService.update_search(search_id, data)
-        return success_response(search.to_dict(), 'Search updated successfully')
+        return success_response(SearchService.serialize_searches([search])[0], 'Search updated successfully')
     except ValueError as e:
         return error_response(str(e), 400)
     except Exception as e:
@@ -287,7 +431,91 @@ def update_search_results(search_id):
             return error_response('No listings count provided')
 
         search = SearchService.update_search_results(search_id, data['listings_found'])
-        return success_response(search.to_dict(), 'Search results updated successfully')
+        return success_response(SearchService.serialize_searches([search])[0], 'Search results updated successfully')
+    except ValueError as e:
+        return error_response(str(e), 400)
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+# ==================== #
+# MESSAGE TEMPLATE & MAILING ENDPOINTS
+# ==================== #
+
+@api_bp.route('/templates', methods=['GET'])
+def get_templates():
+    """Get the current version of every template (a customer's own ones replace shared ones)"""
+    try:
+        customer_id = request.args.get('customer_id', type=int)
+        templates = TemplateService.get_templates(customer_id)
+        return success_response([template.to_dict() for template in templates])
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+@api_bp.route('/templates', methods=['POST'])
+def create_template_version():
+    """Save a template as the next version of its name"""
+    try:
+        data = request.get_json()
+        if not data:
+            return error_response('No data provided')
+
+        template = TemplateService.save_template(data)
+        return success_response(template.to_dict(), 'Template saved successfully', 201)
+    except ValueError as e:
+        return error_response(str(e), 400)
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+@api_bp.route('/templates/<name>/versions', methods=['GET'])
+def get_template_versions(name):
+    """Get all versions of a template, newest first"""
+    try:
+        customer_id = request.args.get('customer_id', type=int)
+        versions = TemplateService.get_versions(name, customer_id)
+        if not versions:
+            return error_response('Template not found', 404)
+
+        return success_response([template.to_dict() for template in versions])
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+@api_bp.route('/templates/<name>/preview', methods=['POST'])
+def preview_template(name):
+    """Render the current version of a template for one listing"""
+    try:
+        data = request.get_json()
+        if not data or 'listing_id' not in data:
+            return error_response('No listing_id provided')
+
+        listing = ListingService.get_listing_by_id(data['listing_id'])
+        if not listing:
+            return error_response('Listing not found', 404)
+
+        template = TemplateService.get_current(name, listing.customer_id)
+        if not template:
+            return error_response('Template not found', 404)
+
+        subject, body = TemplateService.render_listings(template, [listing.id])[listing.id]
+        return success_response({'template_id': template.id, 'version': template.version,
+                                 'subject': subject, 'body': body})
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+@api_bp.route('/mailings/campaign', methods=['POST'])
+def queue_campaign():
+    """Queue templated mails for many listings"""
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('listing_ids'), list):
+            return error_response('No listing_ids provided')
+
+        counts = MailService.queue_campaign(data['listing_ids'], data.get('type') or 'initial')
+        return success_response(counts, 'Mailings queued', 202)
     except ValueError as e:
         return error_response(str(e), 400)
     except Exception as e:
@@ -299,43 +527,38 @@ def update_search_results(search_id):
 # ==================== #
 
 @api_bp.route('/dashboard/stats', methods=['GET'])
+@conditional('account_managers', 'customers', 'searches', 'listings')
 def get_dashboard_stats():
     """Get dashboard statistics"""
     try:
-        from sqlalchemy import func
+        return success_response(DashboardService.get_admin_overview())
+    except Exception as e:
+        return error_response(str(e), 500)
 
-        # Get counts
-        total_account_managers = AccountManager.query.filter_by(is_active=True).count()
-        total_customers = Customer.query.filter_by(status='ACTIVE').count()
-        total_searches = Search.query.filter_by(is_active=True).count()
 
-        # Get recent activity
-        from datetime import datetime, timedelta, timezone
-        thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
+# ==================== #
+# AUTOCOMPLETE
+# ==================== #
 
-        recent_customers = Customer.query.filter(
-            Customer.created_at >= thirty_days_ago
-        ).count()
+@api_bp.route('/autocomplete', methods=['GET'])
+def autocomplete_search():
+    """Prefix matches across customers, account managers and listings"""
+    try:
+        query = request.args.get('q', '').strip()
+        limit = min(max(request.args.get('limit', autocomplete.DEFAULT_LIMIT, type=int), 1),
+                    autocomplete.MAX_LIMIT)
 
-        # Get platform distribution from customers
-        platforms_data = {}
-        customers_with_platforms = Customer.query.filter(Customer.platforms.isnot(None)).all()
+        types = None
+        if request.args.get('types'):
+            types = set(request.args['types'].split(','))
+            unknown = types - set(autocomplete.SOURCES)
+            if unknown:
+                return error_response(f"Unknown types: {', '.join(sorted(unknown))}")
 
-        for customer in customers_with_platforms:
-            for platform in customer.platforms or []:
-                platforms_data[platform] = platforms_data.get(platform, 0) + 1
+        if not query:
+            return success_response([])
 
-        stats = {
-            'totals': {
-                'account_managers': total_account_managers,
-                'customers': total_customers,
-                'searches': total_searches,
-                'recent_customers': recent_customers
-            },
-            'platforms': platforms_data
-        }
-
-        return success_response(stats)
+        return success_response(autocomplete.get_index().search(query, limit, types))
     except Exception as e:
         return error_response(str(e), 500)
 
@@ -349,8 +572,9 @@ def health_check():
     """Health check endpoint"""
     try:
         # Test database connection
-        db.session.execute('SELECT 1')
-        return success_response({'status': 'healthy', 'database': 'connected'})
+        db.session.execute(text('SELECT 1'))
+        return success_response({'status': 'healthy', 'database': 'connected',
+                                 'reference_cache': get_cache().stats()})
     except Exception as e:
         return error_response({'status': 'unhealthy', 'error': str(e)}, 500)
 
@@ -359,112 +583,96 @@ def health_check():
 # ==================== #
 
 @api_bp.route('/listings', methods=['GET'])
+@conditional('listings')
 def get_listings():
     """Get all listings with optional filters"""
     try:
         # Parse filters from query parameters
-        filters = {}
-
-        # Customer filter
-        customer_id = request.args.get('customer_id')
-        if customer_id:
-            try:
-                filters['customer_id'] = int(customer_id)
-            except ValueError:
-                return jsonify({
-                    'error': 'customer_id must be an integer',
-                    'status': 'error'
-                }), 400
+        try:
+            filters = parse_listing_filters()
+            serializer = listing_serializer.subset(requested_fields(LISTING_FIELDS))
+        except ValueError as e:
+            return jsonify({
+                'error': str(e),
+                'status': 'error'
+            }), 400
 
-        # Search filter
-        search_id = request.args.get('search_id')
-        if search_id:
-            try:
-                filters['search_id'] = int(search_id)
-            except ValueError:
-                return jsonify({
-                    'error': 'search_id must be an integer',
-                    'status': 'error'
-                }), 400
+        # Keyset pagination parameters
+        per_page, cursor = pagination_args()
 
-        # Platform filter
-        platform = request.args.get('platform')
-        if platform:
-            filters['platform'] = platform
+        # Sort order: newest first, or best full-text match first when searching
+        sort = request.args.get('sort', 'newest')
+        if sort not in ('newest', 'relevance'):
+            return jsonify({
+                'error': 'sort must be newest or relevance',
+                'status': 'error'
+            }), 400
 
-        # Status filter
-        status = request.args.get('status')
-        if status:
-            filters['status'] = status
+        try:
+            rows, next_cursor = ListingService.get_listings_page(filters, per_page, cursor, sort,
+                                                                 serializer.columns)
+        except ValueError as e:
+            return jsonify({
+                'error': str(e),
+                'status': 'error'
+            }), 400
 
-        # Price range filters
-        min_price = request.args.get('min_price')
-        if min_price:
-            try:
-                filters['min_price'] = float(min_price)
-            except ValueError:
-                return jsonify({
-                    'error': 'min_price must be a number',
-                    'status': 'error'
-                }), 400
+        listings_data = serializer.many(rows)
 
-        max_price = request.args.get('max_price')
-        if max_price:
-            try:
-                filters['max_price'] = float(max_price)
-            except ValueError:
-                return jsonify({
-                    'error': 'max_price must be a number',
-                    'status': 'error'
-                }), 400
+        return jsonify({
+            'listings': listings_data,
+            'count': len(listings_data),
+            'per_page': per_page,
+            'next_cursor': next_cursor,
+            'status': 'success'
+        })
 
-        # Text search filter
-        search_text = request.args.get('search')
-        if search_text:
-            filters['search_text'] = search_text
+    except Exception as e:
+        return jsonify({
+            'error': f'Failed to fetch listings: {str(e)}',
+            'status': 'error'
+        }), 500
 
-        # Pagination parameters
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
 
-        # Get all listings (for now without pagination)
-        listings = ListingService.get_all_listings(filters)
+@api_bp.route('/listings/nearby', methods=['GET'])
+def get_nearby_listings():
+    """Get listings within radius_km of a postal code, with their distance"""
+    try:
+        try:
+            filters = parse_listing_filters()
+            if 'radius_km' not in filters:
+                raise ValueError('postcode and radius_km are required')
+            fields = requested_fields(LISTING_FIELDS + ['distance_km'])
+            serializer, hidden = listing_serializer.narrow(fields, {'distance_km': 'postal_code'})
+            distances = ListingService.postal_codes_within(filters['postcode'], filters['radius_km'])
+
+            per_page, cursor = pagination_args()
+            rows, next_cursor = ListingService.get_listings_page(filters, per_page, cursor,
+                                                                 columns=serializer.columns)
+        except ValueError as e:
+            return jsonify({
+                'error': str(e),
+                'status': 'error'
+            }), 400
 
-        # Convert to list of dicts
-        listings_data = []
-        for listing in listings:
-            listings_data.append({
-                'id': listing.id,
-                'title': listing.title,
-                'customer_id': listing.customer_id,
-                'search_id': listing.search_id,
-                'platform': listing.platform,
-                'platform_display': listing.platform_display,
-                'location': listing.location,
-                'address': listing.address,
-                'postal_code': listing.postal_code,
-                'city': listing.city,
-                'property_type': listing.property_type,
-                'rooms': listing.rooms,
-                'living_area': listing.living_area,
-                'year_built': listing.year_built,
-                'price': float(listing.price) if listing.price else None,
-                'price_per_sqm': float(listing.price_per_sqm) if listing.price_per_sqm else None,
-                'contact_name': listing.contact_name,
-                'contact_phone': listing.contact_phone,
-                'contact_email': listing.contact_email,
-                'status': listing.status,
-                'url': listing.url,
-                'description': listing.description,
-                'scraped_at': listing.scraped_at.isoformat() if listing.scraped_at else None,
-                'contacted_at': listing.contacted_at.isoformat() if listing.contacted_at else None,
-                'responded_at': listing.responded_at.isoformat() if listing.responded_at else None,
-                'created_at': listing.created_at.isoformat() if listing.created_at else None
-            })
+        listings_data = serializer.many(rows)
+        with_distance = fields is None or 'distance_km' in fields
+        for payload in listings_data:
+            if with_distance:
+                payload['distance_km'] = distances.get(payload['postal_code']) if distances is not None else None
+            for key in hidden:
+                del payload[key]
 
         return jsonify({
             'listings': listings_data,
             'count': len(listings_data),
+            'postcode': filters['postcode'],
+            'radius_km': filters['radius_km'],
+            'postal_codes': len(distances) if distances is not None else None,
+            # No centroid data installed: matched by postal region, without distances
+            'approximate': distances is None,
+            'per_page': per_page,
+            'next_cursor': next_cursor,
             'status': 'success'
         })
 
@@ -475,6 +683,59 @@ def get_listings():
         }), 500
 
 
+@api_bp.route('/listings/export', methods=['GET'])
+def export_listings():
+    """Stream all matching listings as NDJSON or CSV"""
+    try:
+        export_format = request.args.get('format', 'ndjson').lower()
+        if export_format not in ('ndjson', 'csv'):
+            return jsonify({
+                'error': 'format must be ndjson or csv',
+                'status': 'error'
+            }), 400
+
+        filters = parse_listing_filters()
+        serializer = listing_serializer.subset(requested_fields(LISTING_FIELDS))
+    except ValueError as e:
+        return jsonify({
+            'error': str(e),
+            'status': 'error'
+        }), 400
+
+    rows = ListingService.iter_listings(filters, columns=serializer.columns)
+
+    if export_format == 'csv':
+        body = _stream_csv(rows, serializer)
+        mimetype = 'text/csv'
+    else:
+        body = (dumps(serializer.serialize(row)) + b'\n' for row in rows)
+        mimetype = 'application/x-ndjson'
+
+    filename = datetime.now(timezone.utc).strftime(f'listings_%Y%m%d_%H%M%S.{export_format}')
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}'
+    })
+
+
+def _stream_csv(rows, serializer=listing_serializer, rows_per_chunk=500):
+    """Yield CSV text in chunks (semicolon separated with BOM so Excel opens umlauts correctly)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+
+    buffer.write('\ufeff')
+    writer.writerow(serializer.keys)
+
+    serialize = serializer.serialize
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(serialize(row).values())
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    yield buffer.getvalue()
+
+
 @api_bp.route('/listings', methods=['POST'])
 def create_listing():
     """Create a new listing"""
@@ -518,7 +779,53 @@ def create_listing():
         }), 500
 
 
+@api_bp.route('/listings/bulk', methods=['POST'])
+def bulk_upsert_listings():
+    """Create or update many listings at once (JSON array or NDJSON stream)"""
+    try:
+        if request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+            rows = _iter_ndjson(request.stream)
+        else:
+            rows = request.get_json(silent=True)
+            if not isinstance(rows, list):
+                return jsonify({
+                    'error': 'Expected a JSON array of listings',
+                    'status': 'error'
+                }), 400
+
+        results = ListingService.bulk_upsert_listings(rows)
+
+        summary = {'created': 0, 'updated': 0, 'rejected': 0}
+        for result in results:
+            summary[result['status']] += 1
+
+        return jsonify({
+            'results': results,
+            'summary': summary,
+            'status': 'success'
+        })
+
+    except Exception as e:
+        return jsonify({
+            'error': f'Failed to ingest listings: {str(e)}',
+            'status': 'error'
+        }), 500
+
+
+def _iter_ndjson(stream):
+    """Yield one parsed object per non-empty NDJSON line"""
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield ValueError(f'Invalid JSON on line {line_number}')
+
+
 @api_bp.route('/listings/<int:listing_id>', methods=['GET'])
+@conditional('listings')
 def get_listing(listing_id):
     """Get a specific listing by ID"""
     try:
@@ -610,27 +917,7 @@ def update_listing(listing_id):
     """Update listing details"""
     try:
         data = request.get_json()
-        listing = ListingService.get_listing_by_id(listing_id)
-
-        if not listing:
-            return jsonify({
-                'error': f'Listing with ID {listing_id} not found',
-                'status': 'error'
-            }), 404
-
-        # Update allowed fields
-        updatable_fields = [
-            'title', 'external_id', 'platform', 'platform_display',
-            'location', 'address', 'postal_code', 'city', 'property_type',
-            'rooms', 'living_area', 'year_built', 'price', 'price_per_sqm',
-            'contact_name', 'contact_phone', 'contact_email', 'url', 'description'
-        ]
-
-        for field in updatable_fields:
-            if field in data:
-                setattr(listing, field, data[field])
-
-        db.session.commit()
+        listing = ListingService.update_listing(listing_id, data)
 
         return jsonify({
             'message': 'Listing updated successfully',
@@ -642,6 +929,11 @@ def update_listing(listing_id):
             'status': 'success'
         })
 
+    except LookupError as e:
+        return jsonify({
+            'error': str(e),
+            'status': 'error'
+        }), 404
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -675,41 +967,22 @@ def delete_listing(listing_id):
 
 
 @api_bp.route('/listings/status-counts', methods=['GET'])
+@conditional('customer_stats')
 def get_listing_status_counts():
     """Get counts of listings grouped by status"""
     try:
         # Parse customer_id if provided
         customer_id = request.args.get('customer_id')
-
-        # This would ideally be a separate service method
-        # For now, implement basic version
-        from app.models import Listing
-        query = Listing.query
-
         if customer_id:
             try:
-                query = query.filter_by(customer_id=int(customer_id))
+                customer_id = int(customer_id)
             except ValueError:
                 return jsonify({
                     'error': 'customer_id must be an integer',
                     'status': 'error'
                 }), 400
 
-        # Group by status and count
-        from sqlalchemy import func
-        status_counts = db.session.query(
-            Listing.status,
-            func.count(Listing.id).label('count')
-        ).group_by(Listing.status).all()
-
-        # Format response
-        counts = {status: count for status, count in status_counts}
-
-        # Ensure all statuses are included (even if count is 0)
-        all_statuses = ['new', 'contacted', 'responded', 'appointment', 'closed']
-        for status in all_statuses:
-            if status not in counts:
-                counts[status] = 0
+        counts = DashboardService.get_listing_status_counts(customer_id)
 
         return jsonify({
             'status_counts': counts,
@@ -918,21 +1191,27 @@ def get_mobile_listing(listing_id):
 
 @api_bp.route('/mobile/listings/<int:listing_id>/contact', methods=['POST'])
 def contact_listing(listing_id):
-    """Send contact message for a listing"""
+    """Queue a contact message for a listing"""
     try:
-        data = request.get_json()
-        if not data or 'message' not in data:
-            return error_response('No message provided')
-
-        # In production: Save to database and send actual email
-        response = {
-            'success': True,
-            'message_id': 123,
-            'sent_at': datetime.now(timezone.utc).isoformat(),
-            'status': 'sent'
-        }
+        data = request.get_json(silent=True) or {}
 
-        return success_response(response, 'Nachricht erfolgreich gesendet')
+        listing = ListingService.get_listing_by_id(listing_id)
+        if not listing:
+            return error_response('Listing not found', 404)
+
+        # The same property on another platform counts as contacted
+        duplicate = DedupService.contacted_duplicate(listing)
+        if duplicate:
+            return error_response(
+                f'Seller already contacted through listing {duplicate.id} ({duplicate.platform_display})', 409
+            )
+
+        # Delivered asynchronously by `flask send-mails`; without a message the template is used
+        mailing = MailService.queue_mailing(listing, data.get('message'), data.get('subject'),
+                                            data.get('type') or 'initial')
+        return success_response(mailing.to_dict(), 'Nachricht zum Versand eingeplant', 202)
+    except ValueError as e:
+        return error_response(str(e), 400)
     except Exception as e:
         return error_response(str(e), 500)
 
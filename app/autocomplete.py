@@ -0,0 +1,279 @@
+# app/autocomplete.py
+"""
+In-process typeahead index for customers, account managers and listings.
+
+Every searchable value is folded like full-text search (app/search.py) and
+stored once per word start ("Hans Müller" -> "hans mueller", "mueller"), in
+one sorted array. A prefix lookup is a binary search plus a short forward
+scan, so top-k answers take microseconds instead of an OR of ILIKEs.
+
+The index is built lazily on first use and kept in sync by session events:
+after_flush records what changed, after_commit applies it. Writes that
+bypass the ORM (bulk upserts) stage their changes with stage(). Other
+processes (CLI imports, other web workers) are picked up by a background
+rebuild once the index is older than AUTOCOMPLETE_REFRESH_SECONDS.
+"""
+
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from .database import db
+from .models import AccountManager, Customer, Listing
+from .search import search_terms, word_spellings
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+MIN_QUERY_LENGTH = 1
+
+# Listings have long titles; only the first few words start an entry
+MAX_WORDS = 4
+
+# Candidates looked at per query before ranking
+SCAN_LIMIT = 500
+
+# Result order between types for equally good matches
+TYPE_PRIORITY = {'account_manager': 0, 'customer': 1, 'listing': 2}
+
+# type -> (model, {field: column}, label builder)
+SOURCES = {
+    'customer': (Customer, {
+        'name': (Customer.first_name, Customer.last_name),
+        'company_name': (Customer.company_name,),
+        'email': (Customer.email,),
+        'city': (Customer.city,),
+    }, lambda v: v['company_name'] or f"{v['first_name']} {v['last_name']}"),
+    'account_manager': (AccountManager, {
+        'name': (AccountManager.first_name, AccountManager.last_name),
+        'email': (AccountManager.email,),
+    }, lambda v: f"{v['first_name']} {v['last_name']}"),
+    'listing': (Listing, {
+        'title': (Listing.title,),
+    }, lambda v: v['title']),
+}
+
+_MODEL_TYPES = {model: kind for kind, (model, _, _) in SOURCES.items()}
+_PENDING_KEY = 'autocomplete_pending'
+
+
+def _source_columns(kind):
+    _, fields, _ = SOURCES[kind]
+    return {column.key: column for columns in fields.values() for column in columns}
+
+
+def entity_values(obj):
+    """The indexed attribute values of a model instance"""
+    kind = _MODEL_TYPES[type(obj)]
+    return {key: getattr(obj, key) for key in _source_columns(kind)}
+
+
+def entity_terms(kind, values):
+    """Terms to index: every word start of every field value, in each spelling"""
+    _, fields, _ = SOURCES[kind]
+    terms = set()
+    for columns in fields.values():
+        # Emails fold to their words too: "anna.schmidt@web.de" -> "anna schmidt web de"
+        value = ' '.join(str(values[c.key]) for c in columns if values.get(c.key))
+        for words in word_spellings(value):
+            for start in range(min(len(words), MAX_WORDS)):
+                terms.add(' '.join(words[start:]))
+    return sorted(terms)
+
+
+class PrefixIndex:
+    """
+    Sorted term array with parallel entry references; thread-safe. Changes
+    never modify the arrays in place: apply() builds new ones and swaps them in.
+    """
+
+    def __init__(self):
+        self.terms = []
+        self.refs = array('l')
+        self.entries = {}      # ref -> (type, id, label, terms)
+        self.keys = {}         # (type, id) -> ref
+        self.next_ref = 0
+        self.built_at = 0.0
+        self.lock = threading.RLock()           # held by lookups and the swap of new arrays
+        self.write_lock = threading.Lock()      # one writer merges at a time
+
+    @classmethod
+    def build(cls, batch_size=5000):
+        """Load every indexed entity from the database"""
+        index = cls()
+        pairs = []
+        for kind, (model, _, _) in SOURCES.items():
+            columns = _source_columns(kind)
+            stmt = select(model.id, *columns.values())
+            for row in db.session.execute(stmt, execution_options={'yield_per': batch_size}):
+                values = dict(zip(columns, row[1:]))
+                ref = index._register(kind, row[0], values)
+                pairs.extend((term, ref) for term in index.entries[ref][3])
+
+        pairs.sort()
+        index.terms = [term for term, _ in pairs]
+        index.refs = array('l', (ref for _, ref in pairs))
+        index.built_at = time.monotonic()
+        return index
+
+    def __len__(self):
+        return len(self.terms)
+
+    def _register(self, kind, entity_id, values):
+        terms = entity_terms(kind, values)
+        ref = self.next_ref
+        self.next_ref += 1
+        self.entries[ref] = (kind, entity_id, SOURCES[kind][2](values), terms)
+        self.keys[(kind, entity_id)] = ref
+        return ref
+
+    def upsert(self, kind, entity_id, values):
+        self.apply({(kind, entity_id): values})
+
+    def remove(self, kind, entity_id):
+        self.apply({(kind, entity_id): None})
+
+    def apply(self, changes):
+        """
+        Apply {(type, id): values or None (removed)} in one merge: the new
+        arrays are sliced together from the current ones, off the lookup lock,
+        and swapped in at once, so a commit costs one copy of the index
+        instead of a list insert/delete per term.
+        """
+        with self.write_lock:
+            terms, refs = self.terms, self.refs
+            removed = []
+            deletions = set()
+            additions = []
+            for (kind, entity_id), values in changes.items():
+                ref = self.keys.pop((kind, entity_id), None)
+                if ref is not None:
+                    removed.append(ref)
+                    for term in self.entries[ref][3]:
+                        position = bisect_left(terms, term)
+                        while refs[position] != ref:
+                            position += 1
+                        deletions.add(position)
+                if values is not None:
+                    ref = self._register(kind, entity_id, values)
+                    additions.extend((bisect_left(terms, term), term, ref) for term in self.entries[ref][3])
+            additions.sort()
+
+            new_terms, new_refs = [], array('l')
+            start = 0
+            added = 0
+            for position in sorted(deletions.union(position for position, _, _ in additions)):
+                new_terms.extend(terms[start:position])
+                new_refs.extend(refs[start:position])
+                while added < len(additions) and additions[added][0] == position:
+                    new_terms.append(additions[added][1])
+                    new_refs.append(additions[added][2])
+                    added += 1
+                start = position + 1 if position in deletions else position
+            new_terms.extend(terms[start:])
+            new_refs.extend(refs[start:])
+
+            with self.lock:
+                self.terms, self.refs = new_terms, new_refs
+                for ref in removed:
+                    del self.entries[ref]
+
+    def search(self, query, limit=DEFAULT_LIMIT, types=None):
+        """Top `limit` entities with a term starting with the folded `query`"""
+        prefix = ' '.join(search_terms(query))
+        if len(prefix) < MIN_QUERY_LENGTH:
+            return []
+
+        candidates = {}
+        with self.lock:
+            position = bisect_left(self.terms, prefix)
+            end = min(len(self.terms), position + SCAN_LIMIT)
+            while position < end and self.terms[position].startswith(prefix):
+                ref = self.refs[position]
+                term = self.terms[position]
+                kind, entity_id, label, _ = self.entries[ref]
+                if types is None or kind in types:
+                    # Exact word first, then shortest remaining text, then type
+                    rank = (term != prefix, len(term), TYPE_PRIORITY[kind], label)
+                    if ref not in candidates or rank < candidates[ref][0]:
+                        candidates[ref] = (rank, {'type': kind, 'id': entity_id, 'label': label})
+                position += 1
+
+        return [result for _, result in sorted(candidates.values(), key=lambda c: c[0])[:limit]]
+
+
+# ==================== #
+# INDEX ACCESS
+# ==================== #
+
+_build_lock = threading.Lock()
+
+
+def get_index():
+    """The app's index, built on first use and refreshed in the background when stale"""
+    app = current_app._get_current_object()
+    index = app.extensions.get('autocomplete')
+
+    if index is None:
+        with _build_lock:
+            index = app.extensions.get('autocomplete')
+            if index is None:
+                index = PrefixIndex.build()
+                app.extensions['autocomplete'] = index
+        return index
+
+    refresh = app.config.get('AUTOCOMPLETE_REFRESH_SECONDS', 300)
+    if refresh and time.monotonic() - index.built_at > refresh and _build_lock.acquire(blocking=False):
+        index.built_at = time.monotonic()  # one refresh at a time
+        threading.Thread(target=_rebuild, args=(app,), daemon=True).start()
+
+    return index
+
+
+def _rebuild(app):
+    try:
+        with app.app_context():
+            app.extensions['autocomplete'] = PrefixIndex.build()
+    finally:
+        _build_lock.release()
+
+
+def stage(session, kind, entity_id, values=None):
+    """Queue an index change for the session's next commit (values None = removed)"""
+    session.info.setdefault(_PENDING_KEY, {})[(kind, entity_id)] = values
+
+
+# ==================== #
+# SESSION EVENTS
+# ==================== #
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    for obj in session.new | session.dirty:
+        if type(obj) in _MODEL_TYPES and obj.id is not None:
+            stage(session, _MODEL_TYPES[type(obj)], obj.id, entity_values(obj))
+    for obj in session.deleted:
+        if type(obj) in _MODEL_TYPES:
+            stage(session, _MODEL_TYPES[type(obj)], obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending or not has_app_context():
+        return
+
+    index = current_app.extensions.get('autocomplete')
+    if index is None:
+        return  # built fresh from the database on first use
+
+    index.apply(pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,171 @@
+# app/cache.py
+"""
+In-process cache for reference data: account managers, customer names and
+the customer platform distribution. They change a few times a day but are
+read on almost every request.
+
+TTLCache is a bounded LRU whose entries also expire after a TTL, with
+hit/miss counters. Keys are (entity, id) tuples; ENTITY_SCOPES names the
+change generation scope (app/generations.py) each entity is built from.
+
+Entries are invalidated per scope:
+
+- in this process right after a commit that wrote the scope, through the
+  generations commit hook (write-through for the services' own writes)
+- for writes of other processes (other web workers, CLI commands), by
+  comparing the scopes' generations in the change_generations table at most
+  every REFERENCE_CACHE_SYNC_SECONDS (0 = only the TTL bounds staleness)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+from . import generations
+
+DEFAULT_MAXSIZE = 10000
+DEFAULT_TTL = 300
+
+# Entity -> change generation scope its values are read from
+ENTITY_SCOPES = {
+    'account_manager': 'account_managers',
+    'account_managers': 'account_managers',
+    'customer_name': 'customers',
+    'platform_distribution': 'customers',
+}
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU of at most `maxsize` entries, each valid for `ttl` seconds"""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """Cached value of `key`, else loader() (cached)"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def get_many(self, entity, ids, loader):
+        """{id: value} for many ids of `entity`; loader(missing ids) returns {id: value} for those it finds"""
+        found = {}
+        missing = []
+        for entity_id in ids:
+            value = self.get((entity, entity_id), _MISSING)
+            if value is _MISSING:
+                missing.append(entity_id)
+            else:
+                found[entity_id] = value
+        if missing:
+            loaded = loader(missing)
+            for entity_id, value in loaded.items():
+                self.set((entity, entity_id), value)
+            found.update(loaded)
+        return found
+
+    def invalidate(self, entities):
+        """Drop every entry of the given entities"""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] in entities]:
+                del self.entries[key]
+                self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries), 'maxsize': self.maxsize, 'ttl': self.ttl,
+                'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions, 'invalidations': self.invalidations,
+            }
+
+
+class ReferenceCache(TTLCache):
+    """TTLCache of reference entities kept in step with their change generations"""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL, sync_seconds=0):
+        super().__init__(maxsize, ttl)
+        self.sync_seconds = sync_seconds
+        self.synced_at = None
+        self.generations = {}
+        self.sync_lock = threading.Lock()
+
+    def invalidate_scopes(self, scopes):
+        self.invalidate({entity for entity, scope in ENTITY_SCOPES.items() if scope in scopes})
+
+    def sync(self):
+        """Drop entities whose scope another process has written since the last check"""
+        if not self.sync_seconds:
+            return
+        now = time.monotonic()
+        if self.synced_at is not None and now - self.synced_at < self.sync_seconds:
+            return
+        if not self.sync_lock.acquire(blocking=False):
+            return  # another thread is checking
+        try:
+            scopes = sorted(set(ENTITY_SCOPES.values()))
+            current = {scope: generation for scope, (generation, _) in generations.current(scopes).items()}
+            if self.synced_at is None:
+                self.invalidate(set(ENTITY_SCOPES))  # loaded before the first check
+            else:
+                self.invalidate_scopes({scope for scope in scopes if current.get(scope) != self.generations.get(scope)})
+            self.generations = current
+            self.synced_at = now
+        finally:
+            self.sync_lock.release()
+
+
+def get_cache():
+    """The app's reference cache, checked against other processes' writes"""
+    app = current_app._get_current_object()
+    cache = app.extensions.get('reference_cache')
+    if cache is None:
+        cache = app.extensions.setdefault('reference_cache', ReferenceCache(
+            maxsize=app.config.get('REFERENCE_CACHE_SIZE', DEFAULT_MAXSIZE),
+            ttl=app.config.get('REFERENCE_CACHE_TTL', DEFAULT_TTL),
+            sync_seconds=app.config.get('REFERENCE_CACHE_SYNC_SECONDS', 0),
+        ))
+    cache.sync()
+    return cache
+
+
+@generations.on_commit
+def _invalidate_committed(scopes):
+    if not has_app_context():
+        return
+    cache = current_app.extensions.get('reference_cache')
+    if cache is not None:
+        cache.invalidate_scopes(scopes)
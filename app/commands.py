@@ -0,0 +1,265 @@
+# app/commands.py
+import hashlib
+import json
+import time
+
+import click
+from sqlalchemy import select
+
+from contact_journal import listing_key
+from offers_csv import iter_offers, link_platform
+from .geo import DATA_PATH, build_centroids_file
+from . import followups, mailer, replies
+from .models import Customer, Listing, Search, db
+from .scheduler import (DEFAULT_POLL_INTERVAL, DEFAULT_WORKERS, count_new_listings, load_runner,
+                        run_scheduler)
+from .search import rebuild_index
+from .services import (CustomerService, DedupService, ListingService, MatchingService, StatsService,
+                       TemplateService)
+
+
+def _offer_external_id(url):
+    """platform:id for known platforms, else a hash of the normalized URL (fits the column)"""
+    key = listing_key(url)
+    if '://' in key:
+        return 'url:' + hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return key
+
+
+def _fit(field, value):
+    """Truncate strings to the column length so one long cell cannot fail a whole batch"""
+    length = getattr(Listing.__table__.c[field].type, 'length', None)
+    if length and isinstance(value, str):
+        return value[:length]
+    return value
+
+
+def offer_rows(offers, customer_id, search_id=None, stats=None):
+    """Map parsed export offers onto bulk listing rows, skipping repeated listings"""
+    seen = set()
+    for offer in offers:
+        external_id = _offer_external_id(offer['url'])
+        if external_id in seen:
+            if stats is not None:
+                stats['duplicates'] += 1
+            continue
+        seen.add(external_id)
+
+        column = offer.pop('column')
+        if external_id.startswith('url:'):
+            platform = link_platform(column)
+        else:
+            platform = external_id.split(':', 1)[0]
+
+        title = offer.get('title') or ' '.join(
+            filter(None, [offer.get('property_type'), offer.get('postal_code'), offer.get('city')])
+        ) or offer['url']
+
+        row = {field: _fit(field, value) for field, value in offer.items()}
+        row.update({
+            'title': _fit('title', title),
+            'platform': _fit('platform', platform),
+            'platform_display': _fit('platform_display', column),
+            'external_id': external_id,
+            'customer_id': customer_id,
+            'search_id': search_id,
+        })
+        yield row
+
+
+def register_commands(app):
+    """Register the maintenance CLI commands (run with `flask --app main <command>`)"""
+
+    @app.cli.command('rebuild-stats')
+    @click.option('--customer-id', type=int, multiple=True,
+                  help='Only rebuild these customers (repeatable). Default: all.')
+    def rebuild_stats(customer_id):
+        """Rebuild the customer_stats rollup and customer platform index from scratch"""
+        customer_ids = list(customer_id) or None
+        StatsService.rebuild(customer_ids)
+        click.echo(f" customer_stats rebuilt for {len(customer_ids) if customer_ids else 'all'} customer(s)")
+
+        if customer_ids is None:
+            platform_rows = CustomerService.rebuild_platform_index()
+            click.echo(f" customer_platforms rebuilt ({platform_rows} rows)")
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index():
+        """Rebuild the listing full-text search index from the listings table"""
+        with db.engine.begin() as connection:
+            count = rebuild_index(connection)
+        click.echo(f" listing_search rebuilt ({count} listings)")
+
+    @app.cli.command('run-scheduler')
+    @click.option('--workers', type=int, default=DEFAULT_WORKERS, show_default=True,
+                  help='Searches run concurrently.')
+    @click.option('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL, show_default=True,
+                  help='Seconds between polls when nothing is due.')
+    @click.option('--runner', help='module:function executing one search (default: count newly imported listings).')
+    @click.option('--once', is_flag=True, help='Exit once no search is due.')
+    def run_scheduler_command(workers, poll_interval, runner, once):
+        """Run due searches (safe to start several instances)"""
+        run_scheduler(app, load_runner(runner) if runner else count_new_listings,
+                      workers=workers, poll_interval=poll_interval, once=once)
+
+    @app.cli.command('send-mails')
+    @click.option('--connections', type=int, help='Persistent SMTP connections (default: MAIL_CONNECTIONS).')
+    @click.option('--batch-size', type=int, help='Mailings claimed per batch (default: MAIL_BATCH_SIZE).')
+    @click.option('--poll-interval', type=float, default=mailer.DEFAULT_POLL_INTERVAL, show_default=True,
+                  help='Seconds between polls when the queue is empty.')
+    @click.option('--once', is_flag=True, help='Exit once no mailing is due.')
+    def send_mails(connections, batch_size, poll_interval, once):
+        """Send queued mailings (safe to start several instances)"""
+        mailer.run_mail_sender(app, connections=connections or app.config['MAIL_CONNECTIONS'],
+                               batch_size=batch_size or app.config['MAIL_BATCH_SIZE'],
+                               poll_interval=poll_interval, once=once)
+
+    @app.cli.command('queue-followups')
+    @click.option('--batch-size', type=int, default=followups.DEFAULT_BATCH_SIZE, show_default=True,
+                  help='Threads per transaction.')
+    @click.option('--dry-run', is_flag=True, help='Only count the due follow-ups.')
+    def queue_followups(batch_size, dry_run):
+        """Queue the follow-ups due by each customer's sequence (safe to run from cron)"""
+        started = time.monotonic()
+        counts = followups.run_followups(batch_size, dry_run=dry_run, log=click.echo)
+        click.echo(f" {sum(queued for _, queued in counts.values())} follow-up(s) queued "
+                   f"({time.monotonic() - started:.1f}s)")
+
+    @app.cli.command('ingest-replies')
+    @click.argument('paths', nargs=-1, type=click.Path(exists=True))
+    @click.option('--batch-size', type=int, default=replies.DEFAULT_BATCH_SIZE, show_default=True,
+                  help='Messages per transaction.')
+    @click.option('--interval', type=float, default=0, help='Keep running, reading every INTERVAL seconds.')
+    def ingest_replies(paths, batch_size, interval):
+        """Record replies from Maildir directories / mbox files (default: REPLY_MAILBOXES)"""
+        paths = paths or app.config['REPLY_MAILBOXES']
+        if not paths:
+            raise click.UsageError('No mailbox given and REPLY_MAILBOXES is empty')
+
+        while True:
+            started = time.monotonic()
+            for path in paths:
+                counts = replies.ingest_mailbox(path, batch_size, log=click.echo)
+                click.echo(f" {path}: {counts['messages']} new message(s), {counts['matched']} matched, "
+                           f"{counts['replied']} mailing(s) replied ({time.monotonic() - started:.1f}s)")
+            if not interval:
+                break
+            time.sleep(interval)
+
+    @app.cli.command('build-plz-index')
+    @click.argument('geonames_path', type=click.Path(exists=True, dir_okay=False))
+    def build_plz_index(geonames_path):
+        """Build app/data/plz_centroids.tsv from the GeoNames DE.txt postal code dump"""
+        count = build_centroids_file(geonames_path)
+        click.echo(f" {count} postal code centroids written to {DATA_PATH}")
+
+    @app.cli.command('match-listings')
+    @click.option('--customer-id', type=int, help='Only match this customer\'s listings. Default: all.')
+    @click.option('--batch-size', type=int, default=5000, show_default=True, help='Listings per transaction.')
+    def match_listings(customer_id, batch_size):
+        """Re-match existing listings against all active searches"""
+        query = select(Listing.id).order_by(Listing.id).limit(batch_size)
+        if customer_id is not None:
+            query = query.where(Listing.customer_id == customer_id)
+
+        started = time.monotonic()
+        totals = {'listings': 0, 'matches': 0, 'assigned': 0}
+        last_id = 0
+        while True:
+            listing_ids = db.session.scalars(query.where(Listing.id > last_id)).all()
+            if not listing_ids:
+                break
+            counts = MatchingService.match_listings(listing_ids)
+            db.session.commit()
+            last_id = listing_ids[-1]
+            for key, value in counts.items():
+                totals[key] += value
+            click.echo(f" {totals['listings']} listings, {totals['matches']} matches, "
+                       f"{totals['assigned']} assigned to a search")
+
+        click.echo(f" Matching finished in {time.monotonic() - started:.1f}s")
+
+    @app.cli.command('group-listings')
+    @click.option('--customer-id', type=int, help='Only group this customer\'s listings. Default: all.')
+    @click.option('--batch-size', type=int, default=1000, show_default=True, help='Listings per transaction.')
+    def group_listings(customer_id, batch_size):
+        """Fingerprint existing listings and link cross-platform duplicates"""
+        query = select(Listing.id).order_by(Listing.id).limit(batch_size)
+        if customer_id is not None:
+            query = query.where(Listing.customer_id == customer_id)
+
+        started = time.monotonic()
+        totals = {'listings': 0, 'grouped': 0}
+        last_id = 0
+        while True:
+            listing_ids = db.session.scalars(query.where(Listing.id > last_id)).all()
+            if not listing_ids:
+                break
+            counts = DedupService.group_listings(listing_ids)
+            db.session.commit()
+            last_id = listing_ids[-1]
+            for key, value in counts.items():
+                totals[key] += value
+            click.echo(f" {totals['listings']} listings, {totals['grouped']} linked to a duplicate group")
+
+        click.echo(f" Grouping finished in {time.monotonic() - started:.1f}s")
+
+    @app.cli.command('export-template')
+    @click.argument('output', type=click.Path(dir_okay=False, writable=True))
+    @click.option('--customer-id', type=int, required=True, help='Customer the messages are sent for.')
+    @click.option('--name', default='initial', show_default=True, help='Template to export.')
+    def export_template(output, customer_id, name):
+        """Write a customer's current template and signature for the contact bot (immometricabot.py --template)"""
+        try:
+            exported = TemplateService.export_template(name, customer_id)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(exported, f, ensure_ascii=False, indent=2)
+        click.echo(f" '{name}' v{exported['version']} for customer {customer_id} written to {output}")
+
+    @app.cli.command('import-offers')
+    @click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--customer-id', type=int, required=True, help='Customer the listings belong to.')
+    @click.option('--search-id', type=int, help='Search the export was produced by.')
+    @click.option('--batch-size', type=int, default=ListingService.BULK_CHUNK_SIZE, show_default=True,
+                  help='Listings per transaction.')
+    @click.option('--delimiter', default=';', show_default=True, help='CSV field separator.')
+    @click.option('--encoding', default='utf-8-sig', show_default=True, help='CSV file encoding.')
+    def import_offers(csv_path, customer_id, search_id, batch_size, delimiter, encoding):
+        """Import an ImmoMetrica offers.csv export straight into the listings table"""
+        if db.session.get(Customer, customer_id) is None:
+            raise click.ClickException(f"Customer with ID {customer_id} not found")
+        if search_id is not None:
+            search = db.session.get(Search, search_id)
+            if search is None:
+                raise click.ClickException(f"Search with ID {search_id} not found")
+            if search.customer_id != customer_id:
+                raise click.ClickException(f"Search {search_id} does not belong to customer {customer_id}")
+
+        stats = {'created': 0, 'updated': 0, 'rejected': 0, 'duplicates': 0}
+        offers = iter_offers(csv_path, delimiter=delimiter, encoding=encoding)
+        rows = offer_rows(offers, customer_id, search_id, stats)
+        started = time.monotonic()
+        processed = 0
+
+        click.echo(f" Importing {csv_path} for customer {customer_id} (batches of {batch_size})")
+        while True:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                break
+
+            for result in ListingService.bulk_upsert_listings(batch, chunk_size=batch_size):
+                stats[result['status']] += 1
+                if result['status'] == 'rejected':
+                    click.echo(f" ✗ {batch[result['index']]['url']}: {result['error']}", err=True)
+
+            processed += len(batch)
+            elapsed = time.monotonic() - started
+            click.echo(f" {processed} listings ({processed / elapsed if elapsed else 0:.0f} rows/s) - "
+                       f"{stats['created']} created, {stats['updated']} updated, {stats['rejected']} rejected")
+
+        elapsed = time.monotonic() - started
+        click.echo(f" Import finished in {elapsed:.1f}s: {processed} listings, "
+                   f"{stats['created']} created, {stats['updated']} updated, {stats['rejected']} rejected, "
+                   f"{stats['duplicates']} duplicate links skipped")
@@ -21,4 +21,29 @@ def init_database(app):
 
         except Exception as e:
             print(f" Error creating tables: {e}")
-            raise
\ No newline at end of file
+            raise
+
+
+def upsert(table, index_elements, build_set):
+    """
+    Build an INSERT that updates the existing row on a unique key conflict.
+
+    Uses ON DUPLICATE KEY UPDATE on MySQL and ON CONFLICT DO UPDATE elsewhere
+    (SQLite in local runs). `build_set` receives the incoming-row proxy
+    (`inserted` / `excluded`) and returns the SET clause as a dict. Execute it
+    with a list of parameter dicts: SQLAlchemy batches those into multi-row
+    VALUES statements while compiling the statement only once.
+    """
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(table)
+        return stmt.on_duplicate_key_update(build_set(stmt.inserted))
+
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(index_elements=index_elements, set_=build_set(stmt.excluded))
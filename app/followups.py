@@ -0,0 +1,223 @@
+# app/followups.py
+"""
+Follow-up sequencer.
+
+A sequence is a list of steps, each sent `after_days` after the previous
+mailing of the thread (the mailings of one listing):
+
+    [{'type': 'followup_1', 'after_days': 7}, {'type': 'followup_2', 'after_days': 14}]
+
+Customers follow the sequence of their subscription tier (SEQUENCES) unless
+Customer.followup_sequence overrides it ([] turns follow-ups off).
+
+`flask queue-followups` runs one set-based query per step and sequence: the
+threads whose last mailing is of the step's previous type ('initial' for
+the first step), was delivered at least after_days ago without a reply, and
+whose listing is still 'contacted'. Due follow-ups are rendered from the
+customer's template named like the step and queued in bulk for the sender
+(app/mailer.py), keyset-batched over mailing ids.
+
+Mailing.follows_id is unique: a mailing gets at most one follow-up, even
+when two sequencer runs overlap. A queued follow-up is the thread's last
+mailing, so the previous one is not due again.
+"""
+
+import json
+from datetime import datetime, timedelta, timezone
+from email.utils import make_msgid
+
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import aliased
+
+import message_templates
+from .database import db, upsert
+from .models import Customer, Listing, Mailing
+
+DEFAULT_BATCH_SIZE = 5000
+
+# Customer ids per IN filter of a customer-specific sequence
+LOOKUP_CHUNK_SIZE = 1000
+
+MAX_STEPS = 5
+MAX_AFTER_DAYS = 365
+
+# Default sequence per subscription tier
+SEQUENCES = {
+    'BASIC': [
+        {'type': 'followup_1', 'after_days': 7},
+    ],
+    'PRO': [
+        {'type': 'followup_1', 'after_days': 7},
+        {'type': 'followup_2', 'after_days': 14},
+    ],
+    'ENTERPRISE': [
+        {'type': 'followup_1', 'after_days': 5},
+        {'type': 'followup_2', 'after_days': 10},
+    ],
+}
+
+# Mailing statuses a follow-up may answer (not queued, failed or replied)
+FOLLOWABLE_STATUSES = ('sent', 'delivered', 'opened', 'clicked')
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def validate_sequence(steps):
+    """Normalized copy of a sequence, ValueError when it is malformed"""
+    if not isinstance(steps, list) or len(steps) > MAX_STEPS:
+        raise ValueError(f"followup_sequence must be a list of at most {MAX_STEPS} steps")
+
+    normalized = []
+    for step in steps:
+        mailing_type = step.get('type') if isinstance(step, dict) else None
+        after_days = step.get('after_days') if isinstance(step, dict) else None
+        if not isinstance(mailing_type, str) or not mailing_type.strip() or mailing_type.strip() == 'initial':
+            raise ValueError("Every follow-up step needs a 'type' (its template name) other than 'initial'")
+        if isinstance(after_days, bool) or not isinstance(after_days, int) or not 0 < after_days <= MAX_AFTER_DAYS:
+            raise ValueError(f"'after_days' must be a whole number between 1 and {MAX_AFTER_DAYS}")
+        normalized.append({'type': mailing_type.strip(), 'after_days': after_days})
+
+    types = [step['type'] for step in normalized]
+    if len(set(types)) != len(types):
+        raise ValueError("Follow-up step types must be distinct")
+    return normalized
+
+
+def sequence_scopes():
+    """
+    [(steps, customer filter)]: one scope per tier default plus one per
+    distinct customer override (customer ids chunked for IN filters)
+    """
+    scopes = [
+        (steps, (Customer.subscription_tier == tier, Customer.followup_sequence.is_(None)))
+        for tier, steps in SEQUENCES.items()
+    ]
+
+    overrides = {}
+    for customer_id, sequence in db.session.execute(
+        select(Customer.id, Customer.followup_sequence).where(Customer.followup_sequence.is_not(None))
+    ):
+        steps = validate_sequence(json.loads(sequence) if isinstance(sequence, str) else sequence)
+        key = tuple((step['type'], step['after_days']) for step in steps)
+        overrides.setdefault(key, (steps, []))[1].append(customer_id)
+
+    for steps, customer_ids in overrides.values():
+        customer_ids.sort()
+        for start in range(0, len(customer_ids), LOOKUP_CHUNK_SIZE):
+            scopes.append((steps, (Mailing.customer_id.in_(customer_ids[start:start + LOOKUP_CHUNK_SIZE]),)))
+    return scopes
+
+
+def due_followups(previous_type, after_days, scope, now, after=None, limit=DEFAULT_BATCH_SIZE):
+    """
+    Threads due for the step after `previous_type`, as Core rows of the
+    mailing they follow (follows_id, sent_at, recipient, previous_subject)
+    plus TemplateService.CONTEXT_COLUMNS. Ordered by (sent_at, mailing id),
+    the order of ix_mailings_type_sent, starting after the key `after`.
+    """
+    from .services import TemplateService
+
+    later = aliased(Mailing)
+    key = tuple_(Mailing.sent_at, Mailing.id)
+    return db.session.execute(
+        select(Mailing.id.label('follows_id'), Mailing.sent_at, Mailing.recipient, Mailing.subject.label('previous_subject'),
+               Listing.contact_email, *TemplateService.CONTEXT_COLUMNS)
+        .join(Listing, Listing.id == Mailing.listing_id)
+        .join(Customer, Customer.id == Mailing.customer_id)
+        .where(
+            Mailing.type == previous_type,
+            Mailing.status.in_(FOLLOWABLE_STATUSES),
+            Mailing.sent_at <= now - timedelta(days=after_days),
+            Listing.status == 'contacted',
+            ~select(later.id).where(later.listing_id == Mailing.listing_id, later.id > Mailing.id).exists(),
+            key > tuple_(*after) if after else True,
+            *scope
+        )
+        .order_by(Mailing.sent_at, Mailing.id)
+        .limit(limit)
+    ).all()
+
+
+def queue_followups(rows, mailing_type, templates, now):
+    """
+    Render and queue follow-ups for due rows (caller commits). Rows without
+    a recipient or template are skipped. Returns the number queued.
+    """
+    from .services import MailService, StatsService, TemplateService
+
+    selected = {}
+    for row in rows:
+        if '@' not in (row.recipient or row.contact_email or ''):
+            continue
+        if row.customer_id not in templates:
+            templates[row.customer_id] = TemplateService.get_current(mailing_type, row.customer_id)
+        template = templates[row.customer_id]
+        if template is not None:
+            selected.setdefault(template.id, (template, []))[1].append(row)
+
+    domain = MailService._message_id_domain()
+    mailings = []
+    for template, template_rows in selected.values():
+        contexts = [TemplateService.listing_context(row) for row in template_rows]
+        subjects = message_templates.render_many(template.subject or '', contexts)
+        bodies = message_templates.render_many(template.body, contexts)
+        for row, subject, body in zip(template_rows, subjects, bodies):
+            mailings.append({
+                'listing_id': row.id, 'customer_id': row.customer_id, 'type': mailing_type,
+                'recipient': (row.recipient or row.contact_email).strip(),
+                'subject': subject or f"Re: {row.previous_subject or row.title}",
+                'content': body, 'message_id': make_msgid(domain=domain), 'template_id': template.id,
+                'follows_id': row.follows_id, 'status': 'queued', 'attempts': 0, 'created_at': now
+            })
+    if not mailings:
+        return 0
+
+    # A mailing another run has already followed up keeps that follow-up
+    table = Mailing.__table__
+    db.session.execute(upsert(table, ['follows_id'], lambda incoming: {'follows_id': table.c.follows_id}),
+                       mailings)
+
+    message_ids = sorted(mailing['message_id'] for mailing in mailings)
+    queued = 0
+    adjustments = []
+    for start in range(0, len(message_ids), LOOKUP_CHUNK_SIZE):
+        for customer_id, count in db.session.execute(
+            select(Mailing.customer_id, func.count())
+            .where(Mailing.message_id.in_(message_ids[start:start + LOOKUP_CHUNK_SIZE]))
+            .group_by(Mailing.customer_id)
+        ):
+            queued += count
+            adjustments.append((customer_id, 'mailing_status', 'queued', count))
+    StatsService.apply(adjustments)
+    return queued
+
+
+def run_followups(batch_size=DEFAULT_BATCH_SIZE, dry_run=False, log=print):
+    """Queue every due follow-up, one transaction per batch. Returns {step type: (due, queued)}."""
+    now = _now()
+    counts = {}
+    for steps, scope in sequence_scopes():
+        previous_type = 'initial'
+        for step in steps:
+            templates = {}
+            after = None
+            while True:
+                rows = due_followups(previous_type, step['after_days'], scope, now, after, batch_size)
+                if not rows:
+                    break
+                queued = 0 if dry_run else queue_followups(rows, step['type'], templates, now)
+                db.session.commit()
+
+                due, total = counts.get(step['type'], (0, 0))
+                counts[step['type']] = (due + len(rows), total + queued)
+                after = (rows[-1].sent_at, rows[-1].follows_id)
+                if len(rows) < batch_size:
+                    break
+            previous_type = step['type']
+
+    db.session.commit()
+    for mailing_type, (due, queued) in sorted(counts.items()):
+        log(f"   {mailing_type}: {due} due, {queued} queued")
+    return counts
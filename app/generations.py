@@ -0,0 +1,204 @@
+# app/generations.py
+"""
+Change generations: cheap validators for conditional GETs.
+
+Every commit that writes a tracked table bumps a counter per scope in the
+change_generations table, in the same transaction:
+
+- the table's scope ('listings') on every write
+- for per-customer tables also 'listings:<customer_id>' when the written
+  rows' customers are known (ORM objects, bulk inserts/upserts carrying
+  customer_id, statements declaring CUSTOMERS_OPTION), else 'listings:*'
+
+An endpoint's ETag is a hash of the generations it depends on, so an
+unchanged poll is answered from one primary-key SELECT, without running
+the main query or serializing anything (see `conditional` in app/api.py).
+A customer-filtered view depends on its customer's scope plus the '*' one.
+
+ORM writes are seen in after_flush, Core writes through the session
+(bulk inserts, upserts, UPDATE ... WHERE) in do_orm_execute. The counters
+are bumped in before_commit, so their row locks are held only for the
+commit itself. Writes on raw connections are not tracked.
+"""
+
+import hashlib
+from datetime import datetime, timezone
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from .database import db, upsert
+from .models import ChangeGeneration
+
+# Table -> scopes its writes bump
+TRACKED_TABLES = {
+    'listings': ('listings',),
+    'searches': ('searches',),
+    'customer_stats': ('customer_stats',),
+    'customers': ('customers',),
+    'customer_platforms': ('customers',),
+    'account_managers': ('account_managers',),
+    'account_manager_customers': ('customers', 'account_managers'),
+}
+
+# Scopes also counted per customer
+CUSTOMER_SCOPES = {'listings', 'searches', 'customer_stats'}
+
+# Scope of writes whose customers are unknown
+ANY_CUSTOMER = '*'
+
+# Execution option naming the customers a Core UPDATE/DELETE touches, e.g.
+# update(listings).where(...).execution_options(generation_customers={1, 2})
+CUSTOMERS_OPTION = 'generation_customers'
+
+_PENDING_KEY = 'generations_pending'
+_COMMITTING_KEY = 'generations_committing'
+
+# Callables run with the bumped scopes after each commit (see on_commit)
+_commit_listeners = []
+
+
+def customer_scope(scope, customer_id):
+    return f"{scope}:{customer_id}"
+
+
+def dependencies(scopes, customer_id=None):
+    """The generation scopes a view over `scopes` depends on, narrowed to one customer when given"""
+    if customer_id is None:
+        return sorted(set(scopes))
+    narrowed = set()
+    for scope in scopes:
+        if scope in CUSTOMER_SCOPES:
+            narrowed.update((customer_scope(scope, customer_id), customer_scope(scope, ANY_CUSTOMER)))
+        else:
+            narrowed.add(scope)
+    return sorted(narrowed)
+
+
+def current(scopes):
+    """{scope: (generation, updated_at)} of the given scopes (unwritten ones are missing)"""
+    return {
+        row.scope: (row.generation, row.updated_at)
+        for row in db.session.execute(
+            select(ChangeGeneration.scope, ChangeGeneration.generation, ChangeGeneration.updated_at)
+            .where(ChangeGeneration.scope.in_(scopes))
+        )
+    }
+
+
+def validator(scopes, variant=''):
+    """
+    (etag, last_modified) for a view over `scopes`; `variant` tells apart
+    the responses built from the same data (path, query string)
+    """
+    generations = current(scopes)
+    key = '|'.join([variant] + [f"{scope}={generations.get(scope, (0, None))[0]}" for scope in scopes])
+    etag = hashlib.blake2b(key.encode('utf-8'), digest_size=12).hexdigest()
+
+    modified = [updated_at for _, updated_at in generations.values() if updated_at is not None]
+    last_modified = max(modified) if modified else None
+    if last_modified is not None and last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return etag, last_modified
+
+
+def mark(session, table_name, customer_ids=None):
+    """Record a write on `table_name` for the session's next commit (customer_ids None = unknown)"""
+    scopes = TRACKED_TABLES.get(table_name)
+    if not scopes:
+        return
+    pending = session.info.setdefault(_PENDING_KEY, set())
+    for scope in scopes:
+        pending.add(scope)
+        if scope in CUSTOMER_SCOPES:
+            for customer_id in (customer_ids if customer_ids is not None else (ANY_CUSTOMER,)):
+                pending.add(customer_scope(scope, customer_id))
+
+
+def bump(session, scopes):
+    """Increment the generations of `scopes` inside the session's transaction"""
+    now = datetime.now(timezone.utc)
+    table = ChangeGeneration.__table__
+    stmt = upsert(table, ['scope'], lambda incoming: {
+        'generation': table.c.generation + 1, 'updated_at': incoming['updated_at']
+    })
+    # Sorted, so concurrent commits lock the rows in the same order
+    session.execute(stmt, [{'scope': scope, 'generation': 1, 'updated_at': now} for scope in sorted(scopes)])
+
+
+def on_commit(listener):
+    """Register listener(scopes), called in-process after every commit that bumped generations"""
+    _commit_listeners.append(listener)
+    return listener
+
+
+def _object_customers(obj):
+    """Current and previous customer_id of a flushed object (None when not loaded)"""
+    state = inspect(obj)
+    if 'customer_id' not in state.attrs:
+        return None
+    history = state.attrs.customer_id.history  # never loads
+    return {value for value in history.sum() if value is not None} or None
+
+
+def _statement_customers(orm_execute_state):
+    """Customers a Core statement declares or its INSERT rows carry, None when unknown"""
+    declared = orm_execute_state.execution_options.get(CUSTOMERS_OPTION)
+    if declared is not None:
+        return set(declared)
+    parameters = orm_execute_state.parameters
+    if not orm_execute_state.is_insert or not parameters:
+        return None
+    rows = parameters if isinstance(parameters, (list, tuple)) else [parameters]
+    customer_ids = set()
+    for row in rows:
+        customer_id = row.get('customer_id') if hasattr(row, 'get') else None
+        if customer_id is None:
+            return None
+        customer_ids.add(customer_id)
+    return customer_ids
+
+
+# ==================== #
+# SESSION EVENTS
+# ==================== #
+
+@event.listens_for(Session, 'after_flush')
+def _collect_flushed(session, flush_context):
+    for obj in session.new | session.deleted:
+        mark(session, obj.__table__.name, _object_customers(obj))
+    for obj in session.dirty:
+        if session.is_modified(obj):
+            mark(session, obj.__table__.name, _object_customers(obj))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_executed(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table_name = getattr(orm_execute_state.statement.table, 'name', None)
+    if table_name in TRACKED_TABLES:
+        mark(orm_execute_state.session, table_name, _statement_customers(orm_execute_state))
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_generations(session):
+    session.flush()
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        bump(session, pending)
+        session.info[_COMMITTING_KEY] = pending
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_listeners(session):
+    scopes = session.info.pop(_COMMITTING_KEY, None)
+    if scopes:
+        for listener in _commit_listeners:
+            listener(scopes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_COMMITTING_KEY, None)
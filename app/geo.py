@@ -0,0 +1,173 @@
+# app/geo.py
+"""
+Offline postal code (PLZ) radius lookups.
+
+Centroids of German postal codes are read from app/data/plz_centroids.tsv
+(tab separated: plz, lat, lon, place) into parallel arrays sorted by
+latitude. A radius query bisects the latitude band of the bounding box,
+prefilters on longitude and refines with the haversine distance, so it never
+touches more than a few hundred of the ~8,200 codes.
+
+The data file is generated from the GeoNames postal code dump (DE.txt from
+https://download.geonames.org/export/zip/DE.zip, CC BY 4.0) with
+`flask build-plz-index DE.txt`.
+
+Without the data, radius filters (and the search matcher, also for a PLZ
+the data lacks) fall back to the postal region: German postal codes are assigned geographically, so codes
+sharing a prefix are neighbours. `region_prefix` picks a prefix length that
+roughly covers the radius; it is an approximation and yields no distances.
+"""
+
+import csv
+import math
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+
+DATA_PATH = Path(__file__).parent / 'data' / 'plz_centroids.tsv'
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.195
+MAX_RADIUS_KM = 500
+
+# (max radius km, prefix digits) for the region fallback: 3 digits ~ a town and
+# its surroundings, 2 a Leitregion, 1 a Leitzone; beyond that, all of Germany
+REGION_PREFIXES = ((15, 3), (60, 2), (200, 1))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class PostalCodeIndex:
+    """PLZ centroids in latitude order with a code -> position map"""
+
+    def __init__(self, rows=()):
+        rows = sorted(rows, key=lambda row: row[1])
+        self.codes = [code for code, _, _, _ in rows]
+        self.places = [place for _, _, _, place in rows]
+        self.lats = array('d', (lat for _, lat, _, _ in rows))
+        self.lons = array('d', (lon for _, _, lon, _ in rows))
+        self.positions = {code: i for i, code in enumerate(self.codes)}
+
+    @classmethod
+    def load(cls, path=DATA_PATH):
+        rows = []
+        with open(path, encoding='utf-8', newline='') as f:
+            for row in csv.reader(f, delimiter='\t'):
+                if not row or row[0].startswith('#') or row[0] == 'plz':
+                    continue
+                rows.append((row[0], float(row[1]), float(row[2]), row[3] if len(row) > 3 else None))
+        return cls(rows)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.positions
+
+    def centroid(self, code):
+        """(lat, lon) of a postal code, None when unknown"""
+        position = self.positions.get(code)
+        if position is None:
+            return None
+        return self.lats[position], self.lons[position]
+
+    def place(self, code):
+        position = self.positions.get(code)
+        return self.places[position] if position is not None else None
+
+    def within(self, code, radius_km):
+        """{plz: distance_km} of every postal code whose centroid lies within radius_km of `code`"""
+        center = self.centroid(code)
+        if center is None:
+            raise ValueError(f"Unknown postal code: {code}")
+        return self.within_point(center[0], center[1], radius_km)
+
+    def within_point(self, lat, lon, radius_km):
+        """{plz: distance_km} around a coordinate"""
+        delta_lat = radius_km / KM_PER_DEGREE_LAT
+        delta_lon = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+
+        start = bisect_left(self.lats, lat - delta_lat)
+        end = bisect_right(self.lats, lat + delta_lat)
+
+        found = {}
+        for position in range(start, end):
+            other_lon = self.lons[position]
+            if abs(other_lon - lon) > delta_lon:
+                continue
+            distance = haversine_km(lat, lon, self.lats[position], other_lon)
+            if distance <= radius_km:
+                found[self.codes[position]] = round(distance, 1)
+        return found
+
+
+def region_prefix(code, radius_km):
+    """Postal code prefix approximating the area within radius_km of `code` ('' for all codes)"""
+    code = code.strip()
+    if not (len(code) == 5 and code.isdigit()):
+        raise ValueError(f"Invalid postal code: {code}")
+    for max_radius, digits in REGION_PREFIXES:
+        if radius_km <= max_radius:
+            return code[:digits]
+    return ''
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def postal_code_index():
+    """The shared index, loaded from DATA_PATH on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = PostalCodeIndex.load(DATA_PATH) if DATA_PATH.exists() else PostalCodeIndex()
+    return _index
+
+
+def reset_postal_code_index():
+    """Drop the cached index (after the data file was rebuilt)"""
+    global _index
+    _index = None
+
+
+def build_centroids_file(geonames_path, output_path=DATA_PATH):
+    """
+    Convert a GeoNames postal code dump (DE.txt) into the centroid file.
+    A PLZ listed for several places gets the mean of their coordinates.
+    Returns the number of postal codes written.
+    """
+    sums = {}
+    with open(geonames_path, encoding='utf-8', newline='') as f:
+        for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+            if len(row) < 11 or row[0] != 'DE':
+                continue
+            code, place = row[1], row[2]
+            try:
+                lat, lon = float(row[9]), float(row[10])
+            except ValueError:
+                continue
+            entry = sums.setdefault(code, [0.0, 0.0, 0, place])
+            entry[0] += lat
+            entry[1] += lon
+            entry[2] += 1
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+        writer.writerow(['plz', 'lat', 'lon', 'place'])
+        for code in sorted(sums):
+            lat_sum, lon_sum, count, place = sums[code]
+            writer.writerow([code, f"{lat_sum / count:.5f}", f"{lon_sum / count:.5f}", place])
+
+    reset_postal_code_index()
+    return len(sums)
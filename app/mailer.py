@@ -0,0 +1,401 @@
+# app/mailer.py
+"""
+Outbound mail queue sender.
+
+The API only queues mails (MailService.queue_mailing writes a Mailing with
+status 'queued'). `flask send-mails` drains the queue:
+
+- claims due mailings in batches by pushing next_attempt_at forward by a
+  lease, like the search scheduler, so several senders can run side by side
+- throttles per recipient domain (GCRA token bucket, per sender process);
+  only mails actually sent take a slot, the ones over the limit go back to
+  the queue with the time the next free slots open
+- sends over a pool of persistent SMTP connections, one per worker thread
+- retries transient failures (4xx replies, dropped connections) with
+  exponential backoff and gives up on 5xx replies or after max_attempts
+- writes the outcomes of a batch back with one executemany UPDATE
+
+A sender that dies mid-batch leaves the lease behind; its mailings are
+claimed again when the lease expires.
+"""
+
+import os
+import queue
+import random
+import signal
+import smtplib
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import formatdate
+
+from sqlalchemy import bindparam, or_, select, update
+from sqlalchemy.orm import aliased
+
+from .database import db
+from .models import Mailing
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_CONNECTIONS = 8
+DEFAULT_POLL_INTERVAL = 5.0
+DEFAULT_MAX_ATTEMPTS = 5
+
+# Seconds between throughput log lines
+REPORT_INTERVAL = 60.0
+
+# How long claimed mailings stay invisible to other senders
+CLAIM_LEASE = timedelta(minutes=10)
+
+# Retry n waits RETRY_BASE * 2^(n-1), at most RETRY_MAX, plus up to 20% jitter
+RETRY_BASE = timedelta(minutes=1)
+RETRY_MAX = timedelta(hours=2)
+
+# Servers commonly cap messages per session; reconnect before hitting the cap
+MAX_MESSAGES_PER_CONNECTION = 100
+
+_parent = aliased(Mailing)
+
+# A follow-up carries the Message-ID it answers, so it lands in the seller's thread
+CLAIM_COLUMNS = (Mailing.id, Mailing.customer_id, Mailing.recipient, Mailing.subject, Mailing.content,
+                 Mailing.message_id, Mailing.attempts,
+                 select(_parent.message_id).where(_parent.id == Mailing.follows_id).scalar_subquery()
+                 .label('parent_message_id'))
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def recipient_domain(address):
+    return (address or '').rpartition('@')[2].strip().lower()
+
+
+def retry_delay(attempts):
+    """Backoff before the next try after `attempts` failed ones"""
+    delay = min(RETRY_BASE * 2 ** max(attempts - 1, 0), RETRY_MAX)
+    return delay + delay * random.uniform(0, 0.2)
+
+
+def _due_filter(now):
+    return Mailing.status == 'queued', or_(Mailing.next_attempt_at.is_(None), Mailing.next_attempt_at <= now)
+
+
+def claim_due_mailings(limit, lease=CLAIM_LEASE):
+    """Claim up to `limit` due mailings for this process, oldest first, as Core rows"""
+    if limit <= 0:
+        return []
+
+    now = _now()
+    lease_until = now + lease
+    dialect = db.session.get_bind().dialect.name
+    candidates = select(*CLAIM_COLUMNS).where(*_due_filter(now)).order_by(Mailing.id).limit(limit)
+
+    if dialect in ('mysql', 'postgresql'):
+        rows = db.session.execute(candidates.with_for_update(skip_locked=True)).all()
+        if rows:
+            db.session.execute(
+                update(Mailing).where(Mailing.id.in_([row.id for row in rows])).values(next_attempt_at=lease_until)
+            )
+        db.session.commit()
+        return rows
+
+    # Compare-and-set, see claim_due_searches
+    claimed = []
+    for row in db.session.execute(candidates).all():
+        result = db.session.execute(
+            update(Mailing).where(Mailing.id == row.id, *_due_filter(now)).values(next_attempt_at=lease_until)
+        )
+        if result.rowcount == 1:
+            claimed.append(row)
+    db.session.commit()
+    return claimed
+
+
+class DomainThrottle:
+    """
+    Per-domain rate limit (generic cell rate algorithm): `rate` mails per
+    minute sustained, up to `burst` at once. Only a mail that gets a slot
+    moves the domain's clock; mails kept waiting don't, so deferring them
+    again and again can't push the domain's slots further into the future.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.interval = 60.0 / rate if rate else 0.0
+        self.tolerance = self.interval * (max(burst, 1) - 1)
+        self.arrivals = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, domain, now=None, waiting=0):
+        """
+        Take a slot for a mail to `domain` when one is free (returns 0). Else
+        reserve nothing and return the seconds until the slot after the
+        `waiting` mails already deferred opens, so those come back spread out.
+        """
+        if not self.interval:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            arrival = max(self.arrivals.get(domain, now), now)
+            wait = arrival - self.tolerance - now
+            if wait <= 0:
+                self.arrivals[domain] = arrival + self.interval
+                return 0.0
+            return wait + waiting * self.interval
+
+
+class SMTPPool:
+    """Persistent SMTP connections, reused across batches until the server drops them"""
+
+    def __init__(self, host='localhost', port=25, username=None, password=None, starttls=False,
+                 timeout=30, max_messages=MAX_MESSAGES_PER_CONNECTION):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.idle = queue.LifoQueue()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['SMTP_HOST'], config['SMTP_PORT'], config.get('SMTP_USERNAME'),
+                   config.get('SMTP_PASSWORD'), config.get('SMTP_STARTTLS', False))
+
+    def open(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password)
+        connection.sent = 0
+        return connection
+
+    def acquire(self):
+        """The most recently used idle connection, or a new one"""
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self.open()
+
+    def release(self, connection):
+        if connection.sent >= self.max_messages:
+            self.discard(connection, polite=True)
+        else:
+            self.idle.put(connection)
+
+    def discard(self, connection, polite=False):
+        try:
+            connection.quit() if polite else connection.close()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    def close(self):
+        while True:
+            try:
+                self.discard(self.idle.get_nowait(), polite=True)
+            except queue.Empty:
+                return
+
+
+def is_permanent(error):
+    """5xx replies will fail again; everything else (4xx, network) is worth a retry"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+class MailSender:
+    """Poll loop claiming batches of queued mailings and sending them over an SMTPPool"""
+
+    def __init__(self, app, pool, sender_address, connections=DEFAULT_CONNECTIONS, batch_size=DEFAULT_BATCH_SIZE,
+                 throttle=None, max_attempts=DEFAULT_MAX_ATTEMPTS, poll_interval=DEFAULT_POLL_INTERVAL,
+                 lease=CLAIM_LEASE, log=print):
+        self.app = app
+        self.pool = pool
+        self.sender_address = sender_address
+        self.connections = connections
+        self.batch_size = batch_size
+        self.throttle = throttle or DomainThrottle(0)
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.log = log
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = threading.Event()
+        self.counts = {'sent': 0, 'retry': 0, 'error': 0, 'deferred': 0}
+        self.last_report = time.monotonic()
+
+    def stop(self, *_):
+        self.stopping.set()
+
+    def run(self, once=False):
+        """Send due mailings until stopped (or until nothing is due with once=True)"""
+        self.log(f" Mail sender {self.name}: {self.connections} connection(s) to "
+                 f"{self.pool.host}:{self.pool.port}, batches of {self.batch_size}")
+        with ThreadPoolExecutor(max_workers=self.connections) as workers:
+            while not self.stopping.is_set():
+                with self.app.app_context():
+                    rows = claim_due_mailings(self.batch_size, self.lease)
+                    if rows:
+                        self.send_batch(rows, workers)
+
+                if time.monotonic() - self.last_report >= REPORT_INTERVAL:
+                    self._report()
+
+                if len(rows) < self.batch_size:
+                    if once:
+                        break
+                    self.stopping.wait(self.poll_interval)
+
+        self.pool.close()
+        self._report()
+        self.log(f" Mail sender {self.name} stopped")
+
+    def send_batch(self, rows, workers):
+        """Throttle, send and record one claimed batch"""
+        now = _now()
+        clock = time.monotonic()
+        ready, deferred = [], []
+        waiting = {}
+        for row in rows:
+            domain = recipient_domain(row.recipient)
+            wait = self.throttle.acquire(domain, clock, waiting.get(domain, 0))
+            if wait:
+                waiting[domain] = waiting.get(domain, 0) + 1
+                deferred.append({'mailing_id': row.id, 'due_at': now + timedelta(seconds=wait)})
+            else:
+                ready.append(row)
+
+        # Round-robin so every connection gets a share of the batch
+        chunks = [ready[i::self.connections] for i in range(self.connections)]
+        outcomes = [outcome for chunk_outcomes in workers.map(self._send_chunk, chunks)
+                    for outcome in chunk_outcomes]
+
+        self.record(outcomes, deferred)
+        self.counts['deferred'] += len(deferred)
+        for outcome in outcomes:
+            self.counts[outcome['kind']] += 1
+
+    def _send_chunk(self, rows):
+        outcomes = []
+        connection = None
+        for position, row in enumerate(rows):
+            try:
+                if connection is None:
+                    connection = self.pool.acquire()
+                try:
+                    self._deliver(connection, row)
+                except smtplib.SMTPServerDisconnected:
+                    # The server closed the pooled connection while it sat idle: reconnect once
+                    self.pool.discard(connection)
+                    connection = None
+                    connection = self.pool.open()
+                    self._deliver(connection, row)
+            except (smtplib.SMTPException, OSError) as e:
+                outcomes.append(self._failure(row, e))
+                if connection is None:
+                    # Could not connect: fail the rest now instead of waiting out a timeout per mail
+                    outcomes.extend(self._failure(other, e) for other in rows[position + 1:])
+                    break
+                connection = self._reset(connection, e)
+            else:
+                outcomes.append(self._success(row))
+
+        if connection is not None:
+            self.pool.release(connection)
+        return outcomes
+
+    def _reset(self, connection, error):
+        """Keep a connection whose server rejected a mail; drop one that failed otherwise"""
+        if isinstance(error, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+            try:
+                connection.rset()
+                return connection
+            except (smtplib.SMTPException, OSError):
+                pass
+        self.pool.discard(connection)
+        return None
+
+    def _deliver(self, connection, row):
+        message = EmailMessage()
+        message['From'] = self.sender_address
+        message['To'] = row.recipient
+        message['Subject'] = row.subject or ''
+        message['Date'] = formatdate(localtime=True)
+        if row.message_id:
+            message['Message-ID'] = row.message_id
+        if row.parent_message_id:
+            message['In-Reply-To'] = row.parent_message_id
+            message['References'] = row.parent_message_id
+        message.set_content(row.content)
+        connection.send_message(message, self.sender_address, [row.recipient])
+        connection.sent += 1
+
+    def _success(self, row):
+        return {'mailing_id': row.id, 'customer_id': row.customer_id, 'kind': 'sent', 'new_status': 'sent',
+                'sent_at': _now(), 'attempts': (row.attempts or 0) + 1, 'due_at': None, 'error': None}
+
+    def _failure(self, row, error):
+        attempts = (row.attempts or 0) + 1
+        message = f"{type(error).__name__}: {error}"[:1000]
+        if is_permanent(error) or attempts >= self.max_attempts:
+            return {'mailing_id': row.id, 'customer_id': row.customer_id, 'kind': 'error', 'new_status': 'error',
+                    'sent_at': None, 'attempts': attempts, 'due_at': None, 'error': message}
+        return {'mailing_id': row.id, 'customer_id': row.customer_id, 'kind': 'retry', 'new_status': 'queued',
+                'sent_at': None, 'attempts': attempts, 'due_at': _now() + retry_delay(attempts), 'error': message}
+
+    def record(self, outcomes, deferred):
+        """Write a batch's outcomes and deferrals in one transaction"""
+        from .services import StatsService
+
+        table = Mailing.__table__
+        if outcomes:
+            db.session.execute(
+                update(table).where(table.c.id == bindparam('mailing_id')).values(
+                    status=bindparam('new_status'), sent_at=bindparam('sent_at'), attempts=bindparam('attempts'),
+                    next_attempt_at=bindparam('due_at'), error=bindparam('error')
+                ),
+                outcomes
+            )
+        if deferred:
+            db.session.execute(
+                update(table).where(table.c.id == bindparam('mailing_id')).values(next_attempt_at=bindparam('due_at')),
+                deferred
+            )
+
+        adjustments = []
+        for outcome in outcomes:
+            if outcome['new_status'] != 'queued':
+                adjustments.append((outcome['customer_id'], 'mailing_status', 'queued', -1))
+                adjustments.append((outcome['customer_id'], 'mailing_status', outcome['new_status'], 1))
+        StatsService.apply(adjustments)
+        db.session.commit()
+
+    def _report(self):
+        counts, self.counts = self.counts, dict.fromkeys(self.counts, 0)
+        elapsed = time.monotonic() - self.last_report
+        self.last_report = time.monotonic()
+        if any(counts.values()):
+            self.log(f" sent {counts['sent']} ({counts['sent'] / elapsed * 60:.0f}/min), "
+                     f"{counts['retry']} to retry, {counts['error']} failed, {counts['deferred']} throttled")
+
+
+def run_mail_sender(app, connections=DEFAULT_CONNECTIONS, batch_size=DEFAULT_BATCH_SIZE,
+                    poll_interval=DEFAULT_POLL_INTERVAL, once=False):
+    """Run a MailSender configured from app.config, stopping cleanly on SIGINT/SIGTERM"""
+    config = app.config
+    sender = MailSender(
+        app, SMTPPool.from_config(config), config['MAIL_FROM'], connections=connections, batch_size=batch_size,
+        throttle=DomainThrottle(config['MAIL_DOMAIN_RATE'], config['MAIL_DOMAIN_BURST']),
+        max_attempts=config['MAIL_MAX_ATTEMPTS'], poll_interval=poll_interval
+    )
+    signal.signal(signal.SIGINT, sender.stop)
+    signal.signal(signal.SIGTERM, sender.stop)
+    sender.run(once=once)
+    return sender
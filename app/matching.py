@@ -0,0 +1,415 @@
+# app/matching.py
+"""
+Reverse matching: which active searches does an incoming listing satisfy?
+
+Instead of testing every search against every listing, searches are
+indexed once (a percolator) and each listing only looks at the few that
+can possibly match:
+
+- platform and property type buckets (plus the searches accepting any)
+- price: geometric price bands; a sorted interval list answers which
+  searches' [price_min, price_max] overlap a band
+- location: grid cells covering each search's radius around its PLZ; a
+  PLZ without centroid data (e.g. plz_centroids.tsv not built) falls back
+  to its postal region (geo.region_prefix), checked on verification
+
+Bucket intersections are cached per (platform, type, band), so a batch only
+computes them once per distinct combination; the survivors are verified
+exactly (price, units, distance, custom_filters).
+
+Matching is strict: a listing value the search constrains but the listing
+does not have (no price, postal code not within the radius or region) does
+not match. custom_filters
+understands min_<field>/max_<field> for numeric listing fields and
+`cities`/`postal_codes` lists (postal codes match by prefix).
+
+The index is built lazily per app and kept in sync by session events like
+app/autocomplete.py; other processes' changes are picked up by a rebuild
+once it is older than MATCHING_REFRESH_SECONDS.
+"""
+
+import json
+import math
+import threading
+import time
+from bisect import bisect_right, insort
+from collections import namedtuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from .database import db
+from .geo import EARTH_RADIUS_KM, KM_PER_DEGREE_LAT, MAX_RADIUS_KM, postal_code_index, region_prefix
+from .models import Listing, Search
+
+DEFAULT_RADIUS_KM = 50
+
+# Width of a price band: prices within 25% of each other share a band
+PRICE_BAND_RATIO = 1.25
+MAX_BAND = 200
+
+# Grid cell size in degrees (roughly 28 x 28 km in Germany)
+CELL_LAT = 0.25
+CELL_LON = 0.4
+
+# Listing fields custom_filters may bound with min_<field> / max_<field>
+NUMERIC_FILTER_FIELDS = ('price', 'price_per_sqm', 'living_area', 'rooms', 'units', 'year_built')
+
+# Listing columns the matcher reads
+LISTING_COLUMNS = (Listing.id, Listing.customer_id, Listing.search_id, Listing.platform,
+                   Listing.property_type, Listing.postal_code, Listing.city,
+                   *(getattr(Listing, field) for field in NUMERIC_FILTER_FIELDS))
+
+SEARCH_COLUMNS = (Search.id, Search.customer_id, Search.is_active, Search.location_postcode, Search.radius_km,
+                  Search.price_min, Search.price_max, Search.min_units, Search.property_types,
+                  Search.platforms, Search.custom_filters)
+
+_PENDING_KEY = 'matching_pending'
+
+# A search reduced to what matching needs
+Rule = namedtuple('Rule', 'id customer_id platforms types price_min price_max min_units point reach radius_km '
+                          'bounds cities postal_codes region cells band_low band_high')
+
+
+def _json(value, default):
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return default
+    return value if value is not None else default
+
+
+def _fold(value):
+    return value.strip().casefold() if isinstance(value, str) and value.strip() else None
+
+
+def _number(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def price_band(price):
+    return min(MAX_BAND, int(math.log(max(price, 1.0)) / math.log(PRICE_BAND_RATIO)))
+
+
+def cell(lat, lon):
+    return math.floor(lat / CELL_LAT), math.floor(lon / CELL_LON)
+
+
+def point(lat, lon):
+    """(lat, lon, cos lat) in radians, what the haversine test needs per coordinate"""
+    lat, lon = math.radians(lat), math.radians(lon)
+    return lat, lon, math.cos(lat)
+
+
+def reach(radius_km):
+    """Haversine of a radius: points closer than radius_km have a smaller haversine term"""
+    return math.sin(radius_km / (2 * EARTH_RADIUS_KM)) ** 2
+
+
+def cells_within(lat, lon, radius_km):
+    """Grid cells touching the bounding box of a circle"""
+    delta_lat = radius_km / KM_PER_DEGREE_LAT
+    delta_lon = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+    lat_low, lon_low = cell(lat - delta_lat, lon - delta_lon)
+    lat_high, lon_high = cell(lat + delta_lat, lon + delta_lon)
+    return [(i, j) for i in range(lat_low, lat_high + 1) for j in range(lon_low, lon_high + 1)]
+
+
+def search_rule(values, postal_codes=None):
+    """Build the Rule of one search row (mapping of SEARCH_COLUMNS); None for inactive searches"""
+    if not values['is_active']:
+        return None
+    postal_codes = postal_codes if postal_codes is not None else postal_code_index()
+
+    platforms = frozenset(filter(None, map(_fold, _json(values['platforms'], [])))) or None
+    types = frozenset(filter(None, map(_fold, _json(values['property_types'], [])))) or None
+    price_min = _number(values['price_min'])
+    price_max = _number(values['price_max'])
+    min_units = values['min_units'] if values['min_units'] and values['min_units'] > 1 else None
+
+    center = radius_km = region = None
+    cells = ()
+    if values['location_postcode']:
+        radius_km = min(values['radius_km'] or DEFAULT_RADIUS_KM, MAX_RADIUS_KM)
+        postcode = values['location_postcode'].strip()
+        centroid = postal_codes.centroid(postcode)
+        if centroid is not None:
+            cells = cells_within(centroid[0], centroid[1], radius_km)
+            center = point(*centroid)
+        else:
+            # Not located: match its postal region instead (a malformed PLZ only matches itself)
+            try:
+                region = region_prefix(postcode, radius_km)
+            except ValueError:
+                region = postcode
+            radius_km = None
+
+    custom = _json(values['custom_filters'], {})
+    custom = custom if isinstance(custom, dict) else {}
+    bounds = []
+    for field in NUMERIC_FILTER_FIELDS:
+        low, high = _number(custom.get(f'min_{field}')), _number(custom.get(f'max_{field}'))
+        if low is not None or high is not None:
+            bounds.append((field, low, high))
+    cities = frozenset(filter(None, map(_fold, custom.get('cities') or []))) or None
+    prefixes = tuple(str(code).strip() for code in custom.get('postal_codes') or [] if str(code).strip()) or None
+
+    band_low = band_high = None
+    if price_min is not None or price_max is not None:
+        band_low = price_band(price_min) if price_min is not None else 0
+        band_high = price_band(price_max) if price_max is not None else MAX_BAND
+
+    return Rule(values['id'], values['customer_id'], platforms, types, price_min, price_max, min_units,
+                center, reach(radius_km) if radius_km else None, radius_km, tuple(bounds), cities, prefixes,
+                region, cells, band_low, band_high)
+
+
+class Percolator:
+    """Searches indexed for matching listings against them; thread-safe"""
+
+    def __init__(self, postal_codes=None):
+        self.postal_codes = postal_codes if postal_codes is not None else postal_code_index()
+        self.rules = {}
+        self.by_platform = {}
+        self.any_platform = set()
+        self.by_type = {}
+        self.any_type = set()
+        self.price_lows = []        # sorted (band_low, id) of searches with a price range
+        self.price_highs = {}       # id -> band_high
+        self.no_price = set()
+        self.by_cell = {}
+        self.no_location = set()
+        self.kinds = {}             # (platform, type) -> searches accepting both
+        self.bands = {}             # band -> searches accepting prices in it
+        self.combos = {}            # (platform, type, band) -> (candidates, candidates without location)
+        self.built_at = 0.0
+        self.lock = threading.RLock()
+
+    @classmethod
+    def build(cls, batch_size=5000):
+        """Load every active search from the database"""
+        percolator = cls()
+        stmt = select(*SEARCH_COLUMNS).where(Search.is_active.is_(True))
+        for row in db.session.execute(stmt, execution_options={'yield_per': batch_size}).mappings():
+            percolator.add(row)
+        percolator.built_at = time.monotonic()
+        return percolator
+
+    def __len__(self):
+        return len(self.rules)
+
+    def add(self, values):
+        """Index (or re-index) one search row"""
+        with self.lock:
+            self.remove(values['id'])
+            rule = search_rule(values, self.postal_codes)
+            if rule is None:
+                return
+
+            self.rules[rule.id] = rule
+            for value in rule.platforms or ():
+                self.by_platform.setdefault(value, set()).add(rule.id)
+            if rule.platforms is None:
+                self.any_platform.add(rule.id)
+            for value in rule.types or ():
+                self.by_type.setdefault(value, set()).add(rule.id)
+            if rule.types is None:
+                self.any_type.add(rule.id)
+
+            if rule.band_low is None:
+                self.no_price.add(rule.id)
+            else:
+                insort(self.price_lows, (rule.band_low, rule.id))
+                self.price_highs[rule.id] = rule.band_high
+
+            if rule.radius_km is None:
+                self.no_location.add(rule.id)
+            for key in rule.cells:
+                self.by_cell.setdefault(key, set()).add(rule.id)
+
+            self._clear_caches()
+
+    def remove(self, search_id):
+        with self.lock:
+            rule = self.rules.pop(search_id, None)
+            if rule is None:
+                return
+
+            for value in rule.platforms or ():
+                self.by_platform[value].discard(rule.id)
+            self.any_platform.discard(rule.id)
+            for value in rule.types or ():
+                self.by_type[value].discard(rule.id)
+            self.any_type.discard(rule.id)
+
+            self.no_price.discard(rule.id)
+            if rule.band_low is not None:
+                self.price_lows.remove((rule.band_low, rule.id))
+                del self.price_highs[rule.id]
+
+            self.no_location.discard(rule.id)
+            for key in rule.cells:
+                self.by_cell[key].discard(rule.id)
+
+            self._clear_caches()
+
+    def _clear_caches(self):
+        self.kinds.clear()
+        self.bands.clear()
+        self.combos.clear()
+
+    def _kind_candidates(self, platform, property_type):
+        key = (platform, property_type)
+        found = self.kinds.get(key)
+        if found is None:
+            platforms = self.any_platform | self.by_platform.get(platform, set()) if platform else self.any_platform
+            types = self.any_type | self.by_type.get(property_type, set()) if property_type else self.any_type
+            found = self.kinds[key] = platforms & types
+        return found
+
+    def _band_candidates(self, band):
+        if band is None:
+            return self.no_price
+        found = self.bands.get(band)
+        if found is None:
+            # Searches starting at or below the band that also end at or above it
+            end = bisect_right(self.price_lows, (band, math.inf))
+            found = {search_id for _, search_id in self.price_lows[:end] if self.price_highs[search_id] >= band}
+            found |= self.no_price
+            self.bands[band] = found
+        return found
+
+    def _candidates(self, platform, property_type, band):
+        """Searches whose platform, type and price band admit the listing, with and without a location"""
+        key = (platform, property_type, band)
+        combo = self.combos.get(key)
+        if combo is None:
+            found = self._kind_candidates(platform, property_type) & self._band_candidates(band)
+            combo = self.combos[key] = (found, found & self.no_location)
+        return combo
+
+    def match(self, listing):
+        """Rules of the searches a listing (mapping of LISTING_COLUMNS) satisfies"""
+        price = _number(listing['price'])
+        band = price_band(price) if price is not None else None
+        postal_code = (listing['postal_code'] or '').strip()
+        centroid = self.postal_codes.centroid(postal_code) if postal_code else None
+        location = point(*centroid) if centroid is not None else None
+
+        with self.lock:
+            found, anywhere = self._candidates(_fold(listing['platform']), _fold(listing['property_type']), band)
+            candidates = list(anywhere)
+            if location is not None:
+                candidates.extend(found & self.by_cell.get(cell(*centroid), set()))
+            return [rule for rule in map(self.rules.get, candidates)
+                    if self._verify(rule, listing, price, postal_code, location)]
+
+    @staticmethod
+    def _verify(rule, listing, price, postal_code, location):
+        """Exact check of the constraints the buckets only approximate"""
+        if rule.price_min is not None and price < rule.price_min:
+            return False
+        if rule.price_max is not None and price > rule.price_max:
+            return False
+        if rule.min_units is not None and (listing['units'] is None or listing['units'] < rule.min_units):
+            return False
+        if rule.point is not None:
+            lat, lon, cos_lat = rule.point
+            other_lat, other_lon, other_cos_lat = location
+            distance = (math.sin((other_lat - lat) / 2) ** 2
+                        + cos_lat * other_cos_lat * math.sin((other_lon - lon) / 2) ** 2)
+            if distance > rule.reach:
+                return False
+        for field, low, high in rule.bounds:
+            value = _number(listing[field])
+            if value is None or (low is not None and value < low) or (high is not None and value > high):
+                return False
+        if rule.cities is not None and _fold(listing['city']) not in rule.cities:
+            return False
+        if rule.postal_codes is not None and not postal_code.startswith(rule.postal_codes):
+            return False
+        if rule.region is not None and not (postal_code and postal_code.startswith(rule.region)):
+            return False
+        return True
+
+
+# ==================== #
+# INDEX ACCESS
+# ==================== #
+
+_build_lock = threading.Lock()
+
+
+def get_percolator():
+    """The app's percolator, built on first use and refreshed in the background when stale"""
+    app = current_app._get_current_object()
+    percolator = app.extensions.get('percolator')
+
+    if percolator is None:
+        with _build_lock:
+            percolator = app.extensions.get('percolator')
+            if percolator is None:
+                percolator = Percolator.build()
+                app.extensions['percolator'] = percolator
+        return percolator
+
+    refresh = app.config.get('MATCHING_REFRESH_SECONDS', 300)
+    if refresh and time.monotonic() - percolator.built_at > refresh and _build_lock.acquire(blocking=False):
+        percolator.built_at = time.monotonic()  # one refresh at a time
+        threading.Thread(target=_rebuild, args=(app,), daemon=True).start()
+
+    return percolator
+
+
+def _rebuild(app):
+    try:
+        with app.app_context():
+            app.extensions['percolator'] = Percolator.build()
+    finally:
+        _build_lock.release()
+
+
+def search_values(search):
+    """The matched attribute values of a Search instance"""
+    return {column.key: getattr(search, column.key) for column in SEARCH_COLUMNS}
+
+
+# ==================== #
+# SESSION EVENTS
+# ==================== #
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Search) and obj.id is not None:
+            session.info.setdefault(_PENDING_KEY, {})[obj.id] = search_values(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Search):
+            session.info.setdefault(_PENDING_KEY, {})[obj.id] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending or not has_app_context():
+        return
+
+    percolator = current_app.extensions.get('percolator')
+    if percolator is None:
+        return  # built fresh from the database on first use
+
+    for search_id, values in pending.items():
+        if values is None:
+            percolator.remove(search_id)
+        else:
+            percolator.add(values)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,220 @@
+# app/migrations.py
+"""
+Versioned schema migrations.
+
+db.create_all() only creates missing tables, so changes to existing tables
+(new indexes, columns) are applied here. Every migration runs once, in
+version order, and is recorded in the schema_migrations table. Migrations
+must be idempotent: on a fresh database create_all() has already built the
+current schema and the migration only gets recorded.
+
+Every web worker runs create_app(), so schema setup holds a database lock
+(schema_lock) and the workers apply it one after the other.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import AddConstraint
+
+from .database import db
+from .search import create_search_table, rebuild_index
+
+schema_migrations = db.Table('schema_migrations',
+                             db.Column('version', db.Integer, primary_key=True, autoincrement=False),
+                             db.Column('name', db.String(100), nullable=False),
+                             db.Column('applied_at', db.DateTime, nullable=False)
+                             )
+
+# Named lock serializing schema setup across processes, and how long to wait for it (seconds)
+SCHEMA_LOCK_NAME = 'immometrica_schema'
+SCHEMA_LOCK_TIMEOUT = 600
+
+# pg_advisory_lock takes a number: crc32 of SCHEMA_LOCK_NAME
+SCHEMA_LOCK_KEY = 0x1e402e9b
+
+
+@contextmanager
+def schema_lock():
+    """
+    Hold a database-wide lock while the block runs (MySQL GET_LOCK, PostgreSQL
+    advisory lock), so concurrently starting workers don't race through
+    create_all() and the migrations. SQLite needs none.
+    """
+    dialect = db.engine.dialect.name
+    if dialect not in ('mysql', 'postgresql'):
+        yield
+        return
+
+    with db.engine.connect() as connection:
+        if dialect == 'mysql':
+            acquired = connection.execute(text("SELECT GET_LOCK(:name, :timeout)"),
+                                          {'name': SCHEMA_LOCK_NAME, 'timeout': SCHEMA_LOCK_TIMEOUT}).scalar()
+            if acquired != 1:
+                raise RuntimeError(f"Timed out after {SCHEMA_LOCK_TIMEOUT}s waiting for the schema lock")
+            release = text("SELECT RELEASE_LOCK(:name)"), {'name': SCHEMA_LOCK_NAME}
+        else:
+            connection.execute(text("SELECT pg_advisory_lock(:key)"), {'key': SCHEMA_LOCK_KEY})
+            release = text("SELECT pg_advisory_unlock(:key)"), {'key': SCHEMA_LOCK_KEY}
+        connection.commit()
+        try:
+            yield
+        finally:
+            connection.execute(*release)
+            connection.commit()
+
+
+def create_indexes(*names):
+    """Migration step creating the named indexes declared on the models, when missing"""
+    def migrate(connection):
+        inspector = inspect(connection)
+        declared = {index.name: index for table in db.metadata.tables.values() for index in table.indexes}
+        for name in names:
+            index = declared[name]
+            existing = {i['name'] for i in inspector.get_indexes(index.table.name)}
+            if name not in existing:
+                print(f"   creating index {name} on {index.table.name}")
+                index.create(connection)
+    return migrate
+
+
+def create_listing_search(connection):
+    """Create the full-text table (FULLTEXT on MySQL, FTS5 on SQLite) and index existing listings"""
+    create_search_table(connection)
+    count = rebuild_index(connection)
+    print(f"   indexed {count} listings for full-text search")
+
+
+def _foreign_key_clause(foreign_key):
+    target = foreign_key.column
+    clause = f" REFERENCES {target.table.name} ({target.name})"
+    if foreign_key.ondelete:
+        clause += f" ON DELETE {foreign_key.ondelete}"
+    return clause
+
+
+def add_foreign_keys(table_name, column_name):
+    """Migration step adding the column's declared foreign keys, when missing (not on SQLite)"""
+    def migrate(connection):
+        if connection.dialect.name == 'sqlite':
+            return  # no ALTER TABLE ADD CONSTRAINT; add_column declares them inline
+        column = db.metadata.tables[table_name].c[column_name]
+        existing = {(tuple(fk['constrained_columns']), fk['referred_table'])
+                    for fk in inspect(connection).get_foreign_keys(table_name)}
+        for foreign_key in column.foreign_keys:
+            target = foreign_key.column
+            if ((column_name,), target.table.name) in existing:
+                continue
+            if foreign_key.ondelete == 'SET NULL':
+                # Rows pointing at deleted parents would fail the new constraint; that's what SET NULL leaves
+                connection.execute(text(
+                    f"UPDATE {table_name} SET {column_name} = NULL WHERE {column_name} NOT IN "
+                    f"(SELECT {target.name} FROM (SELECT {target.name} FROM {target.table.name}) AS parents)"
+                ))
+            print(f"   adding foreign key {table_name}.{column_name} -> {target.table.name}")
+            connection.execute(AddConstraint(foreign_key.constraint))
+    return migrate
+
+
+def add_column(table_name, column_name):
+    """Migration step adding a column declared on the models with its foreign keys, when missing"""
+    def migrate(connection):
+        column = db.metadata.tables[table_name].c[column_name]
+        existing = {c['name'] for c in inspect(connection).get_columns(table_name)}
+        if column_name not in existing:
+            print(f"   adding column {table_name}.{column_name}")
+            definition = f"{column_name} {column.type.compile(dialect=connection.dialect)}"
+            if connection.dialect.name == 'sqlite':
+                definition += ''.join(_foreign_key_clause(fk) for fk in column.foreign_keys)
+            connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {definition}"))
+        add_foreign_keys(table_name, column_name)(connection)
+    return migrate
+
+
+def modify_column_type(connection, table_name, column_name):
+    """
+    Give an existing MySQL column its declared type (e.g. new ENUM values).
+    MODIFY COLUMN replaces the whole definition, so the column's current
+    NULL/NOT NULL and DEFAULT are restated.
+    """
+    column = db.metadata.tables[table_name].c[column_name]
+    current = {c['name']: c for c in inspect(connection).get_columns(table_name)}[column_name]
+    definition = f"{column_name} {column.type.compile(dialect=connection.dialect)}"
+    definition += ' NULL' if current['nullable'] else ' NOT NULL'
+    if current['default'] is not None:
+        definition += f" DEFAULT {current['default']}"
+    connection.execute(text(f"ALTER TABLE {table_name} MODIFY COLUMN {definition}"))
+
+
+def add_listing_groups(connection):
+    """Listing.group_id and its index; `flask group-listings` fills it for existing listings"""
+    add_column('listings', 'group_id')(connection)
+    create_indexes('ix_listings_customer_group')(connection)
+
+
+def add_mailing_queue(connection):
+    """Delivery columns of the outbound mail queue and the 'queued' status"""
+    for column_name in ('recipient', 'message_id', 'attempts', 'next_attempt_at', 'error'):
+        add_column('mailings', column_name)(connection)
+    if connection.dialect.name == 'mysql':
+        # Native ENUM: the new value has to be added to the column type
+        modify_column_type(connection, 'mailings', 'status')
+    create_indexes('ix_mailings_status_next_attempt')(connection)
+
+
+def add_mailing_foreign_keys(connection):
+    """The foreign keys add_column used to leave out of migrations 6 and 8"""
+    add_foreign_keys('mailings', 'template_id')(connection)
+    add_foreign_keys('mailings', 'follows_id')(connection)
+
+
+def add_followups(connection):
+    """Per-customer follow-up sequences, the follow-up link of mailings and the sequencer's indexes"""
+    add_column('customers', 'followup_sequence')(connection)
+    add_column('mailings', 'follows_id')(connection)
+    create_indexes('ix_mailings_type_sent', 'ix_mailings_listing', 'uq_mailings_follows')(connection)
+
+
+# (version, name, step) - append only, never renumber
+MIGRATIONS = [
+    (1, 'listing_search_mailing_indexes', create_indexes(
+        'ix_customers_name', 'ix_customers_status', 'ix_customers_created_at',
+        'ix_searches_active_next_run', 'ix_searches_customer_created', 'ix_searches_created',
+        'ix_listings_customer_status_scraped', 'ix_listings_customer_scraped',
+        'ix_listings_status_scraped', 'ix_listings_platform_scraped', 'ix_listings_search_scraped',
+        'ix_listings_scraped', 'ix_listings_postal_code', 'ix_listings_city',
+        'ix_mailings_customer_status', 'ix_appointments_customer_scheduled',
+    )),
+    (2, 'listing_full_text_search', create_listing_search),
+    (3, 'listing_units', add_column('listings', 'units')),
+    (4, 'listing_groups', add_listing_groups),
+    (5, 'mailing_queue', add_mailing_queue),
+    (6, 'mailing_templates', add_column('mailings', 'template_id')),
+    (7, 'mailing_message_id_index', create_indexes('ix_mailings_message_id')),
+    (8, 'mailing_followups', add_followups),
+    (9, 'mailing_foreign_keys', add_mailing_foreign_keys),
+]
+
+
+def applied_versions(connection):
+    return {row.version for row in connection.execute(schema_migrations.select())}
+
+
+def run_migrations():
+    """Apply pending migrations in order, each in its own transaction (callers hold schema_lock)"""
+    schema_migrations.create(db.engine, checkfirst=True)
+
+    with db.engine.connect() as connection:
+        applied = applied_versions(connection)
+
+    pending = [m for m in MIGRATIONS if m[0] not in applied]
+    for version, name, step in sorted(pending, key=lambda m: m[0]):
+        print(f" Applying migration {version}: {name}")
+        with db.engine.begin() as connection:
+            step(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=version, name=name, applied_at=datetime.now(timezone.utc)
+            ))
+
+    return [version for version, _, _ in pending]
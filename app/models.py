@@ -1,7 +1,7 @@
 # app/models.py - CORRIGÉ
 from datetime import datetime, timezone
 from .database import db
-from sqlalchemy import JSON, Enum, Text, ForeignKey, UniqueConstraint, Index, text
+from sqlalchemy import JSON, Enum, Text, ForeignKey, UniqueConstraint, Index, text, func
 from sqlalchemy.orm import relationship
 import json
 
@@ -21,6 +21,14 @@ account_manager_customers = db.Table('account_manager_customers',
                                      db.Column('is_primary', db.Boolean, default=False)
                                      )
 
+# Normalized copy of Customer.platforms so platform counts can be grouped in SQL
+customer_platforms = db.Table('customer_platforms',
+                              db.Column('customer_id', db.Integer,
+                                        db.ForeignKey('customers.id', ondelete='CASCADE'),
+                                        primary_key=True),
+                              db.Column('platform', db.String(50), primary_key=True)
+                              )
+
 
 # ==================== #
 # ACCOUNT MANAGERS / USERS
@@ -67,8 +75,21 @@ class AccountManager(db.Model):
     searches = relationship('Search', back_populates='account_manager',
                             cascade='all, delete-orphan')
 
-    def to_dict(self):
-        """Convert model to dictionary"""
+    def to_dict(self, counts=None):
+        """
+        Convert model to dictionary.
+
+        `counts` holds precomputed customer_count/search_count (see
+        AccountManagerService.get_relationship_counts); without it they are
+        fetched with COUNT queries instead of loading the collections.
+        """
+        if counts is None:
+            counts = {
+                'customer_count': db.session.query(func.count()).select_from(account_manager_customers).filter(
+                    account_manager_customers.c.account_manager_id == self.id).scalar(),
+                'search_count': db.session.query(func.count(Search.id)).filter(
+                    Search.account_manager_id == self.id).scalar()
+            }
         return {
             'id': self.id,
             'first_name': self.first_name,
@@ -81,8 +102,8 @@ class AccountManager(db.Model):
             'is_active': self.is_active,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'last_login_at': self.last_login_at.isoformat() if self.last_login_at else None,
-            'customer_count': len(self.customers),
-            'search_count': len(self.searches)
+            'customer_count': counts.get('customer_count', 0),
+            'search_count': counts.get('search_count', 0)
         }
 
     def __repr__(self):
@@ -96,6 +117,11 @@ class AccountManager(db.Model):
 class Customer(db.Model):
     """Customer model for real estate clients"""
     __tablename__ = 'customers'
+    __table_args__ = (
+        Index('ix_customers_name', 'last_name', 'first_name', 'id'),
+        Index('ix_customers_status', 'status'),
+        Index('ix_customers_created_at', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
 
@@ -123,6 +149,7 @@ class Customer(db.Model):
     platforms = db.Column(JSON, default=lambda: json.dumps([]))
     search_filters = db.Column(JSON, default=lambda: json.dumps({}))
     notification_settings = db.Column(JSON, default=lambda: json.dumps({}))
+    followup_sequence = db.Column(JSON(none_as_null=True))  # follow-up steps, NULL = tier default (app/followups.py)
 
     # Status
     status = db.Column(
@@ -153,8 +180,22 @@ class Customer(db.Model):
     appointments = relationship('Appointment', back_populates='customer',
                                 cascade='all, delete-orphan')
 
-    def to_dict(self):
-        """Convert model to dictionary"""
+    def to_dict(self, counts=None, account_manager_counts=None):
+        """
+        Convert model to dictionary.
+
+        `counts` holds precomputed search_count/listing_count and
+        `account_manager_counts` maps account manager id to its counts (see
+        CustomerService.serialize_customers); without them they are fetched
+        with COUNT queries instead of loading the collections.
+        """
+        if counts is None:
+            counts = {
+                'search_count': db.session.query(func.count(Search.id)).filter(
+                    Search.customer_id == self.id).scalar(),
+                'listing_count': db.session.query(func.count(Listing.id)).filter(
+                    Listing.customer_id == self.id).scalar()
+            }
         return {
             'id': self.id,
             'first_name': self.first_name,
@@ -177,13 +218,18 @@ class Customer(db.Model):
             'platforms': json.loads(self.platforms) if isinstance(self.platforms, str) else self.platforms,
             'search_filters': json.loads(self.search_filters) if isinstance(self.search_filters,
                                                                             str) else self.search_filters,
+            'followup_sequence': json.loads(self.followup_sequence) if isinstance(self.followup_sequence,
+                                                                                  str) else self.followup_sequence,
             'status': self.status,
             'subscription_tier': self.subscription_tier,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'last_contact_date': self.last_contact_date.isoformat() if self.last_contact_date else None,
-            'account_managers': [am.to_dict() for am in self.account_managers],
-            'search_count': len(self.searches),
-            'listing_count': len(self.listings)
+            'account_managers': [
+                am.to_dict(account_manager_counts.get(am.id, {}) if account_manager_counts is not None else None)
+                for am in self.account_managers
+            ],
+            'search_count': counts.get('search_count', 0),
+            'listing_count': counts.get('listing_count', 0)
         }
 
     def __repr__(self):
@@ -197,6 +243,11 @@ class Customer(db.Model):
 class Search(db.Model):
     """Search configuration model"""
     __tablename__ = 'searches'
+    __table_args__ = (
+        Index('ix_searches_active_next_run', 'is_active', 'next_run_at'),
+        Index('ix_searches_customer_created', 'customer_id', 'created_at', 'id'),
+        Index('ix_searches_created', 'created_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
 
@@ -240,13 +291,20 @@ class Search(db.Model):
     customer = relationship('Customer', back_populates='searches')
     account_manager = relationship('AccountManager', back_populates='searches')
 
-    def to_dict(self):
-        """Convert model to dictionary"""
+    def to_dict(self, customer_name=None):
+        """
+        Convert model to dictionary.
+
+        `customer_name` is passed by SearchService.serialize_searches (from
+        the reference cache); without it the customer is loaded.
+        """
+        if customer_name is None and self.customer:
+            customer_name = f"{self.customer.first_name} {self.customer.last_name}"
         return {
             'id': self.id,
             'name': self.name,
             'customer_id': self.customer_id,
-            'customer_name': f"{self.customer.first_name} {self.customer.last_name}" if self.customer else None,
+            'customer_name': customer_name,
             'account_manager_id': self.account_manager_id,
             'location_postcode': self.location_postcode,
             'radius_km': self.radius_km,
@@ -280,6 +338,18 @@ class Search(db.Model):
 
 class Listing(db.Model):
     __tablename__ = 'listings'
+    # Listing pages are filtered on customer/status/platform/search and sorted on (scraped_at, id)
+    __table_args__ = (
+        Index('ix_listings_customer_status_scraped', 'customer_id', 'status', 'scraped_at', 'id'),
+        Index('ix_listings_customer_scraped', 'customer_id', 'scraped_at', 'id'),
+        Index('ix_listings_status_scraped', 'status', 'scraped_at', 'id'),
+        Index('ix_listings_platform_scraped', 'platform', 'scraped_at', 'id'),
+        Index('ix_listings_search_scraped', 'search_id', 'scraped_at', 'id'),
+        Index('ix_listings_scraped', 'scraped_at', 'id'),
+        Index('ix_listings_postal_code', 'postal_code'),
+        Index('ix_listings_city', 'city'),
+        Index('ix_listings_customer_group', 'customer_id', 'group_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     customer_id = db.Column(db.Integer,
@@ -287,6 +357,8 @@ class Listing(db.Model):
                             nullable=False)
     search_id = db.Column(db.Integer,
                           db.ForeignKey('searches.id', ondelete='SET NULL'))
+    # Id of the first listing of the same property on any platform (listing_dedup.py), NULL when unique
+    group_id = db.Column(db.Integer)
 
 
     external_id = db.Column(db.String(100), unique=True)
@@ -302,6 +374,7 @@ class Listing(db.Model):
     city = db.Column(db.String(100))
     property_type = db.Column(db.String(100))
     rooms = db.Column(db.Float)
+    units = db.Column(db.Integer)  # residential units (Wohneinheiten), matched against Search.min_units
     living_area = db.Column(db.Float)
     year_built = db.Column(db.Integer)
     price = db.Column(db.Numeric(12, 2))
@@ -339,6 +412,7 @@ class Listing(db.Model):
             'postal_code': self.postal_code,
             'city': self.city,
             'rooms': self.rooms,
+            'units': self.units,
             'living_area': self.living_area,
             'year_built': self.year_built,
             'price': float(self.price) if self.price else None,
@@ -353,6 +427,7 @@ class Listing(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'customer_id': self.customer_id,
             'search_id': self.search_id,
+            'group_id': self.group_id,
             'external_id': self.external_id,
             'mailing_history': json.loads(self.mailing_history) if isinstance(self.mailing_history,
                                                                               str) else self.mailing_history
@@ -368,6 +443,14 @@ class Listing(db.Model):
 class Mailing(db.Model):
     """Mailing history model"""
     __tablename__ = 'mailings'
+    __table_args__ = (
+        Index('ix_mailings_customer_status', 'customer_id', 'status'),
+        Index('ix_mailings_status_next_attempt', 'status', 'next_attempt_at'),
+        Index('ix_mailings_message_id', 'message_id'),
+        Index('ix_mailings_type_sent', 'type', 'sent_at'),
+        Index('ix_mailings_listing', 'listing_id'),
+        Index('uq_mailings_follows', 'follows_id', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
 
@@ -381,21 +464,32 @@ class Mailing(db.Model):
 
     # Mailing Details
     type = db.Column(db.String(50))  # initial, followup_1, followup_2
+    recipient = db.Column(db.String(255))
     subject = db.Column(db.String(500))
     content = db.Column(Text, nullable=False)
+    message_id = db.Column(db.String(255))  # RFC 5322 Message-ID, set when queued
+    template_id = db.Column(db.Integer,
+                            db.ForeignKey('message_templates.id', ondelete='SET NULL'))  # version it was rendered from
+    follows_id = db.Column(db.Integer,
+                           db.ForeignKey('mailings.id', ondelete='SET NULL'))  # mailing a follow-up answers, at most one
 
     # Status
     status = db.Column(
-        db.Enum('sent', 'delivered', 'opened', 'clicked', 'replied', 'error', name='mailing_status'),
+        db.Enum('queued', 'sent', 'delivered', 'opened', 'clicked', 'replied', 'error', name='mailing_status'),
         default='sent'
     )
 
+    # Delivery (app/mailer.py): queued mailings are sent once next_attempt_at has passed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime)
+    error = db.Column(Text)
+
     # Response
     response_content = db.Column(Text)
     response_at = db.Column(db.DateTime)
 
     # Timestamps
-    sent_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
+    sent_at = db.Column(db.DateTime)  # set by the sender on delivery
     created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
 
     # Relationships
@@ -409,9 +503,15 @@ class Mailing(db.Model):
             'listing_id': self.listing_id,
             'customer_id': self.customer_id,
             'type': self.type,
+            'recipient': self.recipient,
             'subject': self.subject,
             'content': self.content,
+            'message_id': self.message_id,
+            'template_id': self.template_id,
+            'follows_id': self.follows_id,
             'status': self.status,
+            'attempts': self.attempts,
+            'error': self.error,
             'sent_at': self.sent_at.isoformat() if self.sent_at else None,
             'response_content': self.response_content,
             'response_at': self.response_at.isoformat() if self.response_at else None,
@@ -422,6 +522,206 @@ class Mailing(db.Model):
         return f'<Mailing {self.type} for Listing {self.listing_id}>'
 
 
+class MailboxCursor(db.Model):
+    """How far app/replies.py has read a Maildir or mbox, so old mail is never parsed again"""
+    __tablename__ = 'mailbox_cursors'
+
+    path = db.Column(db.String(255), primary_key=True)
+    position = db.Column(db.BigInteger, nullable=False, default=0)  # mbox: byte offset after the last message read
+    inode = db.Column(db.BigInteger)                                 # mbox: a new inode means the file was rotated
+    mtime_ns = db.Column(db.BigInteger)                              # Maildir: newest message file read
+    state = db.Column(Text)                                          # JSON, see app/replies.py
+    updated_at = db.Column(db.DateTime)
+
+
+# ==================== #
+# MESSAGE TEMPLATES
+# ==================== #
+
+class MessageTemplate(db.Model):
+    """
+    One version of an outreach template (message_templates.py). Versions are
+    never edited: saving a template adds the next version, and mailings keep
+    pointing at the version they were rendered from.
+    """
+    __tablename__ = 'message_templates'
+    __table_args__ = (
+        UniqueConstraint('name', 'customer_id', 'version', name='uq_message_templates_version'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+
+    # NULL: shared template, used by customers without their own version
+    customer_id = db.Column(db.Integer,
+                            db.ForeignKey('customers.id', ondelete='CASCADE'))
+
+    name = db.Column(db.String(50), nullable=False)  # initial, followup_1, followup_2
+    version = db.Column(db.Integer, nullable=False)
+    subject = db.Column(db.String(500))
+    body = db.Column(Text, nullable=False)
+
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    def to_dict(self):
+        """Convert model to dictionary"""
+        return {
+            'id': self.id,
+            'customer_id': self.customer_id,
+            'name': self.name,
+            'version': self.version,
+            'subject': self.subject,
+            'body': self.body,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+    def __repr__(self):
+        return f'<MessageTemplate {self.name} v{self.version}>'
+
+
+# ==================== #
+# SEARCH MATCHES (REVERSE MATCHING)
+# ==================== #
+
+class SearchMatch(db.Model):
+    """A listing that satisfies a saved search, recorded when the listing was ingested"""
+    __tablename__ = 'search_matches'
+    __table_args__ = (
+        Index('ix_search_matches_listing', 'listing_id'),
+    )
+
+    search_id = db.Column(db.Integer,
+                          db.ForeignKey('searches.id', ondelete='CASCADE'),
+                          primary_key=True, autoincrement=False)
+    listing_id = db.Column(db.Integer,
+                           db.ForeignKey('listings.id', ondelete='CASCADE'),
+                           primary_key=True, autoincrement=False)
+    matched_at = db.Column(db.DateTime, nullable=False)
+
+    def to_dict(self):
+        return {
+            'search_id': self.search_id,
+            'listing_id': self.listing_id,
+            'matched_at': self.matched_at.isoformat() if self.matched_at else None
+        }
+
+
+# ==================== #
+# DUPLICATE DETECTION
+# ==================== #
+
+class ListingSignature(db.Model):
+    """MinHash signature of a listing's title and description (see listing_dedup.py)"""
+    __tablename__ = 'listing_signatures'
+
+    listing_id = db.Column(db.Integer,
+                           db.ForeignKey('listings.id', ondelete='CASCADE'),
+                           primary_key=True, autoincrement=False)
+    signature = db.Column(db.LargeBinary(256))
+
+
+class ListingBucket(db.Model):
+    """LSH bucket membership: listings sharing a bucket key are duplicate candidates"""
+    __tablename__ = 'listing_buckets'
+    __table_args__ = (
+        Index('ix_listing_buckets_listing', 'listing_id'),
+    )
+
+    bucket_key = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    listing_id = db.Column(db.Integer,
+                           db.ForeignKey('listings.id', ondelete='CASCADE'),
+                           primary_key=True, autoincrement=False)
+
+
+class SearchRun(db.Model):
+    """One scheduled execution of a search, with its scheduling lag and outcome"""
+    __tablename__ = 'search_runs'
+    __table_args__ = (
+        Index('ix_search_runs_search_started', 'search_id', 'started_at'),
+        Index('ix_search_runs_started', 'started_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    search_id = db.Column(db.Integer,
+                          db.ForeignKey('searches.id', ondelete='CASCADE'),
+                          nullable=False)
+
+    scheduled_at = db.Column(db.DateTime)          # next_run_at when claimed (NULL = never scheduled)
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime)
+    lag_seconds = db.Column(db.Float)              # started_at - scheduled_at
+    duration_seconds = db.Column(db.Float)
+
+    status = db.Column(
+        db.Enum('running', 'succeeded', 'failed', name='search_run_status'),
+        default='running',
+        nullable=False
+    )
+    listings_found = db.Column(db.Integer)
+    error = db.Column(Text)
+    worker = db.Column(db.String(100))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'search_id': self.search_id,
+            'scheduled_at': self.scheduled_at.isoformat() if self.scheduled_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'lag_seconds': self.lag_seconds,
+            'duration_seconds': self.duration_seconds,
+            'status': self.status,
+            'listings_found': self.listings_found,
+            'error': self.error,
+            'worker': self.worker
+        }
+
+    def __repr__(self):
+        return f'<SearchRun {self.search_id} {self.status}>'
+
+
+# ==================== #
+# CUSTOMER STATS (ROLLUP)
+# ==================== #
+
+class CustomerStat(db.Model):
+    """
+    Per-customer counters kept in step with listing/mailing writes.
+
+    dimension is one of listing_status, listing_platform or mailing_status and
+    key is the status or platform value being counted.
+    """
+    __tablename__ = 'customer_stats'
+
+    customer_id = db.Column(db.Integer,
+                            db.ForeignKey('customers.id', ondelete='CASCADE'),
+                            primary_key=True)
+    dimension = db.Column(db.String(30), primary_key=True)
+    key = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CustomerStat {self.customer_id} {self.dimension}:{self.key}={self.count}>'
+
+
+# ==================== #
+# CHANGE GENERATIONS
+# ==================== #
+
+class ChangeGeneration(db.Model):
+    """
+    Write counter of a scope ('listings', 'listings:42', ...), bumped by every
+    commit that changes it. Validators of conditional GETs, see app/generations.py.
+    """
+    __tablename__ = 'change_generations'
+
+    scope = db.Column(db.String(100), primary_key=True)
+    generation = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<ChangeGeneration {self.scope}={self.generation}>'
+
+
 # ==================== #
 # APPOINTMENTS
 # ==================== #
@@ -429,6 +729,9 @@ class Mailing(db.Model):
 class Appointment(db.Model):
     """Appointment model"""
     __tablename__ = 'appointments'
+    __table_args__ = (
+        Index('ix_appointments_customer_scheduled', 'customer_id', 'scheduled_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
 
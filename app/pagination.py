@@ -0,0 +1,105 @@
+# app/pagination.py
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import tuple_
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 200
+
+
+def clamp_per_page(per_page: Optional[int]) -> int:
+    """Keep page sizes within sane bounds"""
+    if not per_page or per_page < 1:
+        return DEFAULT_PER_PAGE
+    return min(per_page, MAX_PER_PAGE)
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Encode the sort key of the last row of a page into an opaque token"""
+    payload = [v.isoformat() if isinstance(v, (date, datetime)) else v for v in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, columns: Sequence[Any]) -> List[Any]:
+    """Decode a cursor token back into typed sort-key values"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, binascii.Error, UnicodeError):
+        raise ValueError('Invalid cursor')
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError('Invalid cursor')
+
+    return [_decode_value(column, value) for column, value in zip(columns, values)]
+
+
+def _decode_value(column: Any, value: Any) -> Any:
+    """One sort-key value checked against its column's type (NULL keys stay None)"""
+    if value is None:
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        python_type = None
+
+    if python_type in (datetime, date):
+        if not isinstance(value, str):
+            raise ValueError('Invalid cursor')
+        try:
+            return python_type.fromisoformat(value)
+        except ValueError:
+            raise ValueError('Invalid cursor')
+
+    # bool is an int to Python but never a valid id or score
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError('Invalid cursor')
+    if python_type is int and not isinstance(value, int):
+        raise ValueError('Invalid cursor')
+    if python_type in (float, Decimal) and not isinstance(value, (int, float)):
+        raise ValueError('Invalid cursor')
+    if python_type is str and not isinstance(value, str):
+        raise ValueError('Invalid cursor')
+    return value
+
+
+def keyset_query(query, columns: Sequence[Any], per_page: int,
+                 cursor: Optional[str] = None, descending: bool = False):
+    """The query keyset_paginate runs: rows after `cursor`, ordered, one extra row to detect a next page"""
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        key = tuple_(*columns)
+        query = query.filter(key < tuple_(*values) if descending else key > tuple_(*values))
+
+    ordering = [c.desc() if descending else c.asc() for c in columns]
+    return query.order_by(*ordering).limit(per_page + 1)
+
+
+def keyset_paginate(query, columns: Sequence[Any], per_page: int,
+                    cursor: Optional[str] = None, descending: bool = False,
+                    row_values: Optional[Callable[[Any], Sequence[Any]]] = None) -> Tuple[list, Optional[str]]:
+    """
+    Fetch one page of `query` ordered by `columns` (the last one must be unique,
+    usually the primary key) starting strictly after `cursor`. `row_values`
+    extracts the sort key from a row when it is not a plain attribute lookup
+    (e.g. computed columns).
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    per_page = clamp_per_page(per_page)
+    rows = keyset_query(query, columns, per_page, cursor, descending).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        values = row_values(last) if row_values else [getattr(last, c.key) for c in columns]
+        next_cursor = encode_cursor(values)
+
+    return rows, next_cursor
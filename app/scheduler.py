@@ -0,0 +1,309 @@
+# app/scheduler.py
+"""
+Due-search scheduler.
+
+Claims active searches whose next_run_at has passed, runs them on a bounded
+thread pool and records every run (lag, duration, outcome) in search_runs.
+
+Claiming pushes next_run_at forward by a lease, inside the claiming
+transaction, so concurrent schedulers never pick the same search:
+
+- MySQL 8 / PostgreSQL: SELECT ... FOR UPDATE SKIP LOCKED, then UPDATE
+- SQLite: compare-and-set UPDATE ... WHERE <still due>
+
+While a search runs, its scheduler renews the lease a quarter of the way
+into it (compare-and-set on the lease it holds, so the run's own
+rescheduling is never overwritten), so runs longer than CLAIM_LEASE are not
+claimed twice. A scheduler that dies mid-run stops renewing; the search
+becomes due again when the lease expires. New searches get a jittered first
+run (SearchService.create_search) and successful runs reschedule through
+SearchService.update_search_results, which adds jitter too, so searches
+created together drift apart instead of firing as one burst.
+"""
+
+import importlib
+import os
+import random
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, or_, select, update
+
+from .database import db
+from .models import Listing, Search, SearchRun
+
+DEFAULT_WORKERS = 4
+DEFAULT_POLL_INTERVAL = 10.0
+
+# Seconds between lag/throughput log lines
+REPORT_INTERVAL = 60.0
+
+# How long a claimed search stays invisible to other schedulers, and the
+# part of it after which a running search's lease is pushed forward again
+CLAIM_LEASE = timedelta(hours=1)
+LEASE_RENEWAL_FRACTION = 0.25
+
+# Failed runs are retried after RETRY_DELAY, spread by up to RETRY_JITTER
+RETRY_DELAY = timedelta(minutes=15)
+RETRY_JITTER = timedelta(minutes=5)
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(value):
+    """DateTime columns come back naive; they hold UTC"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def count_new_listings(search):
+    """Default runner: listings attached to the search since its last run (e.g. by import-offers)"""
+    query = select(func.count(Listing.id)).where(Listing.search_id == search.id)
+    if search.last_run_at:
+        query = query.where(Listing.created_at > search.last_run_at)
+    return db.session.scalar(query)
+
+
+def load_runner(path):
+    """Resolve a 'module:function' runner; the function takes a Search and returns listings found"""
+    module_name, _, attribute = path.partition(':')
+    if not attribute:
+        raise ValueError(f"Runner must look like module:function, got {path!r}")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def _due_filter(now):
+    # Searches that never ran and were never scheduled are due immediately
+    return Search.is_active.is_(True), or_(Search.next_run_at.is_(None), Search.next_run_at <= now)
+
+
+def _lease_until(now, lease):
+    # Whole seconds: MySQL DATETIME drops fractions, and renewals compare the value
+    return (now + lease).replace(microsecond=0)
+
+
+def claim_due_searches(limit, lease=CLAIM_LEASE):
+    """
+    Claim up to `limit` due searches for this process. Returns
+    [(search_id, scheduled_at, lease_until)] with scheduled_at the
+    next_run_at that was due and lease_until the one the claim set.
+    """
+    if limit <= 0:
+        return []
+
+    now = _now()
+    lease_until = _lease_until(now, lease)
+    dialect = db.session.get_bind().dialect.name
+    candidates = select(Search.id, Search.customer_id, Search.next_run_at).where(*_due_filter(now)).order_by(
+        Search.next_run_at
+    ).limit(limit)
+
+    if dialect in ('mysql', 'postgresql'):
+        rows = db.session.execute(candidates.with_for_update(skip_locked=True)).all()
+        if rows:
+            db.session.execute(
+                update(Search).where(Search.id.in_([row.id for row in rows])).values(next_run_at=lease_until)
+                .execution_options(generation_customers={row.customer_id for row in rows})
+            )
+        db.session.commit()
+        return [(row.id, _as_utc(row.next_run_at), lease_until) for row in rows]
+
+    # Compare-and-set: a claim moves next_run_at past now, so only the first
+    # scheduler whose UPDATE still finds the search due wins it
+    claimed = []
+    for row in db.session.execute(candidates).all():
+        result = db.session.execute(
+            update(Search).where(Search.id == row.id, *_due_filter(now)).values(next_run_at=lease_until)
+            .execution_options(generation_customers=[row.customer_id])
+        )
+        if result.rowcount == 1:
+            claimed.append((row.id, _as_utc(row.next_run_at), lease_until))
+    db.session.commit()
+    return claimed
+
+
+def renew_leases(leases, lease=CLAIM_LEASE):
+    """
+    Push the leases of running searches forward. `leases` maps search_id to
+    the lease_until this process holds; a search whose next_run_at changed
+    since (its run rescheduled it) is left alone. Returns {search_id:
+    new lease_until} of the leases renewed.
+    """
+    if not leases:
+        return {}
+
+    lease_until = _lease_until(_now(), lease)
+    renewed = {}
+    rows = db.session.execute(select(Search.id, Search.customer_id).where(Search.id.in_(list(leases)))).all()
+    for row in rows:
+        result = db.session.execute(
+            update(Search).where(Search.id == row.id, Search.next_run_at == leases[row.id])
+            .values(next_run_at=lease_until)
+            .execution_options(generation_customers=[row.customer_id])
+        )
+        if result.rowcount == 1:
+            renewed[row.id] = lease_until
+    db.session.commit()
+    return renewed
+
+
+def retry_at(now=None):
+    now = now or _now()
+    return now + RETRY_DELAY + timedelta(seconds=random.uniform(0, RETRY_JITTER.total_seconds()))
+
+
+class Scheduler:
+    """Poll loop that keeps up to `workers` searches running at a time"""
+
+    def __init__(self, app, runner=count_new_listings, workers=DEFAULT_WORKERS,
+                 poll_interval=DEFAULT_POLL_INTERVAL, lease=CLAIM_LEASE, log=print):
+        self.app = app
+        self.runner = runner
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.renewal = (lease * LEASE_RENEWAL_FRACTION).total_seconds()
+        self.leases = {}            # search_id -> lease_until, of the searches running here
+        self.last_renewal = time.monotonic()
+        self.log = log
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = threading.Event()
+        self.running = 0
+        self.lock = threading.Lock()
+        self.lags = []
+        self.claimed = 0
+        self.last_report = time.monotonic()
+
+    def stop(self, *_):
+        self.stopping.set()
+
+    def run(self, once=False):
+        """Claim and run due searches until stopped (or until nothing is due with once=True)"""
+        self.log(f" Scheduler {self.name}: {self.workers} worker(s), polling every {self.poll_interval}s")
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while not self.stopping.is_set():
+                with self.lock:
+                    free = self.workers - self.running
+
+                with self.app.app_context():
+                    claimed = claim_due_searches(free, self.lease)
+
+                for search_id, scheduled_at, lease_until in claimed:
+                    with self.lock:
+                        self.running += 1
+                        self.leases[search_id] = lease_until
+                    pool.submit(self._run_one, search_id, scheduled_at)
+
+                self.claimed += len(claimed)
+                if time.monotonic() - self.last_renewal >= self.renewal:
+                    self._renew_leases()
+                if time.monotonic() - self.last_report >= REPORT_INTERVAL:
+                    self._report()
+
+                if not claimed and once:
+                    with self.lock:
+                        idle = self.running == 0
+                    if idle:
+                        break
+
+                if free and len(claimed) < free:
+                    # Nothing more is due: sleep until the next poll
+                    self.stopping.wait(0.1 if once else self.poll_interval)
+                else:
+                    # Pool full, or more searches may be due: check again shortly
+                    self.stopping.wait(0.05)
+
+        self._report()
+        self.log(f" Scheduler {self.name} stopped")
+
+    def _run_one(self, search_id, scheduled_at):
+        try:
+            with self.app.app_context():
+                self._execute(search_id, scheduled_at)
+        except Exception as e:
+            self.log(f" ✗ search {search_id}: could not record run: {e}")
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.leases.pop(search_id, None)
+
+    def _renew_leases(self):
+        """Keep the searches running here claimed, however long their runs take"""
+        self.last_renewal = time.monotonic()
+        with self.lock:
+            leases = dict(self.leases)
+        try:
+            with self.app.app_context():
+                renewed = renew_leases(leases, self.lease)
+        except Exception as e:
+            self.log(f" ✗ could not renew search leases: {e}")
+            return
+        with self.lock:
+            for search_id, lease_until in renewed.items():
+                # Skip runs that finished meanwhile
+                if search_id in self.leases:
+                    self.leases[search_id] = lease_until
+
+    def _execute(self, search_id, scheduled_at):
+        from .services import SearchService
+
+        started_at = _now()
+        lag = (started_at - scheduled_at).total_seconds() if scheduled_at else None
+        run = SearchRun(search_id=search_id, scheduled_at=scheduled_at, started_at=started_at,
+                        lag_seconds=lag, status='running', worker=self.name)
+        db.session.add(run)
+        db.session.commit()
+        with self.lock:
+            if lag is not None:
+                self.lags.append(lag)
+
+        try:
+            search = db.session.get(Search, search_id)
+            found = self.runner(search)
+            SearchService.update_search_results(search_id, found or 0)
+            run.status = 'succeeded'
+            run.listings_found = found or 0
+        except Exception as e:
+            db.session.rollback()
+            db.session.execute(update(Search).where(Search.id == search_id).values(next_run_at=retry_at()))
+            run = db.session.get(SearchRun, run.id)
+            run.status = 'failed'
+            run.error = str(e)
+            self.log(f" ✗ search {search_id} failed: {e}")
+
+        run.finished_at = _now()
+        run.duration_seconds = round((run.finished_at - started_at).total_seconds(), 3)
+        db.session.commit()
+
+    def _report(self):
+        """Log searches claimed and scheduling lag percentiles since the last report"""
+        with self.lock:
+            lags = sorted(self.lags)
+            self.lags = []
+            claimed, self.claimed = self.claimed, 0
+            running = self.running
+        self.last_report = time.monotonic()
+
+        line = f" claimed {claimed} search(es), {running} running"
+        if lags:
+            p50 = lags[len(lags) // 2]
+            p95 = lags[min(len(lags) - 1, int(len(lags) * 0.95))]
+            line += f"; lag p50 {p50:.1f}s, p95 {p95:.1f}s, max {lags[-1]:.1f}s"
+        self.log(line)
+
+
+def run_scheduler(app, runner=count_new_listings, workers=DEFAULT_WORKERS,
+                  poll_interval=DEFAULT_POLL_INTERVAL, once=False):
+    """Run a Scheduler in the foreground, stopping cleanly on SIGINT/SIGTERM"""
+    scheduler = Scheduler(app, runner, workers, poll_interval)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    scheduler.run(once=once)
+    return scheduler
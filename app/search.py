@@ -0,0 +1,192 @@
+# app/search.py
+"""
+Full-text search over listings.
+
+Listing text is folded for German (lowercase, ä -> ae, ß -> ss, other accents
+stripped) and stored in the listing_search table:
+
+- MySQL: InnoDB table with FULLTEXT indexes, queried in BOOLEAN MODE
+- SQLite (local runs): FTS5 virtual table keyed by rowid, ranked with bm25
+
+Words with umlauts are indexed in both spellings (mueller and muller), so
+"Müller", "Mueller" and "Muller" all find the same listing. The table is
+created by a migration (app/migrations.py) and kept in sync by ListingService.
+"""
+
+from sqlalchemy import Float, Integer, bindparam, select, text
+
+from text_folding import UMLAUTS, WORD, strip_accents
+
+SEARCH_TABLE = 'listing_search'
+
+# InnoDB ignores shorter words (innodb_ft_min_token_size)
+MYSQL_MIN_TOKEN = 3
+MAX_QUERY_TERMS = 8
+
+# Title matches weigh more than description/location matches
+TITLE_WEIGHT = 4.0
+
+
+def fold_word(word):
+    """Canonical search spelling of one word: 'Müller' -> 'mueller'"""
+    return strip_accents(word.lower().translate(UMLAUTS))
+
+
+def fold_text(value):
+    """Folded, space separated words of `value`, plus the plain spelling of umlaut words"""
+    words = []
+    for word in WORD.findall((value or '').lower()):
+        folded = fold_word(word)
+        words.append(folded)
+        plain = strip_accents(word).replace('ß', 'ss')
+        if plain != folded:
+            words.append(plain)
+    return ' '.join(words)
+
+
+def word_spellings(value):
+    """Folded word lists of `value`: the canonical spelling, plus the plain one when umlauts differ"""
+    words = WORD.findall((value or '').lower())
+    canonical = [fold_word(word) for word in words]
+    plain = [strip_accents(word).replace('ß', 'ss') for word in words]
+    return [canonical] if plain == canonical else [canonical, plain]
+
+
+def search_terms(query):
+    """Folded query words, at most MAX_QUERY_TERMS"""
+    return [fold_word(word) for word in WORD.findall(query or '')][:MAX_QUERY_TERMS]
+
+
+def listing_document(title, description=None, location=None, address=None, city=None, postal_code=None):
+    """(title, body) search columns for one listing"""
+    body = ' '.join(filter(None, [description, location, address, postal_code, city]))
+    return fold_text(title), fold_text(body)
+
+
+def _dialect(connection):
+    return connection.dialect.name
+
+
+# ==================== #
+# SCHEMA
+# ==================== #
+
+def create_search_table(connection):
+    """Create listing_search for the connection's dialect (idempotent)"""
+    if _dialect(connection) == 'mysql':
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            " listing_id INT NOT NULL PRIMARY KEY,"
+            " title TEXT NOT NULL,"
+            " body MEDIUMTEXT NOT NULL,"
+            " FULLTEXT KEY ft_listing_search_title (title),"
+            " FULLTEXT KEY ft_listing_search_all (title, body),"
+            " CONSTRAINT fk_listing_search_listing FOREIGN KEY (listing_id)"
+            "  REFERENCES listings (id) ON DELETE CASCADE"
+            ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+        ))
+    else:
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+            "USING fts5(title, body, tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+
+
+def _key_column(connection):
+    return 'listing_id' if _dialect(connection) == 'mysql' else 'rowid'
+
+
+# ==================== #
+# INDEXING
+# ==================== #
+
+def index_listings(connection, listing_ids, batch_size=1000):
+    """(Re)index the given listings from the listings table"""
+    from .models import Listing
+
+    listing_ids = list(listing_ids)
+    key = _key_column(connection)
+
+    for start in range(0, len(listing_ids), batch_size):
+        batch = listing_ids[start:start + batch_size]
+        rows = connection.execute(
+            select(Listing.id, Listing.title, Listing.description, Listing.location,
+                   Listing.address, Listing.city, Listing.postal_code)
+            .where(Listing.id.in_(batch))
+        ).all()
+
+        remove_listings(connection, batch)
+        if rows:
+            documents = []
+            for row in rows:
+                title, body = listing_document(row.title, row.description, row.location,
+                                               row.address, row.city, row.postal_code)
+                documents.append({'listing_id': row.id, 'title': title, 'body': body})
+            connection.execute(
+                text(f"INSERT INTO {SEARCH_TABLE} ({key}, title, body) VALUES (:listing_id, :title, :body)"),
+                documents
+            )
+
+
+def remove_listings(connection, listing_ids):
+    """Drop listings from the search index"""
+    listing_ids = list(listing_ids)
+    if listing_ids:
+        key = _key_column(connection)
+        connection.execute(
+            text(f"DELETE FROM {SEARCH_TABLE} WHERE {key} IN :ids").bindparams(
+                bindparam('ids', expanding=True)),
+            {'ids': listing_ids}
+        )
+
+
+def rebuild_index(connection, batch_size=1000):
+    """Reindex every listing, walking the primary key in batches; returns the count"""
+    from .models import Listing
+
+    connection.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    count = 0
+    last_id = 0
+    while True:
+        ids = connection.execute(
+            select(Listing.id).where(Listing.id > last_id).order_by(Listing.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return count
+        index_listings(connection, ids, batch_size)
+        count += len(ids)
+        last_id = ids[-1]
+
+
+# ==================== #
+# QUERYING
+# ==================== #
+
+def match_query(connection, query):
+    """
+    Subquery of (listing_id, score) for listings matching every word of
+    `query` as a prefix, higher score = more relevant (whole-word matches
+    count twice). None when the query has no searchable words.
+    """
+    terms = search_terms(query)
+
+    if _dialect(connection) == 'mysql':
+        terms = [t for t in terms if len(t) >= MYSQL_MIN_TOKEN]
+        if not terms:
+            return None
+        stmt = text(
+            f"SELECT listing_id, "
+            f"MATCH (title) AGAINST (:q IN BOOLEAN MODE) * :weight "
+            f"+ MATCH (title, body) AGAINST (:q IN BOOLEAN MODE) AS score "
+            f"FROM {SEARCH_TABLE} WHERE MATCH (title, body) AGAINST (:q IN BOOLEAN MODE)"
+        ).bindparams(q=' '.join(f'+({t} {t}*)' for t in terms), weight=TITLE_WEIGHT)
+    else:
+        if not terms:
+            return None
+        # bm25 is lower-is-better, negate it so both dialects sort score descending
+        stmt = text(
+            f"SELECT rowid AS listing_id, -bm25({SEARCH_TABLE}, :weight, 1.0) AS score "
+            f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :q"
+        ).bindparams(q=' AND '.join(f'("{t}" OR "{t}"*)' for t in terms), weight=TITLE_WEIGHT)
+
+    return stmt.columns(listing_id=Integer, score=Float).subquery('search_hits')
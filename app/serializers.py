@@ -0,0 +1,230 @@
+# app/serializers.py
+"""
+Row serializers for the list and export endpoints.
+
+Those endpoints select only the columns they return, as plain rows, instead
+of hydrating ORM objects and calling to_dict. A RowSerializer turns such
+rows into response dicts through one function generated and compiled when
+the serializer is built (at import), with the conversion of every field
+inlined from its column type:
+
+- Numeric (Decimal) -> float, 0 and NULL -> None like the to_dict methods
+- Date/DateTime -> ISO 8601 string
+- JSON columns holding a json.dumps string -> the decoded value
+
+Sparse fieldsets (`fields=` on the list endpoints) select a narrowed
+serializer (subset/narrow, compiled once per field combination), so
+unrequested columns, e.g. the TEXT ones, are never read.
+
+Responses are encoded with orjson when it is installed (FastJSONProvider,
+dumps), else with the standard library. Compare both paths with
+scripts/benchmark_serializers.py.
+"""
+
+import json
+from datetime import date
+from decimal import Decimal
+from functools import lru_cache
+
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import JSON, Date, DateTime, Numeric
+
+from .models import Customer, Listing, Search
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to json
+    orjson = None
+
+
+# Field combinations each serializer keeps compiled (least recently used dropped first)
+SUBSET_CACHE_SIZE = 256
+
+
+def _loads(value):
+    return json.loads(value) if isinstance(value, str) else value
+
+
+class Computed:
+    """A field computed in Python from several columns: function(*values)"""
+
+    def __init__(self, function, *columns):
+        self.function = function
+        self.columns = columns
+
+
+class RowSerializer:
+    """
+    Compiled row -> dict function for a fixed list of fields.
+
+    `fields` is a sequence of (key, column), (key, Computed) or (key, nested
+    fields) pairs; `columns` lists the columns to select, in the order the
+    function reads them from a row (extra trailing columns, e.g. sort keys,
+    are ignored).
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = tuple(fields)
+        self.keys = [key for key, _ in self.fields]
+        self.columns = []
+        self.namespace = {'_loads': _loads}
+        lines = []
+        expression = self._expression(self.fields, lines)
+        source = '\n'.join([f"def serialize_{name}(row):", *lines, f"    return {expression}"])
+
+        exec(compile(source, f"<serializer {name}>", 'exec'), self.namespace)
+        self.serialize = self.namespace[f"serialize_{name}"]
+
+        # Narrowed serializers of this one by field set, compiled on first use
+        self.subsets = lru_cache(maxsize=SUBSET_CACHE_SIZE)(self._compile_subset)
+
+    def _expression(self, fields, lines):
+        items = []
+        for key, column in fields:
+            if isinstance(column, (list, tuple)):
+                items.append(f"{key!r}: {self._expression(column, lines)}")
+                continue
+            if isinstance(column, Computed):
+                function = f"_computed{len(self.namespace)}"
+                self.namespace[function] = column.function
+                arguments = []
+                for argument in column.columns:
+                    arguments.append(f"row[{len(self.columns)}]")
+                    self.columns.append(argument)
+                items.append(f"{key!r}: {function}({', '.join(arguments)})")
+                continue
+
+            index = len(self.columns)
+            self.columns.append(column)
+            value = f"row[{index}]"
+            column_type = column.type
+            if isinstance(column_type, Numeric) and column_type.asdecimal:
+                value = f"float(v{index}) if v{index} else None"
+            elif isinstance(column_type, (DateTime, Date)):
+                value = f"v{index}.isoformat() if v{index} else None"
+            elif isinstance(column_type, JSON):
+                value = f"_loads(v{index})"
+            if value != f"row[{index}]":
+                lines.append(f"    v{index} = row[{index}]")
+            items.append(f"{key!r}: {value}")
+        return '{' + ', '.join(items) + '}'
+
+    def __call__(self, row):
+        return self.serialize(row)
+
+    def many(self, rows):
+        return list(map(self.serialize, rows))
+
+    def subset(self, keys):
+        """Serializer of just the top-level fields in `keys` (all when None), in declared order"""
+        if keys is None:
+            return self
+        unknown = set(keys) - set(self.keys)
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+        return self.subsets(frozenset(keys))
+
+    def _compile_subset(self, keys):
+        return RowSerializer(self.name, [field for field in self.fields if field[0] in keys])
+
+    def narrow(self, fields, derived=None):
+        """
+        (serializer, hidden keys) for a sparse fieldset. `derived` maps the
+        fields the caller adds after serializing to the field they are built
+        from; such source fields are selected too and listed as hidden, to
+        be dropped from the output again.
+        """
+        if fields is None:
+            return self, []
+        derived = derived or {}
+        keys = [key for key in fields if key not in derived]
+        hidden = list(dict.fromkeys(derived[key] for key in fields if key in derived and derived[key] not in keys))
+        return self.subset(keys + hidden), hidden
+
+
+listing_serializer = RowSerializer('listing', [
+    (name, getattr(Listing, name)) for name in (
+        'id', 'title', 'customer_id', 'search_id', 'group_id', 'platform', 'platform_display',
+        'location', 'address', 'postal_code', 'city', 'property_type', 'rooms', 'units',
+        'living_area', 'year_built', 'price', 'price_per_sqm', 'contact_name',
+        'contact_phone', 'contact_email', 'status', 'url', 'description',
+        'scraped_at', 'contacted_at', 'responded_at', 'created_at'
+    )
+])
+
+# Customer.to_dict without account_managers and the counts (CustomerService.serialize_customer_rows adds them)
+customer_serializer = RowSerializer('customer', [
+    ('id', Customer.id), ('first_name', Customer.first_name), ('last_name', Customer.last_name),
+    ('full_name', Computed(lambda first_name, last_name: f"{first_name} {last_name}",
+                           Customer.first_name, Customer.last_name)),
+    ('company_name', Customer.company_name), ('email', Customer.email), ('phone', Customer.phone),
+    ('address', Computed(lambda street, house_number, postal_code, city, country_code: {
+        'street': street, 'house_number': house_number, 'postal_code': postal_code, 'city': city,
+        'country_code': country_code
+    } if street else None, Customer.street, Customer.house_number, Customer.postal_code, Customer.city,
+        Customer.country_code)),
+    ('search_region', Customer.search_region), ('immometrica_email', Customer.immometrica_email),
+    ('property_types', Customer.property_types), ('platforms', Customer.platforms),
+    ('search_filters', Customer.search_filters), ('followup_sequence', Customer.followup_sequence),
+    ('status', Customer.status), ('subscription_tier', Customer.subscription_tier),
+    ('created_at', Customer.created_at), ('last_contact_date', Customer.last_contact_date),
+])
+
+# Search.to_dict without customer_name (SearchService.serialize_search_rows adds it)
+search_serializer = RowSerializer('search', [
+    ('id', Search.id), ('name', Search.name), ('customer_id', Search.customer_id),
+    ('account_manager_id', Search.account_manager_id), ('location_postcode', Search.location_postcode),
+    ('radius_km', Search.radius_km),
+    ('price_range', [('min', Search.price_min), ('max', Search.price_max)]),
+    ('min_units', Search.min_units), ('property_types', Search.property_types),
+    ('platforms', Search.platforms), ('custom_filters', Search.custom_filters),
+    ('is_active', Search.is_active), ('frequency_hours', Search.frequency_hours),
+    ('last_run_at', Search.last_run_at), ('next_run_at', Search.next_run_at),
+    ('total_listings_found', Search.total_listings_found),
+    ('last_listings_count', Search.last_listings_count), ('created_at', Search.created_at),
+])
+
+
+# ==================== #
+# JSON ENCODING
+# ==================== #
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    """Compact UTF-8 JSON bytes of `value` (Decimal -> float, dates -> ISO 8601)"""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask's JSON provider with jsonify() responses encoded by orjson when
+    installed. Output matches the default provider's (dates through its
+    `default`, so still HTTP dates), except non-ASCII stays UTF-8.
+    """
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        try:
+            body = orjson.dumps(obj, default=self.default, option=option)
+        except (TypeError, orjson.JSONEncodeError):
+            # e.g. integers beyond 64 bits or mixed key types when sorting
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
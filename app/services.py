@@ -1,9 +1,27 @@
 # app/services.py
-from typing import List, Dict, Any, Optional
-from sqlalchemy import or_, and_, func
-from .models import AccountManager, Customer, Search, Listing, Mailing, Appointment, db
-from datetime import datetime, timezone
+from typing import List, Dict, Any, Iterable, Optional, Sequence, Tuple
+from sqlalchemy import (or_, and_, func, select, delete, insert, update, literal, bindparam, Float, Integer,
+                        Numeric)
+from sqlalchemy.orm import selectinload
+from .models import (AccountManager, Customer, Search, Listing, ListingBucket, ListingSignature, Mailing,
+                     MessageTemplate, Appointment, CustomerStat, SearchMatch, db, account_manager_customers,
+                     customer_platforms)
+from .database import upsert
+from .pagination import keyset_paginate
+from .search import index_listings, match_query, remove_listings
+from . import autocomplete, matching
+from .cache import get_cache
+from .followups import validate_sequence
+from .geo import postal_code_index, region_prefix
+from .serializers import customer_serializer, search_serializer
+from datetime import datetime, timezone, timedelta
+from decimal import Decimal, InvalidOperation
+from email.utils import make_msgid
+from flask import current_app
+from listing_dedup import MAX_CANDIDATES, Record, candidate_ids, listing_attributes, pack_signature, unpack_signature
 import json
+import message_templates
+import random
 
 
 class AccountManagerService:
@@ -52,6 +70,62 @@ class AccountManagerService:
             AccountManager.first_name
         ).all()
 
+    @staticmethod
+    def get_relationship_counts(account_manager_ids: List[int]) -> Dict[int, Dict[str, int]]:
+        """Get customer/search counts for many account managers with grouped aggregates"""
+        counts = {am_id: {'customer_count': 0, 'search_count': 0} for am_id in account_manager_ids}
+        if not counts:
+            return counts
+
+        customer_rows = db.session.query(
+            account_manager_customers.c.account_manager_id,
+            func.count()
+        ).filter(
+            account_manager_customers.c.account_manager_id.in_(counts)
+        ).group_by(account_manager_customers.c.account_manager_id)
+
+        search_rows = db.session.query(
+            Search.account_manager_id,
+            func.count(Search.id)
+        ).filter(
+            Search.account_manager_id.in_(counts)
+        ).group_by(Search.account_manager_id)
+
+        for am_id, count in customer_rows:
+            counts[am_id]['customer_count'] = count
+        for am_id, count in search_rows:
+            counts[am_id]['search_count'] = count
+        return counts
+
+    @staticmethod
+    def serialize_account_managers(account_managers: List[AccountManager]) -> List[Dict[str, Any]]:
+        """Convert account managers to dicts with batched relationship counts"""
+        counts = AccountManagerService.get_relationship_counts([am.id for am in account_managers])
+        return [am.to_dict(counts[am.id]) for am in account_managers]
+
+    @staticmethod
+    def get_cached_account_managers(active_only: bool = True) -> List[Dict[str, Any]]:
+        """Serialized account managers from the reference cache, with fresh relationship counts"""
+        account_managers = get_cache().get_or_load(
+            ('account_managers', active_only),
+            lambda: [am.to_dict({}) for am in AccountManagerService.get_all_account_managers(active_only)]
+        )
+        counts = AccountManagerService.get_relationship_counts([am['id'] for am in account_managers])
+        return [dict(am, **counts[am['id']]) for am in account_managers]
+
+    @staticmethod
+    def get_cached_account_manager(account_manager_id: int) -> Optional[Dict[str, Any]]:
+        """Serialized account manager from the reference cache (None when missing)"""
+        def load():
+            account_manager = AccountManagerService.get_account_manager_by_id(account_manager_id)
+            return account_manager.to_dict({}) if account_manager else None
+
+        account_manager = get_cache().get_or_load(('account_manager', account_manager_id), load)
+        if account_manager is None:
+            return None
+        counts = AccountManagerService.get_relationship_counts([account_manager_id])
+        return dict(account_manager, **counts[account_manager_id])
+
     @staticmethod
     def get_account_manager_by_id(account_manager_id: int) -> Optional[AccountManager]:
         """Get account manager by ID"""
@@ -106,6 +180,17 @@ class AccountManagerService:
 class CustomerService:
     """Service for Customer CRUD operations"""
 
+    # List fields added after serializing rows -> the row field they are built from
+    DERIVED_FIELDS = {'account_managers': 'id', 'search_count': 'id', 'listing_count': 'id'}
+
+    # Fields a customer list may be narrowed to (fields=)
+    FIELDS = customer_serializer.keys + list(DERIVED_FIELDS)
+
+    @staticmethod
+    def _followup_sequence(steps: Optional[List[Dict[str, Any]]]) -> Optional[str]:
+        """Stored form of a customer's follow-up sequence (None keeps the tier default)"""
+        return json.dumps(validate_sequence(steps)) if steps is not None else None
+
     @staticmethod
     def create_customer(data: Dict[str, Any]) -> Customer:
         """Create a new customer"""
@@ -138,11 +223,14 @@ class CustomerService:
             property_types=json.dumps(data.get('property_types', [])),
             platforms=json.dumps(data.get('platforms', [])),
             search_filters=json.dumps(data.get('search_filters', {})),
+            followup_sequence=CustomerService._followup_sequence(data.get('followup_sequence')),
             status=data.get('status', 'ACTIVE'),
             subscription_tier=data.get('subscription_tier', 'BASIC')
         )
 
         db.session.add(customer)
+        db.session.flush()
+        CustomerService.set_platforms(customer.id, data.get('platforms', []))
         db.session.commit()
 
         # Link to account managers if provided
@@ -154,6 +242,29 @@ class CustomerService:
     @staticmethod
     def get_all_customers(filters: Optional[Dict[str, Any]] = None) -> List[Customer]:
         """Get all customers with optional filters"""
+        query = CustomerService._filtered_query(filters)
+        return query.order_by(Customer.last_name, Customer.first_name).all()
+
+    @staticmethod
+    def get_customers_page(filters: Optional[Dict[str, Any]] = None, per_page: int = 20,
+                           cursor: Optional[str] = None,
+                           columns: Optional[Sequence[Any]] = None) -> Tuple[List[Any], Optional[str]]:
+        """
+        Get one keyset page of customers ordered by name. With `columns`,
+        returns rows of those columns (followed by the sort key) instead of
+        Customer objects.
+        """
+        query = CustomerService._filtered_query(filters)
+        sort_columns = [Customer.last_name, Customer.first_name, Customer.id]
+        if columns:
+            return keyset_paginate(query.with_entities(*columns, *sort_columns), sort_columns, per_page, cursor,
+                                   row_values=lambda row: row[-3:])
+        return keyset_paginate(query.options(selectinload(Customer.account_managers)), sort_columns,
+                               per_page, cursor)
+
+    @staticmethod
+    def _filtered_query(filters: Optional[Dict[str, Any]] = None):
+        """Build the customer query for the given filters"""
         query = Customer.query
 
         if filters:
@@ -174,7 +285,112 @@ class CustomerService:
                     Customer.city.ilike(search_text)
                 ))
 
-        return query.order_by(Customer.last_name, Customer.first_name).all()
+        return query
+
+    @staticmethod
+    def get_relationship_counts(customer_ids: List[int]) -> Dict[int, Dict[str, int]]:
+        """Get search/listing counts for many customers with grouped aggregates"""
+        counts = {customer_id: {'search_count': 0, 'listing_count': 0} for customer_id in customer_ids}
+        if not counts:
+            return counts
+
+        search_rows = db.session.query(
+            Search.customer_id,
+            func.count(Search.id)
+        ).filter(Search.customer_id.in_(counts)).group_by(Search.customer_id)
+
+        listing_rows = db.session.query(
+            Listing.customer_id,
+            func.count(Listing.id)
+        ).filter(Listing.customer_id.in_(counts)).group_by(Listing.customer_id)
+
+        for customer_id, count in search_rows:
+            counts[customer_id]['search_count'] = count
+        for customer_id, count in listing_rows:
+            counts[customer_id]['listing_count'] = count
+        return counts
+
+    @staticmethod
+    def serialize_customers(customers: List[Customer]) -> List[Dict[str, Any]]:
+        """
+        Convert customers to dicts with a fixed number of queries: account
+        managers should be eager-loaded and all counts come from grouped
+        aggregates.
+        """
+        counts = CustomerService.get_relationship_counts([c.id for c in customers])
+        am_ids = {am.id for customer in customers for am in customer.account_managers}
+        am_counts = AccountManagerService.get_relationship_counts(list(am_ids))
+        return [customer.to_dict(counts[customer.id], am_counts) for customer in customers]
+
+    @staticmethod
+    def serialize_customer_rows(rows: List[Any], serializer=customer_serializer, fields: Optional[List[str]] = None,
+                                hidden: Sequence[str] = ()) -> List[Dict[str, Any]]:
+        """
+        Convert rows of `serializer.columns` (see customer_serializer.narrow)
+        to dicts with the DERIVED_FIELDS among `fields` (all without it):
+        account managers from the reference cache, counts from grouped
+        aggregates. `hidden` fields are dropped afterwards.
+        """
+        customers = serializer.many(rows)
+        wanted = set(CustomerService.DERIVED_FIELDS if fields is None else fields)
+        if wanted & set(CustomerService.DERIVED_FIELDS):
+            customer_ids = [customer['id'] for customer in customers]
+
+        if 'account_managers' in wanted:
+            assignments = CustomerService.get_account_managers_by_customer(customer_ids)
+            for customer in customers:
+                customer['account_managers'] = assignments.get(customer['id'], [])
+        if wanted & {'search_count', 'listing_count'}:
+            counts = CustomerService.get_relationship_counts(customer_ids)
+            for customer in customers:
+                for key in ('search_count', 'listing_count'):
+                    if key in wanted:
+                        customer[key] = counts[customer['id']][key]
+        for key in hidden:
+            for customer in customers:
+                del customer[key]
+        return customers
+
+    @staticmethod
+    def get_account_managers_by_customer(customer_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """{customer_id: [serialized account manager]}, from the reference cache with fresh counts"""
+        assignments = {}
+        for chunk in DedupService._chunks(customer_ids):
+            for customer_id, account_manager_id in db.session.execute(
+                select(account_manager_customers.c.customer_id, account_manager_customers.c.account_manager_id)
+                .where(account_manager_customers.c.customer_id.in_(chunk))
+                .order_by(account_manager_customers.c.customer_id, account_manager_customers.c.account_manager_id)
+            ):
+                assignments.setdefault(customer_id, []).append(account_manager_id)
+
+        def load(missing):
+            return {
+                account_manager.id: account_manager.to_dict({})
+                for chunk in DedupService._chunks(missing)
+                for account_manager in AccountManager.query.filter(AccountManager.id.in_(chunk))
+            }
+
+        account_manager_ids = {am_id for am_ids in assignments.values() for am_id in am_ids}
+        account_managers = get_cache().get_many('account_manager', account_manager_ids, load)
+        counts = AccountManagerService.get_relationship_counts(list(account_managers))
+        return {
+            customer_id: [dict(account_managers[am_id], **counts[am_id]) for am_id in am_ids if am_id in account_managers]
+            for customer_id, am_ids in assignments.items()
+        }
+
+    @staticmethod
+    def get_customer_names(customer_ids: Iterable[int]) -> Dict[int, str]:
+        """{customer_id: full name} from the reference cache"""
+        def load(missing):
+            names = {}
+            for chunk in DedupService._chunks(missing):
+                for customer_id, first_name, last_name in db.session.execute(
+                    select(Customer.id, Customer.first_name, Customer.last_name).where(Customer.id.in_(chunk))
+                ):
+                    names[customer_id] = f"{first_name} {last_name}"
+            return names
+
+        return get_cache().get_many('customer_name', set(customer_ids), load)
 
     @staticmethod
     def get_customer_by_id(customer_id: int) -> Optional[Customer]:
@@ -204,6 +420,12 @@ class CustomerService:
                 else:
                     setattr(customer, field, data[field])
 
+        if 'followup_sequence' in data:
+            customer.followup_sequence = CustomerService._followup_sequence(data['followup_sequence'])
+
+        if 'platforms' in data:
+            CustomerService.set_platforms(customer_id, data['platforms'])
+
         # Update account managers if provided
         if 'account_manager_ids' in data:
             CustomerService.assign_account_managers(customer_id, data['account_manager_ids'])
@@ -218,10 +440,43 @@ class CustomerService:
         if not customer:
             return False
 
+        db.session.execute(delete(customer_platforms).where(customer_platforms.c.customer_id == customer_id))
+        db.session.execute(delete(CustomerStat).where(CustomerStat.customer_id == customer_id))
+        listing_ids = db.session.scalars(select(Listing.id).where(Listing.customer_id == customer_id)).all()
+        remove_listings(db.session.connection(), listing_ids)
+        for listing_id in listing_ids:
+            autocomplete.stage(db.session, 'listing', listing_id)
         db.session.delete(customer)
         db.session.commit()
         return True
 
+    @staticmethod
+    def set_platforms(customer_id: int, platforms: Optional[List[str]]) -> None:
+        """Replace the normalized platform rows of a customer (caller commits)"""
+        db.session.execute(delete(customer_platforms).where(customer_platforms.c.customer_id == customer_id))
+        unique_platforms = sorted({p for p in platforms or [] if p})
+        if unique_platforms:
+            db.session.execute(insert(customer_platforms), [
+                {'customer_id': customer_id, 'platform': platform} for platform in unique_platforms
+            ])
+
+    @staticmethod
+    def rebuild_platform_index() -> int:
+        """Rebuild customer_platforms from Customer.platforms for all customers"""
+        db.session.execute(delete(customer_platforms))
+
+        rows = []
+        for customer_id, platforms in db.session.query(Customer.id, Customer.platforms):
+            if isinstance(platforms, str):
+                platforms = json.loads(platforms)
+            for platform in sorted(set(platforms or [])):
+                rows.append({'customer_id': customer_id, 'platform': platform})
+
+        if rows:
+            db.session.execute(insert(customer_platforms), rows)
+        db.session.commit()
+        return len(rows)
+
     @staticmethod
     def assign_account_managers(customer_id: int, account_manager_ids: List[int]) -> Customer:
         """Assign account managers to a customer"""
@@ -245,6 +500,16 @@ class CustomerService:
 class SearchService:
     """Service for Search CRUD operations"""
 
+    # List fields added after serializing rows -> the row field they are built from
+    DERIVED_FIELDS = {'customer_name': 'customer_id'}
+
+    # Fields a search list may be narrowed to (fields=)
+    FIELDS = search_serializer.keys + list(DERIVED_FIELDS)
+
+    # Random delay added to each next_run_at: a fraction of the interval, capped
+    SCHEDULE_JITTER = 0.05
+    MAX_SCHEDULE_JITTER = timedelta(minutes=30)
+
     @staticmethod
     def create_search(data: Dict[str, Any]) -> Search:
         """Create a new search"""
@@ -268,16 +533,70 @@ class SearchService:
             custom_filters=json.dumps(data.get('custom_filters', {})),
             is_active=data.get('is_active', True),
             frequency_hours=data.get('frequency_hours', 24),
-            next_run_at=data.get('next_run_at')
+            # Jittered first run, so searches created together don't all come due at once
+            next_run_at=data.get('next_run_at') or (
+                datetime.now(timezone.utc) + SearchService.schedule_jitter(data.get('frequency_hours', 24))
+            )
         )
 
         db.session.add(search)
         db.session.commit()
         return search
 
+    @staticmethod
+    def schedule_jitter(frequency_hours: Optional[float]) -> timedelta:
+        """Random delay for a run: up to SCHEDULE_JITTER of the interval, at most MAX_SCHEDULE_JITTER"""
+        interval = timedelta(hours=frequency_hours or 0)
+        return min(interval * SearchService.SCHEDULE_JITTER, SearchService.MAX_SCHEDULE_JITTER) * random.random()
+
     @staticmethod
     def get_all_searches(filters: Optional[Dict[str, Any]] = None) -> List[Search]:
         """Get all searches with optional filters"""
+        query = SearchService._filtered_query(filters)
+        return query.order_by(Search.created_at.desc()).all()
+
+    @staticmethod
+    def get_searches_page(filters: Optional[Dict[str, Any]] = None, per_page: int = 20,
+                          cursor: Optional[str] = None,
+                          columns: Optional[Sequence[Any]] = None) -> Tuple[List[Any], Optional[str]]:
+        """
+        Get one keyset page of searches, newest first. With `columns`, returns
+        rows of those columns (followed by the sort key) instead of Search objects.
+        """
+        query = SearchService._filtered_query(filters)
+        sort_columns = [Search.created_at, Search.id]
+        if columns:
+            return keyset_paginate(query.with_entities(*columns, *sort_columns), sort_columns, per_page, cursor,
+                                   descending=True, row_values=lambda row: row[-2:])
+        return keyset_paginate(query, sort_columns, per_page, cursor, descending=True)
+
+    @staticmethod
+    def serialize_searches(searches: List[Search]) -> List[Dict[str, Any]]:
+        """Convert searches to dicts, customer names from the reference cache"""
+        names = CustomerService.get_customer_names(search.customer_id for search in searches)
+        return [search.to_dict(names.get(search.customer_id)) for search in searches]
+
+    @staticmethod
+    def serialize_search_rows(rows: List[Any], serializer=search_serializer, fields: Optional[List[str]] = None,
+                              hidden: Sequence[str] = ()) -> List[Dict[str, Any]]:
+        """
+        Convert rows of `serializer.columns` (see search_serializer.narrow) to
+        dicts, with customer names from the reference cache unless `fields`
+        leaves them out. `hidden` fields are dropped afterwards.
+        """
+        searches = serializer.many(rows)
+        if fields is None or 'customer_name' in fields:
+            names = CustomerService.get_customer_names(search['customer_id'] for search in searches)
+            for search in searches:
+                search['customer_name'] = names.get(search['customer_id'])
+        for key in hidden:
+            for search in searches:
+                del search[key]
+        return searches
+
+    @staticmethod
+    def _filtered_query(filters: Optional[Dict[str, Any]] = None):
+        """Build the search query for the given filters"""
         query = Search.query
 
         if filters:
@@ -288,7 +607,7 @@ class SearchService:
             if 'is_active' in filters:
                 query = query.filter_by(is_active=filters['is_active'])
 
-        return query.order_by(Search.created_at.desc()).all()
+        return query
 
     @staticmethod
     def get_search_by_id(search_id: int) -> Optional[Search]:
@@ -341,10 +660,10 @@ class SearchService:
         search.last_listings_count = listings_found
         search.total_listings_found += listings_found
 
-        # Calculate next run (simple scheduling)
+        # Calculate next run, jittered so searches created together spread out over time
         if search.frequency_hours:
-            from datetime import timedelta
-            search.next_run_at = search.last_run_at + timedelta(hours=search.frequency_hours)
+            interval = timedelta(hours=search.frequency_hours)
+            search.next_run_at = search.last_run_at + interval + SearchService.schedule_jitter(search.frequency_hours)
 
         db.session.commit()
         return search
@@ -353,6 +672,20 @@ class SearchService:
 class ListingService:
     """Service for Listing CRUD operations"""
 
+    # Rows per multi-row INSERT ... ON DUPLICATE KEY UPDATE statement
+    BULK_CHUNK_SIZE = 500
+
+    # Scraped fields written by bulk ingestion (status/customer stay untouched on update, search_id when a row omits it)
+    BULK_FIELDS = [
+        'title', 'description', 'platform', 'platform_display', 'url', 'location',
+        'address', 'postal_code', 'city', 'property_type', 'rooms', 'units', 'living_area',
+        'year_built', 'price', 'price_per_sqm', 'contact_name', 'contact_phone',
+        'contact_email', 'search_id'
+    ]
+
+    # Fields that make up the full-text search document
+    SEARCH_FIELDS = ['title', 'description', 'location', 'address', 'postal_code', 'city']
+
     @staticmethod
     def create_listing(data: Dict[str, Any]) -> Listing:
         """Create a new listing"""
@@ -375,6 +708,7 @@ class ListingService:
             city=data.get('city'),
             property_type=data.get('property_type'),
             rooms=data.get('rooms'),
+            units=data.get('units'),
             living_area=data.get('living_area'),
             year_built=data.get('year_built'),
             price=data.get('price'),
@@ -388,12 +722,308 @@ class ListingService:
         )
 
         db.session.add(listing)
+        StatsService.apply(StatsService.listing_adjustments(
+            listing.customer_id, listing.status, listing.platform, 1
+        ))
+        db.session.flush()
+        index_listings(db.session.connection(), [listing.id])
+        MatchingService.match_listings([listing.id])
+        DedupService.group_listings([listing.id])
         db.session.commit()
         return listing
 
+    @staticmethod
+    def bulk_upsert_listings(rows: Iterable[Any], chunk_size: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Insert or update listings keyed on external_id, one multi-row statement
+        and one commit per chunk (rows without an external_id are plain
+        inserts). Returns one result per input row with status created,
+        updated or rejected.
+        """
+        chunk_size = chunk_size or ListingService.BULK_CHUNK_SIZE
+        results = []
+        chunk = []
+
+        for index, row in enumerate(rows):
+            chunk.append((index, row))
+            if len(chunk) >= chunk_size:
+                results.extend(ListingService._upsert_chunk(chunk))
+                chunk = []
+
+        if chunk:
+            results.extend(ListingService._upsert_chunk(chunk))
+
+        return results
+
+    @staticmethod
+    def _upsert_chunk(chunk: List[Tuple[int, Any]]) -> List[Dict[str, Any]]:
+        """Validate and upsert one chunk of bulk rows"""
+        results = []
+        accepted = []
+
+        for index, row in chunk:
+            try:
+                values = ListingService._bulk_values(row)
+            except ValueError as e:
+                results.append({'index': index, 'external_id': None, 'status': 'rejected', 'error': str(e)})
+                continue
+            accepted.append((index, values, 'search_id' in row))
+
+        if not accepted:
+            return results
+
+        # One lookup per chunk for existing keys and valid customers
+        external_ids = {v['external_id'] for _, v, _ in accepted if v['external_id']}
+        existing = {}
+        if external_ids:
+            existing = {
+                external_id: (customer_id, status, platform)
+                for external_id, customer_id, status, platform in db.session.execute(
+                    select(Listing.external_id, Listing.customer_id, Listing.status, Listing.platform)
+                    .where(Listing.external_id.in_(external_ids))
+                )
+            }
+        customer_ids = {v['customer_id'] for _, v, _ in accepted}
+        known_customers = set(db.session.scalars(
+            select(Customer.id).where(Customer.id.in_(customer_ids))
+        ))
+        search_ids = {v['search_id'] for _, v, _ in accepted if v['search_id'] is not None}
+        known_searches = set(db.session.scalars(
+            select(Search.id).where(Search.id.in_(search_ids))
+        )) if search_ids else set()
+
+        # Rows without a search_id keep the stored one on update, so they get their own statement;
+        # rows without an external_id can't be found again by key and are inserted one by one
+        values_lists = {True: [], False: []}
+        keyless = []
+        pending = []
+        adjustments = []
+        for index, values, has_search_id in accepted:
+            external_id = values['external_id']
+            if values['customer_id'] not in known_customers:
+                results.append({'index': index, 'external_id': external_id, 'status': 'rejected',
+                                'error': f"Customer with ID {values['customer_id']} not found"})
+                continue
+            if values['search_id'] is not None and values['search_id'] not in known_searches:
+                results.append({'index': index, 'external_id': external_id, 'status': 'rejected',
+                                'error': f"Search with ID {values['search_id']} not found"})
+                continue
+
+            if external_id and external_id in existing:
+                # Updates keep customer and status, only the platform counter can move
+                status = 'updated'
+                customer_id, listing_status, platform = existing[external_id]
+                adjustments.append((customer_id, 'listing_platform', platform, -1))
+                adjustments.append((customer_id, 'listing_platform', values['platform'], 1))
+                existing[external_id] = (customer_id, listing_status, values['platform'])
+            else:
+                status = 'created'
+                adjustments.extend(StatsService.listing_adjustments(
+                    values['customer_id'], values['status'], values['platform'], 1
+                ))
+                if external_id:
+                    existing[external_id] = (values['customer_id'], values['status'], values['platform'])
+
+            if external_id:
+                values_lists[has_search_id].append(values)
+            else:
+                keyless.append(values)
+            pending.append({'index': index, 'external_id': external_id, 'status': status})
+
+        if not pending:
+            return results
+
+        now = datetime.now(timezone.utc)
+
+        def upsert_statement(fields):
+            return upsert(
+                Listing.__table__, ['external_id'],
+                lambda incoming: {
+                    **{field: incoming[field] for field in fields},
+                    'scraped_at': incoming.scraped_at,
+                    'updated_at': now
+                }
+            )
+
+        try:
+            for has_search_id, values_list in values_lists.items():
+                if values_list:
+                    fields = [field for field in ListingService.BULK_FIELDS
+                              if has_search_id or field != 'search_id']
+                    db.session.execute(upsert_statement(fields), values_list)
+            keyless_ids = [
+                db.session.execute(insert(Listing.__table__).values(values)).inserted_primary_key[0]
+                for values in keyless
+            ]
+
+            # The chunk's own rows, by key: never rows other writers added meanwhile
+            keys = [result['external_id'] for result in pending if result['external_id']]
+            changed = db.session.execute(
+                select(Listing.id, Listing.title).where(or_(Listing.external_id.in_(keys), Listing.id.in_(keyless_ids)))
+            ).all()
+            index_listings(db.session.connection(), [listing_id for listing_id, _ in changed])
+            for listing_id, title in changed:
+                autocomplete.stage(db.session, 'listing', listing_id, {'title': title})
+            MatchingService.match_listings([listing_id for listing_id, _ in changed])
+            DedupService.group_listings([listing_id for listing_id, _ in changed])
+            StatsService.apply(adjustments)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            # The driver's message only: str(e) would carry the whole multi-row statement
+            error = str(getattr(e, 'orig', None) or e).splitlines()[0][:200]
+            for result in pending:
+                result['status'] = 'rejected'
+                result['error'] = f"Database error: {error}"
+
+        results.extend(pending)
+        results.sort(key=lambda r: r['index'])
+        return results
+
+    @staticmethod
+    def _bulk_values(row: Any) -> Dict[str, Any]:
+        """Turn one bulk payload row into a full column-value dict"""
+        if isinstance(row, ValueError):
+            raise row
+        if not isinstance(row, dict):
+            raise ValueError('Row must be a JSON object')
+
+        for field in ['title', 'platform', 'customer_id']:
+            if not row.get(field):
+                raise ValueError(f"Missing required field: {field}")
+
+        try:
+            customer_id = int(row['customer_id'])
+        except (TypeError, ValueError):
+            raise ValueError('customer_id must be an integer')
+
+        status = row.get('status', 'new')
+        if status not in ['new', 'contacted', 'responded', 'appointment', 'closed']:
+            raise ValueError(f"Invalid status: {status}")
+
+        values = {field: row.get(field) for field in ListingService.BULK_FIELDS}
+        values['platform_display'] = row.get('platform_display', row['platform'])
+        values['external_id'] = str(row['external_id']) if row.get('external_id') else None
+        # Checked here, so one bad value rejects its row instead of the database rejecting the chunk
+        for field, value in values.items():
+            values[field] = ListingService._bulk_column_value(field, value)
+        values['customer_id'] = customer_id
+        values['status'] = status
+
+        now = datetime.now(timezone.utc)
+        values['scraped_at'] = now
+        values['created_at'] = now
+        values['updated_at'] = now
+        values['mailing_history'] = json.dumps([])
+        return values
+
+    @staticmethod
+    def _bulk_column_value(field: str, value: Any) -> Any:
+        """`value` coerced to the type of listings.<field>, ValueError when it does not fit"""
+        if value is None:
+            return None
+        column_type = Listing.__table__.c[field].type
+
+        if isinstance(column_type, (Integer, Numeric)):
+            if isinstance(value, str) and not value.strip():
+                return None
+            if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+                raise ValueError(f"{field} must be a number")
+            try:
+                number = Decimal(str(value).strip())
+            except InvalidOperation:
+                raise ValueError(f"{field} must be a number")
+            if not number.is_finite():
+                raise ValueError(f"{field} must be a number")
+
+            if isinstance(column_type, Integer):
+                if number != number.to_integral_value():
+                    raise ValueError(f"{field} must be a whole number")
+                if abs(number) > 2 ** 31 - 1:
+                    raise ValueError(f"{field} is out of range")
+                return int(number)
+            if isinstance(column_type, Float):
+                return float(number)
+            if column_type.precision and abs(number) >= 10 ** (column_type.precision - (column_type.scale or 0)):
+                raise ValueError(f"{field} is out of range")
+            return number
+
+        if isinstance(value, (dict, list, bool)):
+            raise ValueError(f"{field} must be text")
+        value = str(value)
+        if getattr(column_type, 'length', None) and len(value) > column_type.length:
+            raise ValueError(f"{field} is longer than {column_type.length} characters")
+        return value
+
     @staticmethod
     def get_all_listings(filters: Optional[Dict[str, Any]] = None) -> List[Listing]:
         """Get all listings with optional filters"""
+        query = ListingService._filtered_query(filters)
+        return query.order_by(Listing.scraped_at.desc()).all()
+
+    @staticmethod
+    def iter_listings(filters: Optional[Dict[str, Any]] = None, batch_size: int = 1000,
+                      columns: Optional[Sequence[Any]] = None) -> Iterable[Any]:
+        """
+        Stream listings newest first through a server-side cursor, holding
+        only `batch_size` rows in memory at a time. With `columns`, yields
+        rows of just those columns instead of Listing objects.
+        """
+        query = ListingService._filtered_query(filters)
+        if columns:
+            query = query.with_entities(*columns)
+        stmt = query.order_by(Listing.scraped_at.desc(), Listing.id.desc()).statement
+
+        if columns:
+            yield from db.session.execute(stmt, execution_options={'yield_per': batch_size})
+            return
+
+        for listing in db.session.scalars(stmt, execution_options={'yield_per': batch_size}):
+            yield listing
+            # Keep the identity map from growing with the export
+            db.session.expunge(listing)
+
+    @staticmethod
+    def get_listings_page(filters: Optional[Dict[str, Any]] = None, per_page: int = 20,
+                          cursor: Optional[str] = None, sort: str = 'newest',
+                          columns: Optional[Sequence[Any]] = None) -> Tuple[List[Any], Optional[str]]:
+        """
+        Get one keyset page of listings on (scraped_at, id) newest first, or
+        by search relevance. With `columns`, returns rows of those columns
+        (followed by the sort key) instead of Listing objects.
+        """
+        if sort == 'relevance' and filters and filters.get('search_text'):
+            hits = match_query(db.session.connection(), filters['search_text'])
+            if hits is not None:
+                return ListingService._relevance_page(hits, filters, per_page, cursor, columns)
+
+        query = ListingService._filtered_query(filters)
+        sort_columns = [Listing.scraped_at, Listing.id]
+        if columns:
+            return keyset_paginate(query.with_entities(*columns, *sort_columns), sort_columns, per_page, cursor,
+                                   descending=True, row_values=lambda row: row[-2:])
+        return keyset_paginate(query, sort_columns, per_page, cursor, descending=True)
+
+    @staticmethod
+    def _relevance_page(hits, filters: Dict[str, Any], per_page: int, cursor: Optional[str],
+                        columns: Optional[Sequence[Any]] = None) -> Tuple[List[Any], Optional[str]]:
+        """Keyset page of full-text hits on (score, id), best match first"""
+        other_filters = {k: v for k, v in filters.items() if k != 'search_text'}
+        query = ListingService._filtered_query(other_filters).join(
+            hits, hits.c.listing_id == Listing.id
+        )
+        if columns:
+            query = query.with_entities(*columns, hits.c.score, Listing.id)
+        else:
+            query = query.add_columns(hits.c.score, Listing.id)
+
+        rows, next_cursor = keyset_paginate(query, [hits.c.score, Listing.id], per_page, cursor,
+                                            descending=True, row_values=lambda row: row[-2:])
+        return (rows if columns else [row.Listing for row in rows]), next_cursor
+
+    @staticmethod
+    def _filtered_query(filters: Optional[Dict[str, Any]] = None):
+        """Build the listing query for the given filters"""
         query = Listing.query
 
         if filters:
@@ -405,19 +1035,43 @@ class ListingService:
                 query = query.filter_by(platform=filters['platform'])
             if 'status' in filters:
                 query = query.filter_by(status=filters['status'])
+            if 'radius_km' in filters:
+                postal_codes = ListingService.postal_codes_within(filters['postcode'], filters['radius_km'])
+                if postal_codes is None:
+                    # No centroid data: approximate the radius by the postal region
+                    prefix = region_prefix(filters['postcode'], filters['radius_km'])
+                    query = query.filter(Listing.postal_code.like(f"{prefix}%"))
+                else:
+                    query = query.filter(Listing.postal_code.in_(list(postal_codes)))
             if 'min_price' in filters:
                 query = query.filter(Listing.price >= filters['min_price'])
             if 'max_price' in filters:
                 query = query.filter(Listing.price <= filters['max_price'])
             if 'search_text' in filters:
-                search_text = f"%{filters['search_text']}%"
-                query = query.filter(or_(
-                    Listing.title.ilike(search_text),
-                    Listing.location.ilike(search_text),
-                    Listing.address.ilike(search_text)
-                ))
+                hits = match_query(db.session.connection(), filters['search_text'])
+                if hits is not None:
+                    query = query.filter(Listing.id.in_(select(hits.c.listing_id)))
+                else:
+                    # No indexable words (e.g. only words below MySQL's FULLTEXT token size)
+                    search_text = f"%{filters['search_text']}%"
+                    query = query.filter(or_(
+                        Listing.title.ilike(search_text),
+                        Listing.location.ilike(search_text),
+                        Listing.address.ilike(search_text)
+                    ))
 
-        return query.order_by(Listing.scraped_at.desc()).all()
+        return query
+
+    @staticmethod
+    def postal_codes_within(postcode: str, radius_km: float) -> Optional[Dict[str, float]]:
+        """
+        Postal codes within radius_km of `postcode` with their distance in km,
+        None when no centroid data is installed (flask build-plz-index)
+        """
+        index = postal_code_index()
+        if not len(index):
+            return None
+        return index.within(postcode, radius_km)
 
     @staticmethod
     def get_listing_by_id(listing_id: int) -> Optional[Listing]:
@@ -435,18 +1089,55 @@ class ListingService:
         if status not in valid_statuses:
             raise ValueError(f"Invalid status. Must be one of: {valid_statuses}")
 
+        StatsService.apply([
+            (listing.customer_id, 'listing_status', listing.status, -1),
+            (listing.customer_id, 'listing_status', status, 1)
+        ])
         listing.status = status
 
         # Update timestamps based on status
         now = datetime.now(timezone.utc)
         if status == 'contacted' and not listing.contacted_at:
             listing.contacted_at = now
+            DedupService.mark_group_contacted(listing, now)
         elif status == 'responded' and not listing.responded_at:
             listing.responded_at = now
 
         db.session.commit()
         return listing
 
+    @staticmethod
+    def update_listing(listing_id: int, data: Dict[str, Any]) -> Listing:
+        """Update listing details"""
+        listing = ListingService.get_listing_by_id(listing_id)
+        if not listing:
+            raise LookupError(f"Listing with ID {listing_id} not found")
+
+        # Update allowed fields
+        updatable_fields = [
+            'title', 'external_id', 'platform', 'platform_display',
+            'location', 'address', 'postal_code', 'city', 'property_type',
+            'rooms', 'units', 'living_area', 'year_built', 'price', 'price_per_sqm',
+            'contact_name', 'contact_phone', 'contact_email', 'url', 'description'
+        ]
+
+        if 'platform' in data and data['platform'] != listing.platform:
+            StatsService.apply([
+                (listing.customer_id, 'listing_platform', listing.platform, -1),
+                (listing.customer_id, 'listing_platform', data['platform'], 1)
+            ])
+
+        for field in updatable_fields:
+            if field in data:
+                setattr(listing, field, data[field])
+
+        if any(field in data for field in ListingService.SEARCH_FIELDS):
+            db.session.flush()
+            index_listings(db.session.connection(), [listing.id])
+
+        db.session.commit()
+        return listing
+
     @staticmethod
     def delete_listing(listing_id: int) -> bool:
         """Delete listing"""
@@ -454,92 +1145,691 @@ class ListingService:
         if not listing:
             return False
 
+        StatsService.apply(StatsService.listing_adjustments(
+            listing.customer_id, listing.status, listing.platform, -1
+        ))
+        remove_listings(db.session.connection(), [listing.id])
         db.session.delete(listing)
         db.session.commit()
         return True
 
 
+class MatchingService:
+    """Routes ingested listings to the saved searches they satisfy"""
+
+    # Search ids per existence check (keeps IN lists under driver parameter limits)
+    LOOKUP_CHUNK_SIZE = 5000
+
+    @staticmethod
+    def match_listings(listing_ids: List[int]) -> Dict[str, int]:
+        """
+        Match listings against every active search (caller commits).
+        Replaces their rows in search_matches and attaches listings without
+        a search to the oldest matching search of their own customer.
+        """
+        if not listing_ids:
+            return {'listings': 0, 'matches': 0, 'assigned': 0}
+
+        percolator = matching.get_percolator()
+        rows = db.session.execute(
+            select(*matching.LISTING_COLUMNS).where(Listing.id.in_(listing_ids))
+        ).mappings().all()
+        found = [(row, percolator.match(row)) for row in rows]
+
+        # The index may still hold searches another process deleted or paused
+        matched = sorted({rule.id for _, rules in found for rule in rules})
+        search_ids = set()
+        for start in range(0, len(matched), MatchingService.LOOKUP_CHUNK_SIZE):
+            search_ids.update(db.session.scalars(select(Search.id).where(
+                Search.id.in_(matched[start:start + MatchingService.LOOKUP_CHUNK_SIZE]), Search.is_active.is_(True)
+            )))
+
+        now = datetime.now(timezone.utc)
+        matches = []
+        assignments = []
+        for row, rules in found:
+            rules = [rule for rule in rules if rule.id in search_ids]
+            matches.extend({'search_id': rule.id, 'listing_id': row['id'], 'matched_at': now} for rule in rules)
+            own = [rule.id for rule in rules if rule.customer_id == row['customer_id']]
+            if row['search_id'] is None and own:
+                assignments.append({'listing_id': row['id'], 'new_search_id': min(own)})
+
+        db.session.execute(delete(SearchMatch).where(SearchMatch.listing_id.in_(listing_ids)))
+        if matches:
+            db.session.execute(insert(SearchMatch.__table__), matches)
+        if assignments:
+            listings = Listing.__table__
+            db.session.execute(
+                update(listings).where(listings.c.id == bindparam('listing_id'))
+                .values(search_id=bindparam('new_search_id'))
+                .execution_options(generation_customers={row['customer_id'] for row, _ in found}),
+                assignments
+            )
+
+        return {'listings': len(rows), 'matches': len(matches), 'assigned': len(assignments)}
+
+
+class DedupService:
+    """Links listings of the same property posted on several platforms (see listing_dedup.py)"""
+
+    # Bucket keys / listing ids per IN lookup
+    LOOKUP_CHUNK_SIZE = 1000
+
+    COLUMNS = (Listing.id, Listing.customer_id, Listing.group_id, Listing.title, Listing.description,
+               Listing.postal_code, Listing.living_area, Listing.rooms, Listing.price)
+
+    @staticmethod
+    def _chunks(values):
+        values = sorted(values)
+        size = DedupService.LOOKUP_CHUNK_SIZE
+        return [values[start:start + size] for start in range(0, len(values), size)]
+
+    @staticmethod
+    def group_listings(listing_ids: List[int]) -> Dict[str, int]:
+        """
+        Store the signature and LSH buckets of listings and link ungrouped
+        ones to their duplicates of the same customer. A group's id is the id
+        of its first listing; listings already in a group stay there (caller commits).
+        """
+        if not listing_ids:
+            return {'listings': 0, 'grouped': 0}
+
+        rows = db.session.execute(select(*DedupService.COLUMNS).where(Listing.id.in_(listing_ids))).all()
+        records = {row.id: Record.from_fields(row._mapping) for row in rows}
+        keys = {row.id: records[row.id].keys(scope=row.customer_id) for row in rows}
+        group_ids = {row.id: row.group_id for row in rows}
+        batch_ids = sorted(records)
+
+        db.session.execute(delete(ListingBucket).where(ListingBucket.listing_id.in_(batch_ids)))
+        db.session.execute(delete(ListingSignature).where(ListingSignature.listing_id.in_(batch_ids)))
+
+        # Earlier listings sharing a bucket with the batch, with their stored signatures
+        buckets = {}
+        for chunk in DedupService._chunks({key for row_keys in keys.values() for key in row_keys}):
+            for key, listing_id in db.session.execute(
+                select(ListingBucket.bucket_key, ListingBucket.listing_id)
+                .where(ListingBucket.bucket_key.in_(chunk)).order_by(ListingBucket.listing_id)
+            ):
+                buckets.setdefault(key, []).append(listing_id)
+
+        candidates = {listing_id for ids in buckets.values() for listing_id in ids}
+        for chunk in DedupService._chunks(candidates):
+            for row in db.session.execute(
+                select(*DedupService.COLUMNS, ListingSignature.signature)
+                .outerjoin(ListingSignature, ListingSignature.listing_id == Listing.id)
+                .where(Listing.id.in_(chunk))
+            ):
+                records[row.id] = Record(listing_attributes(row._mapping), unpack_signature(row.signature))
+                group_ids[row.id] = row.group_id
+
+        # A listing without a group joins the group of its most similar duplicate,
+        # unless it contradicts a known member of that group; groups never merge
+        labels = {listing_id: group_ids[listing_id] or listing_id for listing_id in records}
+        members = {}
+        for listing_id, label in labels.items():
+            members.setdefault(label, []).append(listing_id)
+
+        assignments = {}
+        for listing_id in batch_ids:
+            record = records[listing_id]
+            best = None
+            if group_ids[listing_id] is None:
+                for other in candidate_ids(keys[listing_id], buckets, exclude={listing_id}):
+                    score = record.duplicate_score(records[other]) if other in records else None
+                    if score is not None and (best is None or score > best[0]):
+                        best = (score, labels[other])
+                        if score == 1.0:
+                            break
+            for key in keys[listing_id]:
+                buckets.setdefault(key, []).append(listing_id)
+
+            if best is None or best[1] == labels[listing_id]:
+                continue
+            group = best[1]
+            if any(record.conflicts(records[member]) for member in members[group][-MAX_CANDIDATES:]):
+                continue
+            members[labels[listing_id]].remove(listing_id)
+            members[group].append(listing_id)
+            labels[listing_id] = group
+            assignments[listing_id] = group
+            if group in group_ids and group_ids[group] is None:
+                assignments[group] = group_ids[group] = group  # the group's first listing
+
+        if assignments:
+            listings = Listing.__table__
+            db.session.execute(
+                update(listings).where(listings.c.id == bindparam('listing_id'))
+                .values(group_id=bindparam('new_group_id'))
+                .execution_options(generation_customers={row.customer_id for row in rows}),
+                [{'listing_id': listing_id, 'new_group_id': group} for listing_id, group in assignments.items()]
+            )
+
+        db.session.execute(insert(ListingSignature.__table__), [
+            {'listing_id': listing_id, 'signature': pack_signature(records[listing_id].signature)}
+            for listing_id in batch_ids
+        ])
+        bucket_rows = [{'bucket_key': key, 'listing_id': listing_id}
+                       for listing_id in batch_ids for key in set(keys[listing_id])]
+        if bucket_rows:
+            db.session.execute(insert(ListingBucket.__table__), bucket_rows)
+
+        return {'listings': len(rows), 'grouped': len(assignments)}
+
+    @staticmethod
+    def contacted_duplicate(listing: Listing) -> Optional[Listing]:
+        """Another listing of the same property that was already contacted, if any"""
+        if listing.group_id is None:
+            return None
+        return Listing.query.filter(
+            Listing.customer_id == listing.customer_id,
+            Listing.group_id == listing.group_id,
+            Listing.id != listing.id,
+            Listing.contacted_at.isnot(None)
+        ).order_by(Listing.contacted_at).first()
+
+    @staticmethod
+    def mark_group_contacted(listing: Listing, contacted_at: datetime) -> int:
+        """Mark the still new duplicates of a contacted listing as contacted too (caller commits)"""
+        if listing.group_id is None:
+            return 0
+        siblings = Listing.query.filter(
+            Listing.customer_id == listing.customer_id,
+            Listing.group_id == listing.group_id,
+            Listing.id != listing.id,
+            Listing.status == 'new'
+        ).all()
+        for sibling in siblings:
+            StatsService.apply([
+                (sibling.customer_id, 'listing_status', 'new', -1),
+                (sibling.customer_id, 'listing_status', 'contacted', 1)
+            ])
+            sibling.status = 'contacted'
+            sibling.contacted_at = contacted_at
+        return len(siblings)
+
+
+class TemplateService:
+    """Service for versioned outreach templates (compiled and rendered by message_templates.py)"""
+
+    # Listing and customer fields templates can use, see message_templates.VARIABLES
+    CONTEXT_COLUMNS = (Listing.id, Listing.customer_id, Listing.title, Listing.city, Listing.postal_code,
+                       Listing.address, Listing.price, Listing.platform_display, Listing.contact_name,
+                       Customer.first_name, Customer.last_name, Customer.company_name,
+                       Customer.phone.label('customer_phone'), Customer.email.label('customer_email'))
+
+    @staticmethod
+    def get_current(name: str, customer_id: Optional[int] = None) -> Optional[MessageTemplate]:
+        """Latest version of the customer's own template `name`, else of the shared one"""
+        return MessageTemplate.query.filter(
+            MessageTemplate.name == name,
+            or_(MessageTemplate.customer_id == customer_id, MessageTemplate.customer_id.is_(None))
+        ).order_by(MessageTemplate.customer_id.is_(None), MessageTemplate.version.desc()).first()
+
+    @staticmethod
+    def get_templates(customer_id: Optional[int] = None) -> List[MessageTemplate]:
+        """Latest version of every template a customer uses (own ones replace shared ones of the same name)"""
+        latest = {}
+        for template in MessageTemplate.query.filter(
+            or_(MessageTemplate.customer_id == customer_id, MessageTemplate.customer_id.is_(None))
+        ).order_by(MessageTemplate.customer_id.is_(None).desc(), MessageTemplate.version):
+            latest[template.name] = template
+        return [latest[name] for name in sorted(latest)]
+
+    @staticmethod
+    def get_versions(name: str, customer_id: Optional[int] = None) -> List[MessageTemplate]:
+        return MessageTemplate.query.filter_by(name=name, customer_id=customer_id).order_by(
+            MessageTemplate.version.desc()
+        ).all()
+
+    @staticmethod
+    def save_template(data: Dict[str, Any]) -> MessageTemplate:
+        """Validate a template and store it as the next version of its name"""
+        name = (data.get('name') or '').strip()
+        if not name or not data.get('body'):
+            raise ValueError("Field 'name' and 'body' are required")
+
+        customer_id = data.get('customer_id')
+        if customer_id is not None and not db.session.get(Customer, customer_id):
+            raise ValueError(f"Customer with ID {customer_id} not found")
+
+        message_templates.validate(data['body'])
+        message_templates.validate(data.get('subject'))
+
+        version = db.session.scalar(select(func.max(MessageTemplate.version)).where(
+            MessageTemplate.name == name, MessageTemplate.customer_id == customer_id
+        ))
+        template = MessageTemplate(customer_id=customer_id, name=name, version=(version or 0) + 1,
+                                   subject=data.get('subject'), body=data['body'])
+        db.session.add(template)
+        db.session.commit()
+        return template
+
+    @staticmethod
+    def customer_context(first_name: Optional[str], last_name: Optional[str], company_name: Optional[str],
+                         phone: Optional[str], email: Optional[str]) -> Dict[str, Any]:
+        """Template variables describing the customer a message is sent for"""
+        return {
+            'customer_name': ' '.join(filter(None, [first_name, last_name])),
+            'company_name': company_name,
+            'customer_phone': phone,
+            'customer_email': email,
+            'signature': message_templates.customer_signature(first_name, last_name, company_name, phone, email)
+        }
+
+    @staticmethod
+    def listing_context(row) -> Dict[str, Any]:
+        """Template variables of one CONTEXT_COLUMNS row"""
+        return {
+            'title': row.title,
+            'city': row.city,
+            'postal_code': row.postal_code,
+            'address': row.address,
+            'price': row.price,
+            'platform': row.platform_display,
+            'contact_name': row.contact_name,
+            **TemplateService.customer_context(row.first_name, row.last_name, row.company_name,
+                                               row.customer_phone, row.customer_email)
+        }
+
+    @staticmethod
+    def export_template(name: str, customer_id: int) -> Dict[str, Any]:
+        """
+        A customer's current version of a template with the customer's own
+        variables, for the contact bot (message_templates.load_template_file)
+        """
+        customer = db.session.get(Customer, customer_id)
+        if not customer:
+            raise ValueError(f"Customer with ID {customer_id} not found")
+        template = TemplateService.get_current(name, customer_id)
+        if template is None:
+            raise ValueError(f"No '{name}' template found")
+        return {
+            'name': template.name,
+            'version': template.version,
+            'customer_id': customer_id,
+            'subject': template.subject,
+            'body': template.body,
+            'context': TemplateService.customer_context(customer.first_name, customer.last_name,
+                                                        customer.company_name, customer.phone, customer.email)
+        }
+
+    @staticmethod
+    def render_listings(template: MessageTemplate, listing_ids: List[int]) -> Dict[int, Tuple[str, str]]:
+        """{listing_id: (subject, body)} for the given listings, compiling the template once"""
+        rows = []
+        for chunk in DedupService._chunks(listing_ids):
+            rows.extend(db.session.execute(
+                select(*TemplateService.CONTEXT_COLUMNS).join(Customer, Customer.id == Listing.customer_id)
+                .where(Listing.id.in_(chunk))
+            ))
+        contexts = [TemplateService.listing_context(row) for row in rows]
+        subjects = message_templates.render_many(template.subject or '', contexts)
+        bodies = message_templates.render_many(template.body, contexts)
+        return {row.id: (subject, body) for row, subject, body in zip(rows, subjects, bodies)}
+
+
+class MailService:
+    """Service for the outbound mail queue (delivered by `flask send-mails`, see app/mailer.py)"""
+
+    @staticmethod
+    def _message_id_domain() -> Optional[str]:
+        return current_app.config['MAIL_FROM'].rpartition('@')[2] or None
+
+    @staticmethod
+    def queue_mailing(listing: Listing, content: Optional[str] = None, subject: Optional[str] = None,
+                      mailing_type: str = 'initial') -> Mailing:
+        """
+        Queue a mail to the listing's contact and mark a new listing as
+        contacted. Without `content` the customer's `mailing_type` template is rendered.
+        """
+        recipient = (listing.contact_email or '').strip()
+        if '@' not in recipient:
+            raise ValueError(f"Listing {listing.id} has no contact email")
+
+        # The same property on another platform counts as contacted (follow-ups go to the contacted seller)
+        if mailing_type == 'initial':
+            duplicate = DedupService.contacted_duplicate(listing)
+            if duplicate:
+                raise ValueError(f"Seller of listing {listing.id} already contacted through listing "
+                                 f"{duplicate.id} ({duplicate.platform_display})")
+
+        template = None
+        if not content:
+            template = TemplateService.get_current(mailing_type, listing.customer_id)
+            if template is None:
+                raise ValueError(f"No message provided and no '{mailing_type}' template found")
+            rendered_subject, content = TemplateService.render_listings(template, [listing.id])[listing.id]
+            subject = subject or rendered_subject
+
+        mailing = Mailing(
+            listing_id=listing.id,
+            customer_id=listing.customer_id,
+            type=mailing_type,
+            recipient=recipient,
+            subject=subject or f"Ihr Inserat: {listing.title}",
+            content=content,
+            message_id=make_msgid(domain=MailService._message_id_domain()),
+            template_id=template.id if template else None,
+            status='queued',
+            attempts=0
+        )
+        db.session.add(mailing)
+        StatsService.apply([(listing.customer_id, 'mailing_status', 'queued', 1)])
+
+        if listing.status == 'new':
+            ListingService.update_listing_status(listing.id, 'contacted')
+        else:
+            db.session.commit()
+        return mailing
+
+    @staticmethod
+    def queue_campaign(listing_ids: List[int], mailing_type: str = 'initial') -> Dict[str, int]:
+        """
+        Render each customer's `mailing_type` template for many listings and
+        queue the mails in bulk. Only new listings with a contact email are
+        mailed, one per duplicate group and none whose seller was already
+        contacted through a duplicate; they and their duplicates become
+        contacted. Skipped listings are counted by reason, the already
+        contacted ones also listed with the listing they were contacted through.
+        """
+        rows = []
+        for chunk in DedupService._chunks(set(listing_ids)):
+            rows.extend(db.session.execute(
+                select(*TemplateService.CONTEXT_COLUMNS, Listing.contact_email, Listing.status, Listing.group_id)
+                .join(Customer, Customer.id == Listing.customer_id).where(Listing.id.in_(chunk))
+            ))
+
+        # First contacted listing per duplicate group, as DedupService.contacted_duplicate picks it
+        contacted = {}
+        if mailing_type == 'initial':
+            group_ids = {row.group_id for row in rows if row.group_id is not None}
+            for chunk in DedupService._chunks(group_ids):
+                for customer_id, group_id, listing_id in db.session.execute(
+                    select(Listing.customer_id, Listing.group_id, Listing.id)
+                    .where(Listing.group_id.in_(chunk), Listing.contacted_at.isnot(None))
+                    .order_by(Listing.contacted_at.desc())
+                ):
+                    contacted[(customer_id, group_id)] = listing_id
+
+        templates = {}
+        selected = {}
+        groups = set()
+        reasons = {}
+        already_contacted = []
+        for row in rows:
+            if row.status != 'new':
+                reason = 'not_new'
+            elif '@' not in (row.contact_email or ''):
+                reason = 'no_contact_email'
+            elif (row.customer_id, row.group_id) in contacted:
+                reason = 'already_contacted'
+                already_contacted.append({'listing_id': row.id,
+                                          'contacted_listing_id': contacted[(row.customer_id, row.group_id)]})
+            elif row.group_id is not None and row.group_id in groups:
+                reason = 'duplicate'
+            else:
+                if row.group_id is not None:
+                    groups.add(row.group_id)
+                if row.customer_id not in templates:
+                    templates[row.customer_id] = TemplateService.get_current(mailing_type, row.customer_id)
+                template = templates[row.customer_id]
+                if template is not None:
+                    selected.setdefault(template.id, (template, []))[1].append(row)
+                    continue
+                reason = 'no_template'
+            reasons[reason] = reasons.get(reason, 0) + 1
+        skipped = {'skipped': len(rows) - sum(len(template_rows) for _, template_rows in selected.values()),
+                   'skipped_reasons': reasons, 'already_contacted': already_contacted}
+
+        now = datetime.now(timezone.utc)
+        domain = MailService._message_id_domain()
+        mailings = []
+        mailed_groups = set()
+        for template, template_rows in selected.values():
+            contexts = [TemplateService.listing_context(row) for row in template_rows]
+            subjects = message_templates.render_many(template.subject or '', contexts)
+            bodies = message_templates.render_many(template.body, contexts)
+            for row, subject, body in zip(template_rows, subjects, bodies):
+                if row.group_id is not None:
+                    mailed_groups.add(row.group_id)
+                mailings.append({
+                    'listing_id': row.id, 'customer_id': row.customer_id, 'type': mailing_type,
+                    'recipient': row.contact_email.strip(), 'subject': subject or f"Ihr Inserat: {row.title}",
+                    'content': body, 'message_id': make_msgid(domain=domain), 'template_id': template.id,
+                    'status': 'queued', 'attempts': 0, 'created_at': now
+                })
+        if not mailings:
+            return {'queued': 0, **skipped}
+
+        db.session.execute(insert(Mailing.__table__), mailings)
+
+        # The mailed listings and their still new duplicates are contacted now
+        mailed_ids = [mailing['listing_id'] for mailing in mailings]
+        adjustments = [(mailing['customer_id'], 'mailing_status', 'queued', 1) for mailing in mailings]
+        for column, values in ((Listing.id, mailed_ids), (Listing.group_id, mailed_groups)):
+            for chunk in DedupService._chunks(values):
+                contacted = db.session.execute(
+                    select(Listing.customer_id, func.count()).where(column.in_(chunk), Listing.status == 'new')
+                    .group_by(Listing.customer_id)
+                ).all()
+                db.session.execute(update(Listing).where(column.in_(chunk), Listing.status == 'new').values(
+                    status='contacted', contacted_at=now
+                ).execution_options(generation_customers=[customer_id for customer_id, _ in contacted]))
+                for customer_id, count in contacted:
+                    adjustments.append((customer_id, 'listing_status', 'new', -count))
+                    adjustments.append((customer_id, 'listing_status', 'contacted', count))
+
+        StatsService.apply(adjustments)
+        db.session.commit()
+        return {'queued': len(mailings), **skipped}
+
+
+class StatsService:
+    """Service for the customer_stats rollup table"""
+
+    # Key used for NULL statuses/platforms (part of the primary key)
+    UNKNOWN_KEY = 'unknown'
+
+    @staticmethod
+    def apply(adjustments: Iterable[Tuple[int, str, Optional[str], int]]) -> None:
+        """
+        Add deltas to rollup counters as (customer_id, dimension, key, delta)
+        tuples. Runs inside the caller's transaction; the caller commits.
+
+        Counters never go below zero: a decrement only updates an existing
+        row, clamped at 0, so one for a counter that was never counted (rows
+        written before the rollup existed) doesn't create a negative count.
+        """
+        merged = {}
+        for customer_id, dimension, key, delta in adjustments:
+            index = (customer_id, dimension, key or StatsService.UNKNOWN_KEY)
+            merged[index] = merged.get(index, 0) + delta
+
+        table = CustomerStat.__table__
+        increments = [
+            {'customer_id': customer_id, 'dimension': dimension, 'key': key, 'count': delta}
+            for (customer_id, dimension, key), delta in merged.items() if delta > 0
+        ]
+        if increments:
+            stmt = upsert(
+                table, ['customer_id', 'dimension', 'key'],
+                lambda incoming: {'count': table.c['count'] + incoming['count']}
+            )
+            db.session.execute(stmt, increments)
+
+        decrements = [
+            {'stat_customer_id': customer_id, 'stat_dimension': dimension, 'stat_key': key, 'delta': delta}
+            for (customer_id, dimension, key), delta in merged.items() if delta < 0
+        ]
+        if decrements:
+            # GREATEST on MySQL/PostgreSQL; SQLite's two-argument max() is the same scalar function
+            greatest = func.max if db.session.get_bind().dialect.name == 'sqlite' else func.greatest
+            db.session.execute(
+                update(table).where(
+                    table.c.customer_id == bindparam('stat_customer_id'),
+                    table.c.dimension == bindparam('stat_dimension'),
+                    table.c.key == bindparam('stat_key')
+                ).values(count=greatest(table.c['count'] + bindparam('delta'), 0)),
+                decrements
+            )
+
+    @staticmethod
+    def listing_adjustments(customer_id: int, status: Optional[str], platform: Optional[str],
+                            delta: int) -> List[Tuple[int, str, Optional[str], int]]:
+        """Build the counter deltas for adding (+1) or removing (-1) a listing"""
+        return [
+            (customer_id, 'listing_status', status, delta),
+            (customer_id, 'listing_platform', platform, delta)
+        ]
+
+    @staticmethod
+    def rebuild(customer_ids: Optional[List[int]] = None) -> None:
+        """Recompute rollup counters from the source tables (all customers by default)"""
+        table = CustomerStat.__table__
+        columns = ['customer_id', 'dimension', 'key', 'count']
+
+        sources = [
+            ('listing_status', Listing.customer_id, Listing.status, Listing.id),
+            ('listing_platform', Listing.customer_id, Listing.platform, Listing.id),
+            ('mailing_status', Mailing.customer_id, Mailing.status, Mailing.id)
+        ]
+
+        cleanup = delete(table)
+        if customer_ids is not None:
+            cleanup = cleanup.where(table.c.customer_id.in_(customer_ids))
+        db.session.execute(cleanup)
+
+        for dimension, customer_column, key_column, id_column in sources:
+            key = func.coalesce(key_column, StatsService.UNKNOWN_KEY)
+            source = select(
+                customer_column, literal(dimension), key, func.count(id_column)
+            ).group_by(customer_column, key)
+            if customer_ids is not None:
+                source = source.where(customer_column.in_(customer_ids))
+            db.session.execute(insert(table).from_select(columns, source))
+
+        db.session.commit()
+
+    @staticmethod
+    def get_counters(dimension: str, customer_id: Optional[int] = None) -> Dict[str, int]:
+        """Read one dimension of counters for a customer, or summed over all customers"""
+        query = db.session.query(CustomerStat.key, func.sum(CustomerStat.count)).filter(
+            CustomerStat.dimension == dimension
+        )
+        if customer_id:
+            query = query.filter(CustomerStat.customer_id == customer_id)
+
+        return {key: int(count) for key, count in query.group_by(CustomerStat.key) if count}
+
+    @staticmethod
+    def get_customer_counters(customer_id: int) -> Dict[str, Dict[str, int]]:
+        """Read every counter of one customer with a single primary-key range lookup"""
+        counters = {'listing_status': {}, 'listing_platform': {}, 'mailing_status': {}}
+        rows = db.session.query(CustomerStat.dimension, CustomerStat.key, CustomerStat.count).filter(
+            CustomerStat.customer_id == customer_id
+        )
+        for dimension, key, count in rows:
+            counters.setdefault(dimension, {})[key] = count
+        return counters
+
+
 class DashboardService:
     """Service for Dashboard statistics"""
 
+    LISTING_STATUSES = ['new', 'contacted', 'responded', 'appointment', 'closed']
+
     @staticmethod
     def get_dashboard_stats(customer_id: Optional[int] = None) -> Dict[str, Any]:
         """Get dashboard statistics"""
         stats = {}
 
-        # Get counts
         if customer_id:
-            # For specific customer
-            stats['listings_count'] = Listing.query.filter_by(
-                customer_id=customer_id
-            ).count()
-
+            # For specific customer: counters come from the rollup table
+            counters = StatsService.get_customer_counters(customer_id)
+            status_counts = counters['listing_status']
+            stats['listings_count'] = sum(status_counts.values())
             stats['listings_by_status'] = {
-                'new': Listing.query.filter_by(
-                    customer_id=customer_id, status='new'
-                ).count(),
-                'contacted': Listing.query.filter_by(
-                    customer_id=customer_id, status='contacted'
-                ).count(),
-                'responded': Listing.query.filter_by(
-                    customer_id=customer_id, status='responded'
-                ).count(),
-                'appointment': Listing.query.filter_by(
-                    customer_id=customer_id, status='appointment'
-                ).count()
+                status: status_counts.get(status, 0) for status in ['new', 'contacted', 'responded', 'appointment']
             }
 
-            stats['mailings_count'] = Mailing.query.filter_by(
-                customer_id=customer_id
-            ).count()
+            mailings_count = sum(counters['mailing_status'].values())
+            replied_count = counters['mailing_status'].get('replied', 0)
 
+            stats['mailings_count'] = mailings_count
             stats['appointments_count'] = Appointment.query.filter_by(
                 customer_id=customer_id
             ).count()
 
             # Calculate response rate
-            total_mailings = stats['mailings_count']
-            responded_mailings = Mailing.query.filter_by(
-                customer_id=customer_id, status='replied'
-            ).count()
-
             stats['response_rate'] = round(
-                (responded_mailings / total_mailings * 100) if total_mailings > 0 else 0,
+                (replied_count / mailings_count * 100) if mailings_count > 0 else 0,
                 2
             )
 
         else:
-            # For all customers (admin view)
-            stats['customers_count'] = Customer.query.filter_by(
-                status='ACTIVE'
-            ).count()
-
-            stats['account_managers_count'] = AccountManager.query.filter_by(
-                is_active=True
-            ).count()
-
-            stats['searches_count'] = Search.query.filter_by(
-                is_active=True
-            ).count()
-
-            stats['total_listings'] = Listing.query.count()
+            # For all customers (admin view), all totals in one round-trip
+            totals = DashboardService._admin_totals()
+            stats['customers_count'] = totals['customers']
+            stats['account_managers_count'] = totals['account_managers']
+            stats['searches_count'] = totals['searches']
+            stats['total_listings'] = totals['listings']
 
         return stats
 
     @staticmethod
-    def get_platform_distribution(customer_id: Optional[int] = None) -> Dict[str, int]:
-        """Get listing distribution by platform"""
-        from sqlalchemy import func
+    def get_admin_overview() -> Dict[str, Any]:
+        """Get totals and customer platform distribution for the admin dashboard"""
+        totals = DashboardService._admin_totals()
+        return {
+            'totals': {
+                'account_managers': totals['account_managers'],
+                'customers': totals['customers'],
+                'searches': totals['searches'],
+                'recent_customers': totals['recent_customers']
+            },
+            'platforms': DashboardService.get_customer_platform_distribution()
+        }
 
-        query = db.session.query(
-            Listing.platform,
-            func.count(Listing.id).label('count')
-        )
+    @staticmethod
+    def _admin_totals() -> Dict[str, int]:
+        """Count admin dashboard totals with scalar subqueries in a single SELECT"""
+        thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
+
+        row = db.session.query(
+            select(func.count(AccountManager.id)).where(
+                AccountManager.is_active.is_(True)).scalar_subquery().label('account_managers'),
+            select(func.count(Customer.id)).where(
+                Customer.status == 'ACTIVE').scalar_subquery().label('customers'),
+            select(func.count(Search.id)).where(
+                Search.is_active.is_(True)).scalar_subquery().label('searches'),
+            select(func.count(Customer.id)).where(
+                Customer.created_at >= thirty_days_ago).scalar_subquery().label('recent_customers'),
+            select(func.count(Listing.id)).scalar_subquery().label('listings')
+        ).one()
+
+        return dict(row._mapping)
 
-        if customer_id:
-            query = query.filter_by(customer_id=customer_id)
+    @staticmethod
+    def get_listing_status_counts(customer_id: Optional[int] = None) -> Dict[str, int]:
+        """Get listing counts per status from the rollup table"""
+        counts = StatsService.get_counters('listing_status', customer_id)
+        for status in DashboardService.LISTING_STATUSES:
+            counts.setdefault(status, 0)
+        return counts
 
-        query = query.group_by(Listing.platform)
+    @staticmethod
+    def get_customer_platform_distribution() -> Dict[str, int]:
+        """Get number of customers per configured platform (reference cache)"""
+        def load():
+            rows = db.session.query(
+                customer_platforms.c.platform,
+                func.count(customer_platforms.c.customer_id)
+            ).group_by(customer_platforms.c.platform)
+            return {platform: count for platform, count in rows}
 
-        results = query.all()
-        return {platform: count for platform, count in results}
\ No newline at end of file
+        return dict(get_cache().get_or_load(('platform_distribution', None), load))
+
+    @staticmethod
+    def get_platform_distribution(customer_id: Optional[int] = None) -> Dict[str, int]:
+        """Get listing distribution by platform from the rollup table"""
+        return StatsService.get_counters('listing_platform', customer_id)
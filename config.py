@@ -25,5 +25,39 @@ class Config:
     # API Settings
     API_PREFIX = '/api/v1'
 
+    # Autocomplete index: full rebuild interval, picks up writes from other processes (0 = never)
+    AUTOCOMPLETE_REFRESH_SECONDS = int(os.environ.get('AUTOCOMPLETE_REFRESH_SECONDS', 300))
+
+    # Reverse matching index: full rebuild interval, picks up searches changed by other processes (0 = never)
+    MATCHING_REFRESH_SECONDS = int(os.environ.get('MATCHING_REFRESH_SECONDS', 300))
+
+    # Reference data cache (account managers, customer names, platforms): entries, seconds an entry
+    # lives, and how often other processes' writes are checked in change_generations (0 = never)
+    REFERENCE_CACHE_SIZE = int(os.environ.get('REFERENCE_CACHE_SIZE', 10000))
+    REFERENCE_CACHE_TTL = int(os.environ.get('REFERENCE_CACHE_TTL', 300))
+    REFERENCE_CACHE_SYNC_SECONDS = float(os.environ.get('REFERENCE_CACHE_SYNC_SECONDS', 5))
+
+    # Outbound mail (flask send-mails)
+    SMTP_HOST = os.environ.get('SMTP_HOST', 'localhost')
+    SMTP_PORT = int(os.environ.get('SMTP_PORT', 25))
+    SMTP_USERNAME = os.environ.get('SMTP_USERNAME')
+    SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
+    SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '').lower() in ('1', 'true', 'yes')
+    MAIL_FROM = os.environ.get('MAIL_FROM', 'kontakt@extraimmobilien.de')
+
+    # Persistent SMTP connections per sender process, mails claimed per batch
+    MAIL_CONNECTIONS = int(os.environ.get('MAIL_CONNECTIONS', 8))
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', 500))
+
+    # Per recipient domain and sender process: sustained mails per minute and burst size
+    MAIL_DOMAIN_RATE = int(os.environ.get('MAIL_DOMAIN_RATE', 120))
+    MAIL_DOMAIN_BURST = int(os.environ.get('MAIL_DOMAIN_BURST', 20))
+
+    # Delivery attempts before a mailing is given up (status 'error')
+    MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', 5))
+
+    # Maildir directories / mbox files `flask ingest-replies` reads (comma separated)
+    REPLY_MAILBOXES = [path for path in os.environ.get('REPLY_MAILBOXES', '').split(',') if path]
+
 
 config = Config()
\ No newline at end of file
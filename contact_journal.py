@@ -0,0 +1,210 @@
+"""
+Persistent, idempotent journal of contact jobs for immometricabot.
+
+Every (column, URL) job is keyed by a normalized listing key so the same
+listing is never contacted twice, even across crashes and re-runs of the same
+CSV. State lives in a local SQLite file:
+
+    pending -> in_progress -> sent
+                           -> failed (retried until MAX_ATTEMPTS)
+                           -> unknown (interrupted by a crash, left for manual review)
+
+A job interrupted mid-contact may already have reached the seller, so it is
+never retried automatically; reset it with `reopen()` once checked.
+"""
+
+import re
+import sqlite3
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+JOURNAL_DB_PATH = "contact_jobs.sqlite3"
+MAX_ATTEMPTS = 3
+
+# Platform listing IDs, so tracking/query variations of a URL map to one key
+_EXTERNAL_ID_PATTERNS = [
+    ("immoscout24", re.compile(r"immobilienscout24\.de/expose/(\d+)")),
+    ("kleinanzeigen", re.compile(r"kleinanzeigen\.de/s-anzeige/[^/]+/(\d+)")),
+    ("immowelt", re.compile(r"immowelt\.de/(?:expose|projekte/expose)/([A-Za-z0-9]+)")),
+    ("immonet", re.compile(r"immonet\.de/angebot/(\d+)")),
+]
+
+_TRACKING_PARAMS = re.compile(r"^(utm_|ref|referrer|source|campaign|fbclid|gclid)", re.IGNORECASE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS contact_jobs (
+    job_key     TEXT PRIMARY KEY,
+    column_name TEXT NOT NULL,
+    url         TEXT NOT NULL,
+    status      TEXT NOT NULL DEFAULT 'pending'
+                CHECK (status IN ('pending', 'in_progress', 'sent', 'failed', 'unknown')),
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    last_error  TEXT,
+    created_at  TEXT NOT NULL,
+    updated_at  TEXT NOT NULL,
+    started_at  TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_contact_jobs_status ON contact_jobs (status);
+"""
+
+
+def normalize_url(url):
+    """Lowercase scheme/host, drop fragment, tracking params and trailing slash"""
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not _TRACKING_PARAMS.match(k)
+    ))
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ""))
+
+
+def listing_key(url):
+    """Stable key for a listing URL: platform:external_id when known, else the normalized URL"""
+    normalized = normalize_url(url)
+    for platform, pattern in _EXTERNAL_ID_PATTERNS:
+        match = pattern.search(normalized)
+        if match:
+            return f"{platform}:{match.group(1)}"
+    return normalized
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ContactJournal:
+    """SQLite-backed job state, written by a single process (the bot or the pool parent)"""
+
+    def __init__(self, path=JOURNAL_DB_PATH, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def recover(self):
+        """
+        After a crash, jobs left in_progress may or may not have been sent:
+        mark them unknown so they are not contacted again without review
+        """
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE contact_jobs SET status = 'unknown', last_error = 'interrupted', updated_at = ? "
+                "WHERE status = 'in_progress'",
+                (_now(),)
+            )
+        return cursor.rowcount
+
+    def unknown(self):
+        """(column, url) of the jobs interrupted mid-contact, to check by hand"""
+        return self.conn.execute(
+            "SELECT column_name, url FROM contact_jobs WHERE status = 'unknown' ORDER BY updated_at"
+        ).fetchall()
+
+    def reopen(self, url):
+        """Make a checked unknown job retryable again (the seller was not contacted)"""
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE contact_jobs SET status = 'failed', updated_at = ? WHERE job_key = ? AND status = 'unknown'",
+                (_now(), listing_key(url))
+            )
+        return cursor.rowcount
+
+    def reopen_unknown(self):
+        """Make every unknown job retryable again, once all were checked by hand"""
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE contact_jobs SET status = 'failed', updated_at = ? WHERE status = 'unknown'", (_now(),)
+            )
+        return cursor.rowcount
+
+    def track(self, jobs, batch_size=500):
+        """
+        Register (column, url, ...) jobs batch by batch and lazily yield those
+        still open, unchanged, so a consumer can start before the whole
+        source is read
+        """
+        seen = set()  # keys handed out in this run
+        batch = []
+        for job in jobs:
+            batch.append(job)
+            if len(batch) >= batch_size:
+                yield from self._open_in_batch(batch, seen)
+                batch = []
+        if batch:
+            yield from self._open_in_batch(batch, seen)
+
+    def _open_in_batch(self, batch, seen):
+        now = _now()
+        keys = [listing_key(job[1]) for job in batch]
+        self._insert([(key, job[0], job[1], now, now) for key, job in zip(keys, batch)])
+
+        placeholders = ",".join("?" * len(keys))
+        states = dict(
+            (key, (status, attempts)) for key, status, attempts in self.conn.execute(
+                f"SELECT job_key, status, attempts FROM contact_jobs WHERE job_key IN ({placeholders})",
+                keys
+            )
+        )
+
+        for key, job in zip(keys, batch):
+            status, attempts = states[key]
+            if key in seen or self._closed(status, attempts):
+                continue
+            seen.add(key)
+            yield job
+
+    def _insert(self, rows):
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO contact_jobs (job_key, column_name, url, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            return self.conn.total_changes - before
+
+    def is_done(self, url):
+        row = self.conn.execute(
+            "SELECT status, attempts FROM contact_jobs WHERE job_key = ?", (listing_key(url),)
+        ).fetchone()
+        return bool(row) and self._closed(*row)
+
+    def _closed(self, status, attempts):
+        """Whether a job must not be contacted (again)"""
+        return status in ("sent", "unknown") or (status == "failed" and attempts >= self.max_attempts)
+
+    def mark_started(self, job):
+        """Mark a job in_progress, registering it first when it was not tracked (job dict with url, column)"""
+        now = _now()
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO contact_jobs (job_key, column_name, url, status, attempts, created_at, updated_at, "
+                "started_at) VALUES (?, ?, ?, 'in_progress', 1, ?, ?, ?) "
+                "ON CONFLICT (job_key) DO UPDATE SET status = 'in_progress', attempts = attempts + 1, "
+                "started_at = excluded.started_at, updated_at = excluded.updated_at",
+                (listing_key(job["url"]), job.get("column", ""), job["url"], now, now, now)
+            )
+
+    def record(self, result):
+        """
+        Store the outcome of a job (result dict with url, status and optional
+        error): sent, unknown (may have been sent, held for review) or failed
+        """
+        status = result["status"] if result["status"] in ("sent", "unknown") else "failed"
+        now = _now()
+        with self.conn:
+            self.conn.execute(
+                "UPDATE contact_jobs SET status = ?, last_error = ?, finished_at = ?, updated_at = ? "
+                "WHERE job_key = ?",
+                (status, result.get("error"), now, now, listing_key(result["url"]))
+            )
+
+    def summary(self):
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM contact_jobs GROUP BY status"))
@@ -0,0 +1,264 @@
+"""
+Parallel contact automation for ImmoMetrica exports.
+
+Runs N isolated browser sessions in worker processes. The parent process owns
+the job list, hands out (column, URL) jobs only when the platform's rate limit
+allows it, and records every job in the ContactJournal (contact_journal.py).
+
+A worker process that dies is replaced (up to max_restarts); the job it held
+may already have reached the seller, so it is reported as unknown and held
+for review rather than retried. Jobs left when no worker is left are
+reported as failed, never dropped.
+"""
+
+import multiprocessing as mp
+import queue
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+# Minimum seconds between two contacts on the same platform, across all workers
+DEFAULT_RATE_LIMITS = {
+    "Link ImmoScout": 30.0,
+    "Link Kleinanzeigen": 15.0,
+}
+DEFAULT_RATE_LIMIT = 10.0
+
+# Replacement worker processes started per pool run after crashes
+DEFAULT_MAX_RESTARTS = 3
+
+
+class RateLimiter:
+    """Per-platform minimum spacing between job starts"""
+
+    def __init__(self, limits=None, default=DEFAULT_RATE_LIMIT, clock=time.monotonic):
+        self.limits = dict(DEFAULT_RATE_LIMITS if limits is None else limits)
+        self.default = default
+        self.clock = clock
+        self._next_allowed = {}
+
+    def wait_time(self, platform):
+        """Seconds until `platform` may start another job (0 when ready)"""
+        return max(0.0, self._next_allowed.get(platform, 0.0) - self.clock())
+
+    def acquire(self, platform):
+        """Book the next slot of `platform`; call only when wait_time() is 0"""
+        interval = self.limits.get(platform, self.default)
+        self._next_allowed[platform] = self.clock() + interval
+
+
+def default_driver_factory():
+    from immometricabot import setup_driver
+    return setup_driver()
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _worker_main(worker_id, driver_factory, handlers, job_queue, result_queue, initializer=None, initargs=()):
+    """Worker process: one browser session, jobs in, results out"""
+    import immometricabot
+
+    # Spacing is enforced by the parent's RateLimiter
+    immometricabot.disable_pacing()
+    if initializer is not None:
+        initializer(*initargs)
+
+    driver = driver_factory()
+    try:
+        while True:
+            job = job_queue.get()
+            if job is None:
+                break
+
+            result = dict(job, worker=worker_id, started_at=_now())
+            started = time.monotonic()
+            try:
+                immometricabot.contact_url(driver, job["column"], job["url"], job["job_id"], handlers,
+                                           job.get("listing"))
+                result["status"] = "sent"
+            except immometricabot.SubmitUnconfirmed as e:
+                result["status"] = "unknown"
+                result["error"] = str(e)
+            except Exception as e:
+                result["status"] = "failed"
+                result["error"] = str(e)
+                try:
+                    driver.save_screenshot(f"pool_error_{job['job_id']}.png")
+                except Exception:
+                    pass
+
+            result["finished_at"] = _now()
+            result["duration"] = round(time.monotonic() - started, 3)
+            result_queue.put((worker_id, result))
+    finally:
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+
+def run_worker_pool(jobs, workers=4, driver_factory=default_driver_factory, handlers=None,
+                    rate_limiter=None, journal=None, poll_interval=0.5, buffer_size=1000,
+                    max_restarts=DEFAULT_MAX_RESTARTS, initializer=None, initargs=()):
+    """
+    Contact every (column, url) or (column, url, listing fields) in `jobs`
+    using `workers` browser processes.
+
+    `driver_factory`, `handlers` and `initializer` must be picklable
+    (module-level functions); tests pass a fake driver factory and stub
+    handlers. Each worker calls initializer(*initargs) once before its first
+    job, like multiprocessing.Pool (the bot loads the outreach template). Returns one result per
+    job (status sent, unknown or failed); when a ContactJournal is given, jobs
+    are marked in_progress on dispatch and their outcome is recorded as they
+    finish.
+    """
+    rate_limiter = rate_limiter or RateLimiter()
+    ctx = mp.get_context("spawn")
+    result_queue = ctx.Queue()
+
+    # One FIFO per platform so a rate-limited platform never blocks the others.
+    # `jobs` is consumed lazily, keeping at most `buffer_size` jobs in memory.
+    jobs = iter(jobs)
+    pending = {}
+    buffered = 0
+    total = 0
+
+    def refill():
+        nonlocal buffered, total, jobs
+        while jobs is not None and buffered < buffer_size:
+            try:
+                column, url, *listing = next(jobs)
+            except StopIteration:
+                jobs = None
+                break
+            total += 1
+            buffered += 1
+            pending.setdefault(column, deque()).append(
+                {"job_id": total, "column": column, "url": url, "listing": listing[0] if listing else None}
+            )
+
+    # Each worker gets its own queue so the parent always knows who holds which job
+    processes = {}
+    job_queues = {}
+    started = 0
+    restarts = 0
+
+    def start_worker():
+        nonlocal started
+        started += 1
+        job_queues[started] = ctx.Queue()
+        process = ctx.Process(
+            target=_worker_main,
+            args=(started, driver_factory, handlers, job_queues[started], result_queue, initializer, initargs),
+            daemon=True,
+        )
+        process.start()
+        processes[started] = process
+        return started
+
+    for _ in range(workers):
+        start_worker()
+
+    idle = deque(processes)
+    assigned = {}     # worker_id -> job
+    results = []
+
+    def finish(result):
+        results.append(result)
+        if journal:
+            journal.record(result)
+        mark = {"sent": "✓", "unknown": "?"}.get(result["status"], "✗")
+        print(f"{mark} [{len(results)}/{total}] worker {result.get('worker')} {result['column']}: {result['url']}")
+
+    def reap():
+        """Report the jobs of workers whose process died and start replacements"""
+        nonlocal restarts
+        for worker_id in [w for w, p in processes.items() if not p.is_alive()]:
+            del processes[worker_id]
+            if worker_id in idle:
+                idle.remove(worker_id)
+            job = assigned.pop(worker_id, None)
+            if job:
+                # It may have been sent before the crash: held for review, not retried
+                finish(dict(job, worker=worker_id, status="unknown",
+                            error="worker process died", finished_at=_now()))
+            if restarts < max_restarts:
+                restarts += 1
+                idle.append(start_worker())
+                print(f"↻ worker {worker_id} died, started worker {started} ({restarts}/{max_restarts} restarts)")
+            else:
+                print(f"✗ worker {worker_id} died, no restarts left")
+
+    print(f"→ Worker pool: {workers} worker(s)")
+
+    try:
+        refill()
+        while (pending or assigned) and processes:
+            reap()
+
+            # Hand out jobs while a worker is idle and its platform slot is open
+            next_wait = None
+            while pending and idle:
+                column = next((c for c in pending if rate_limiter.wait_time(c) == 0), None)
+                if column is None:
+                    next_wait = min(rate_limiter.wait_time(c) for c in pending)
+                    break
+                job = pending[column].popleft()
+                if not pending[column]:
+                    del pending[column]
+                buffered -= 1
+                refill()
+                rate_limiter.acquire(column)
+                worker_id = idle.popleft()
+                assigned[worker_id] = job
+                if journal:
+                    journal.mark_started(job)
+                job_queues[worker_id].put(job)
+
+            timeout = poll_interval if next_wait is None else min(poll_interval, max(next_wait, 0.01))
+            try:
+                worker_id, result = result_queue.get(timeout=timeout)
+            except queue.Empty:
+                continue
+
+            # A result of a job already reported for a dead worker is stale
+            if assigned.get(worker_id, {}).get("job_id") == result["job_id"]:
+                del assigned[worker_id]
+                idle.append(worker_id)
+                finish(result)
+
+        # No worker left: report the jobs never handed out instead of dropping them
+        leftover = [job for column_jobs in pending.values() for job in column_jobs]
+        pending.clear()
+        for column, url, *_ in jobs or ():
+            total += 1
+            leftover.append({"job_id": total, "column": column, "url": url})
+        for job in leftover:
+            finish(dict(job, worker=None, status="failed", error="no worker left", finished_at=_now()))
+
+    finally:
+        for worker_id, process in processes.items():
+            job_queues[worker_id].put(None)
+        for process in processes.values():
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+
+    return results
+
+
+def handled_jobs(jobs, handlers=None):
+    """Keep only (column, url, ...) jobs whose column has a contact handler"""
+    from immometricabot import COLUMN_HANDLERS
+
+    handlers = handlers or COLUMN_HANDLERS
+    skipped = set()
+    for job in jobs:
+        column = job[0]
+        if column in handlers:
+            yield job
+        elif column not in skipped:
+            skipped.add(column)
+            print(f"⚠ No handler for column {column}, skipping")
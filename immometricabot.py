@@ -10,62 +10,89 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import Select 
-import pandas as pd
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
 import time
 import os
-import re
-import csv
-import json
-from pathlib import Path
+
+from contact_journal import JOURNAL_DB_PATH, ContactJournal
+from listing_dedup import unique_contact_jobs
+from message_templates import DEFAULT_TEMPLATES, VARIABLES, load_template_file, render
+from offers_csv import csv_to_json, iter_offer_rows, read_csv_by_columns
 
 TEST_IMMOSCOUT_LIMIT = 11
 
+# Contact form text for every platform (message_templates.py) and the customer's
+# variables (signature etc.). main() replaces the built-in text by the customer's
+# current 'initial' template exported with `flask export-template` (--template).
+OUTREACH_TEMPLATE = DEFAULT_TEMPLATES['initial']['body']
+OUTREACH_CONTEXT = {}
+
 
 # Configuration
 CSV_FILE_PATH = "/home/rania/Downloads/offers.csv"  # Change this to your CSV file path
 
-def setup_driver():
-    """Initialize Chrome driver with options"""
-    options = webdriver.ChromeOptions()
-    options.add_argument('--start-maximized')
-    options.add_argument('--disable-blink-features=AutomationControlled')
-    options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    options.add_experimental_option('useAutomationExtension', False)
-    
-    driver = webdriver.Chrome(options=options)
-    return driver
+# Pacing in seconds. The worker pool (contact_pool.py) turns these off and
+# enforces per-platform rate limits centrally instead. SUBMIT_COOLDOWN only
+# spaces contacts out: a submit counts as sent once wait_for_submit saw the
+# page react, never because time passed.
+PAGE_SETTLE_DELAY = 2
+CLICK_DELAY = 0.5
+TYPING_DELAY = 0.02
+SUBMIT_COOLDOWN = 30
 
+# Seconds a submitted form may take to react (navigate away or go away)
+SUBMIT_TIMEOUT = 20
 
-def read_csv_by_columns(csv_path):
-    print(f"Reading CSV file: {csv_path}")
 
-    df = pd.read_csv(csv_path, sep=';', on_bad_lines='skip', encoding='utf-8')
+class SubmitUnconfirmed(Exception):
+    """A form was submitted but the page never confirmed it: the message may or may not be sent"""
 
-    start_col = 28  # AC
-    end_col = 45    # AT
 
-    if len(df.columns) <= end_col:
-        raise ValueError("CSV does not contain columns up to AT")
+def disable_pacing():
+    """Turn off the fixed human-like pauses (used by pool workers)"""
+    global PAGE_SETTLE_DELAY, CLICK_DELAY, TYPING_DELAY, SUBMIT_COOLDOWN
+    PAGE_SETTLE_DELAY = CLICK_DELAY = TYPING_DELAY = SUBMIT_COOLDOWN = 0
 
-    target_df = df.iloc[:, start_col:end_col + 1]
 
-    column_urls = {}
+def use_outreach_template(body, context):
+    """Contact with `body` rendered for the customer `context` (also a pool worker initializer)"""
+    global OUTREACH_TEMPLATE, OUTREACH_CONTEXT
+    OUTREACH_TEMPLATE, OUTREACH_CONTEXT = body, dict(context)
 
-    for col_name in target_df.columns:
-        urls = []
 
-        for cell in target_df[col_name]:
-            if pd.notna(cell):
-                found = re.findall(r'https?://[^\s;]+', str(cell))
-                urls.extend(found)
+def outreach_message(listing=None):
+    """The outreach text for one listing: the template rendered with the CSV row's fields"""
+    context = dict(OUTREACH_CONTEXT)
+    context.update((key, value) for key, value in (listing or {}).items() if key in VARIABLES)
+    return render(OUTREACH_TEMPLATE, context)
 
-        if urls:
-            column_urls[col_name] = urls
-            print(f"✓ {col_name}: {len(urls)} URLs")
 
-    return column_urls
+def pause(seconds):
+    if seconds:
+        time.sleep(seconds)
 
 
+def type_text(element, text):
+    """Type text char by char with TYPING_DELAY, or in one go when pacing is off"""
+    if not TYPING_DELAY:
+        element.send_keys(text)
+        return
+
+    for c in text:
+        element.send_keys(c)
+        time.sleep(TYPING_DELAY)
+
+def setup_driver():
+    """Initialize Chrome driver with options"""
+    options = webdriver.ChromeOptions()
+    options.add_argument('--start-maximized')
+    options.add_argument('--disable-blink-features=AutomationControlled')
+    options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    options.add_experimental_option('useAutomationExtension', False)
+    
+    driver = webdriver.Chrome(options=options)
+    return driver
+
 
 def open_detail_page(driver, url, index):
     """Open a detail page URL"""
@@ -80,7 +107,7 @@ def open_detail_page(driver, url, index):
         wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
         
         print(f"[{index}] ✓ Page opened!")
-        time.sleep(2)
+        pause(PAGE_SETTLE_DELAY)
         
         return True
         
@@ -128,7 +155,7 @@ def click_news_button(driver, index):
             driver.execute_script(
                 "arguments[0].scrollIntoView({block:'center'});", button
             )
-            time.sleep(0.5)
+            pause(CLICK_DELAY)
             driver.execute_script("arguments[0].click();", button)
 
             print(f"[{index}] ✓ Contact button clicked")
@@ -142,7 +169,7 @@ def click_news_button(driver, index):
     driver.save_screenshot(f"contact_button_fail_{index}.png")
     return False
 
-def fill_and_submit_immoscout_message(driver, index):
+def fill_and_submit_immoscout_message(driver, index, listing=None):
     wait = WebDriverWait(driver, 20)
 
     print(f"[{index}] Filling ImmoScout contact form")
@@ -152,26 +179,10 @@ def fill_and_submit_immoscout_message(driver, index):
         EC.presence_of_element_located((By.ID, "message"))
     )
 
-    test_message = """Guten Tag,
- 
-Wir sind ein Immobilien Makler und Investor aus der Region und sind sehr an Ihrer Immobilie interessiert. Wir würden gerne mehr über diese erfahren. Sie passt zu mehreren unserer hinterlegten Suchprofile - welche wir bei Kunden aufgenommen haben, bei denen ein vorheriger Ankauf nicht geklappt hat. Daher würde ich mich
-sehr freuen, wenn Sie mir Ihre Telefonnummer und E-Mail
-zur Verfügung stellen könnten, damit wir uns kurz zu Ihrem Objekt austauschen können.
- 
-Mit freundlichen Grüßen
- 
-René Grote
- 
-Immo-VT GmbH / Mittelstr. 11 / 40789 Monheim am Rhein
-T: +49 2173 2950501
-F: +49 2173 8984977
-Interessent@immo-vt.de
-info@immo-vt.de"""
+    message = outreach_message(listing)
 
     message_box.clear()
-    for c in test_message:
-        message_box.send_keys(c)
-        time.sleep(0.02)
+    type_text(message_box, message)
 
     print(f"[{index}] ✓ Message filled")
 
@@ -251,17 +262,40 @@ info@immo-vt.de"""
     driver.execute_script(
         "arguments[0].scrollIntoView({block:'center'});", submit_btn
     )
-    time.sleep(0.5)
+    pause(CLICK_DELAY)
+    url_before = driver.current_url
     driver.execute_script("""
     arguments[0].closest('form').requestSubmit();
 """, submit_btn)
+    wait_for_submit(driver, submit_btn, url_before)
     print(f"[{index}] ✅ ImmoScout form submitted")
 
-    print(f"[{index}] ⏳ Waiting 30s before next URL...")
-    time.sleep(30)  # wait after submit to avoid issues
+    if SUBMIT_COOLDOWN:
+        print(f"[{index}] ⏳ Waiting {SUBMIT_COOLDOWN}s before next URL...")
+        pause(SUBMIT_COOLDOWN)  # wait after submit to avoid issues
 
 
-def handle_immoscout(driver, index):
+def wait_for_submit(driver, submit_btn, url_before, timeout=None):
+    """
+    Block until the page reacts to a form post: the URL changes, or the
+    submit button is replaced or hidden (form swapped for a confirmation).
+    Raises SubmitUnconfirmed when nothing happens within SUBMIT_TIMEOUT.
+    """
+    def submitted(d):
+        if d.current_url != url_before:
+            return True
+        try:
+            return not submit_btn.is_displayed()
+        except StaleElementReferenceException:
+            return True
+
+    try:
+        WebDriverWait(driver, timeout or SUBMIT_TIMEOUT).until(submitted)
+    except TimeoutException:
+        raise SubmitUnconfirmed(f"Form submit not confirmed within {timeout or SUBMIT_TIMEOUT}s")
+
+
+def handle_immoscout(driver, index, listing=None):
     """
     Full ImmoScout flow:
     - Click Nachricht
@@ -275,10 +309,10 @@ def handle_immoscout(driver, index):
     if not click_news_button(driver, index):
         raise Exception("Failed to click Nachricht button")
 
-    time.sleep(2)  # small human pause
+    pause(PAGE_SETTLE_DELAY)  # small human pause
 
     # Step 2: Fill + submit message
-    fill_and_submit_immoscout_message(driver, index)
+    fill_and_submit_immoscout_message(driver, index, listing)
 
 """    
 def click_premium_unlock_button(driver, index, wait_seconds=2):
@@ -315,7 +349,7 @@ def click_premium_unlock_button(driver, index, wait_seconds=2):
         driver.save_screenshot(f"premium_button_fail_{index}.png")
         return False
 """
-def handle_kleinanzeigen(driver, index):
+def handle_kleinanzeigen(driver, index, listing=None):
     wait = WebDriverWait(driver, 20)
 
     print(f"[{index}] Kleinanzeigen: clicking contact")
@@ -330,12 +364,10 @@ def handle_kleinanzeigen(driver, index):
         EC.presence_of_element_located((By.ID, "viewad-contact-message"))
     )
 
-    message = "hi i inquire you for this test"
+    message = outreach_message(listing)
 
     textarea.clear()
-    for c in message:
-        textarea.send_keys(c)
-        time.sleep(0.02)
+    type_text(textarea, message)
 
     print(f"[{index}] ✓ Kleinanzeigen message filled")
 
@@ -375,7 +407,22 @@ def process_columns_sequentially(driver, column_urls, delay=3):
         print(f"✓ Finished column {col_name}")
 """
 
-def process_columns_sequentially(driver, column_urls, delay=3):
+def contact_url(driver, col_name, url, index, handlers=None, listing=None):
+    """Open one listing URL and run the contact handler of its column with the listing's CSV fields"""
+    handler = (handlers or COLUMN_HANDLERS).get(col_name)
+    if not handler:
+        raise ValueError(f"No handler for column {col_name}")
+
+    driver.get(url)
+
+    WebDriverWait(driver, 20).until(
+        EC.presence_of_element_located((By.TAG_NAME, "body"))
+    )
+
+    handler(driver, index, dict(listing or {}, platform=col_name))
+
+
+def process_columns_sequentially(driver, column_urls, delay=3, journal=None, listings=None):
 
     for col_name, urls in column_urls.items():
 
@@ -400,20 +447,34 @@ def process_columns_sequentially(driver, column_urls, delay=3):
 
         for index, url in enumerate(urls, start=1):
             try:
+                if journal and journal.is_done(url):
+                    print(f"\n[{index}/{len(urls)}] ↷ already handled, skipping {url}")
+                    continue
+
                 print(f"\n[{index}/{len(urls)}] {url}")
 
-                driver.get(url)
+                if journal:
+                    journal.mark_started({"column": col_name, "url": url})
 
-                WebDriverWait(driver, 20).until(
-                    EC.presence_of_element_located((By.TAG_NAME, "body"))
-                )
+                contact_url(driver, col_name, url, index, listing=(listings or {}).get(url))
 
-                handler(driver, index)
+                if journal:
+                    journal.record({"url": url, "status": "sent"})
 
                 time.sleep(delay)
 
+            except SubmitUnconfirmed as e:
+                # May have reached the seller: held for review instead of retried
+                print(f"? Unconfirmed on URL {index}: {e}")
+                if journal:
+                    journal.record({"url": url, "status": "unknown", "error": str(e)})
+                driver.save_screenshot(f"immoscout_unconfirmed_{index}.png")
+                continue
+
             except Exception as e:
                 print(f"✗ Failed on URL {index}: {e}")
+                if journal:
+                    journal.record({"url": url, "status": "failed", "error": str(e)})
                 driver.save_screenshot(f"immoscout_error_{index}.png")
                 continue
 
@@ -477,48 +538,51 @@ def preview_scraped_urls(column_urls, max_per_column=10):
 
     print("\n" + "="*70)
 
-def csv_to_json(csv_path, json_path=None, encoding="utf-8"):
-    """
-    Convert CSV file to JSON file.
-
-    :param csv_path: Path to CSV file
-    :param json_path: Optional output JSON path
-    :param encoding: File encoding
-    :return: List of dicts (JSON data)
-    """
-
-    csv_path = Path(csv_path)
-
-    if not csv_path.exists():
-        raise FileNotFoundError(f"CSV file not found: {csv_path}")
-
-    if json_path is None:
-        json_path = csv_path.with_suffix(".json")
-    else:
-        json_path = Path(json_path)
-
-    data = []
-
-    with csv_path.open(mode="r", encoding=encoding, newline="") as f:
-        reader = csv.DictReader(f)
-
-        for row in reader:
-            # Normalize empty strings to None
-            cleaned_row = {
-                key: (value.strip() if value and value.strip() else None)
-                for key, value in row.items()
-            }
-            data.append(cleaned_row)
-
-    with json_path.open(mode="w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+def parse_args():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ImmoMetrica CSV contact automation")
+    parser.add_argument("--csv", default=CSV_FILE_PATH, help="Path to the ImmoMetrica offers CSV")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Browser sessions to run in parallel (1 = sequential test mode)")
+    parser.add_argument("--template", metavar="FILE",
+                        help="Customer template written by `flask export-template` (default: built-in text)")
+    parser.add_argument("--journal", default=JOURNAL_DB_PATH,
+                        help="SQLite job journal used to resume after a crash")
+    parser.add_argument("--reopen", action="append", default=[], metavar="URL",
+                        help="Retry an interrupted job checked by hand (seller not contacted); repeatable")
+    parser.add_argument("--reopen-unknown", action="store_true",
+                        help="Retry every interrupted job (all checked by hand)")
+    return parser.parse_args()
+
+
+def reopen_jobs(journal_path, urls, all_unknown=False):
+    """Release interrupted ('unknown') journal jobs so the next run retries them"""
+    journal = ContactJournal(journal_path)
+    try:
+        for url in urls:
+            if journal.reopen(url):
+                print(f"↻ reopened {url}")
+            else:
+                print(f"⚠ not held for review, left as is: {url}")
+        if all_unknown:
+            print(f"↻ reopened {journal.reopen_unknown()} interrupted job(s)")
+        held = len(journal.unknown())
+    finally:
+        journal.close()
 
-    print(f"✓ CSV converted to JSON → {json_path}")
+    if held:
+        print(f"⚠ {held} job(s) still held for review")
 
-    return data
 
 def main():
     """Main automation flow"""
+    args = parse_args()
+    if args.reopen or args.reopen_unknown:
+        reopen_jobs(args.journal, args.reopen, args.reopen_unknown)
+        return
+
+    csv_file_path = args.csv
     driver = None
     
     try:
@@ -527,26 +591,69 @@ def main():
         print("="*60)
         
         # Check if CSV file exists
-        if not os.path.exists(CSV_FILE_PATH):
-            print(f"\n✗ ERROR: CSV file not found at: {CSV_FILE_PATH}")
+        if not os.path.exists(csv_file_path):
+            print(f"\n✗ ERROR: CSV file not found at: {csv_file_path}")
             print("\nPlease update the CSV_FILE_PATH in the script with your file location.")
             print("Example: CSV_FILE_PATH = 'C:/Users/YourName/Downloads/offers(2).csv'")
             return
+
+        # The customer's current 'initial' template, rendered per listing with the CSV row's fields
+        if args.template:
+            use_outreach_template(*load_template_file(args.template))
+            print(f"✓ Outreach template: {args.template}")
+        else:
+            print("⚠ No --template given: contacting with the built-in default text."
+                  " Export the customer's template with `flask export-template`.")
         
-        # Read CSV file
-        column_urls = read_csv_by_columns(CSV_FILE_PATH)
+        # Persistent job journal: skip listings already contacted by earlier runs
+        journal = ContactJournal(args.journal)
+        recovered = journal.recover()
+        if recovered:
+            print(f"⚠ {recovered} job(s) were interrupted by a previous crash and may have been sent;"
+                  f" they are skipped until checked by hand:")
+        held = journal.unknown()
+        for column, url in held:
+            print(f"   ? [{column}] {url}")
+        if held:
+            print("  Once checked, release them with --reopen URL or --reopen-unknown")
+
+        if args.workers > 1:
+            # Parallel mode: N browsers, central per-platform rate limits.
+            # Jobs stream straight from the CSV, so contacting starts while it is still parsed.
+            # One job per property: a listing posted on several platforms is contacted once.
+            from contact_pool import run_worker_pool
+
+            try:
+                jobs = journal.track(unique_contact_jobs(iter_offer_rows(csv_file_path), COLUMN_HANDLERS))
+                results = run_worker_pool(jobs, workers=args.workers, journal=journal,
+                                          initializer=use_outreach_template,
+                                          initargs=(OUTREACH_TEMPLATE, OUTREACH_CONTEXT))
+                print(f"→ Journal status: {journal.summary()}")
+            finally:
+                journal.close()
+
+            sent = sum(1 for r in results if r["status"] == "sent")
+            print(f"\n✓ Worker pool finished: {sent}/{len(results)} sent (journal: {journal.path})")
+            return
+
+        # Read CSV file, one contact link per property, with its row's fields for the message
+        jobs = list(unique_contact_jobs(iter_offer_rows(csv_file_path), COLUMN_HANDLERS))
+        listings = {url: fields for _, url, fields in jobs}
+        column_urls = read_csv_by_columns(csv_file_path, jobs)
 
         # 👀 PREVIEW URLs BEFORE RUNNING BROWSER
         preview_scraped_urls(column_urls, max_per_column=5)
 
-        
         # Setup browser
         print("\nInitializing browser...")
         driver = setup_driver()
         print("✓ Browser ready")
         
         # Process all listings
-        process_columns_sequentially(driver, column_urls, delay=3)
+        try:
+            process_columns_sequentially(driver, column_urls, delay=3, journal=journal, listings=listings)
+        finally:
+            journal.close()
         
         # Print summary
         #print_summary(results)
@@ -0,0 +1,261 @@
+"""
+Near-duplicate detection for listings posted on several platforms.
+
+The same property often appears on ImmoScout24, Kleinanzeigen and Immowelt
+with slightly different titles and texts. Every listing gets a record:
+
+- normalized attributes: postal code, living area, rooms, price
+- a MinHash signature of the character shingles of title + description
+
+Candidates are found by LSH: the signature is cut into BANDS bands, and
+listings sharing any band hash (or the exact attribute fingerprint) are
+compared; everything else is never looked at. A candidate is a duplicate
+when no attribute contradicts it and the texts are similar enough, or when
+postal code, area and price all agree closely.
+
+Plain stdlib, so both the contact bot and the Flask app use it.
+"""
+
+import hashlib
+import math
+import operator
+import re
+import struct
+import zlib
+
+from text_folding import UMLAUTS, WORD
+
+NUM_HASHES = 64
+BANDS = 16                  # 16 bands of 4 rows: pairs above ~0.5 similarity collide with high probability
+ROWS = NUM_HASHES // BANDS
+SHINGLE_SIZE = 4
+SIMILARITY_THRESHOLD = 0.5
+
+# Items compared per lookup (the most recent of each bucket) and group
+# members checked for contradictions, so boilerplate texts or identical
+# attributes can't make lookups quadratic
+MAX_CANDIDATES = 50
+
+# Attribute tolerances between two listings of the same property
+AREA_TOLERANCE = 0.05
+PRICE_TOLERANCE = 0.10
+ROOMS_TOLERANCE = 0.5
+
+# Closer agreement that makes a duplicate even when the texts differ
+STRONG_AREA_TOLERANCE = 0.02
+STRONG_PRICE_TOLERANCE = 0.03
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def _number(value):
+    try:
+        number = float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+    return number if number and number > 0 else None
+
+
+def _close(a, b, tolerance):
+    return abs(a - b) <= tolerance * max(a, b)
+
+
+def shingles(text):
+    """Character SHINGLE_SIZE-grams of the folded words of `text`"""
+    text = ' '.join(WORD.findall((text or '').lower().translate(UMLAUTS)))
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(shingle_set):
+    """
+    NUM_HASHES-value signature (one-permutation hashing: each shingle hash
+    lands in one bin, the bin keeps its minimum; empty bins borrow from the
+    next filled one). None for empty text.
+    """
+    if not shingle_set:
+        return None
+
+    # crc32 is stable across processes and an order of magnitude cheaper than blake2b here
+    bins = [None] * NUM_HASHES
+    for value in map(zlib.crc32, (shingle.encode('utf-8') for shingle in shingle_set)):
+        position, rest = value % NUM_HASHES, value // NUM_HASHES
+        if bins[position] is None or rest < bins[position]:
+            bins[position] = rest
+
+    if None in bins:
+        filled = [i for i, value in enumerate(bins) if value is not None]
+        for i, value in enumerate(bins):
+            if value is None:
+                source = next((j for j in filled if j > i), filled[0])
+                bins[i] = zlib.crc32(f"{i}:{bins[source]}".encode('utf-8'))
+    return tuple(bins)
+
+
+def pack_signature(signature):
+    return struct.pack(f'>{NUM_HASHES}I', *signature) if signature is not None else None
+
+
+def unpack_signature(data):
+    return struct.unpack(f'>{NUM_HASHES}I', data) if data else None
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(map(operator.eq, signature, other)) / NUM_HASHES
+
+
+def listing_attributes(fields):
+    """Normalized comparable attributes of a listing (missing values are None)"""
+    postal_code = re.sub(r'\D', '', str(fields.get('postal_code') or '')) or None
+    return {
+        'postal_code': postal_code,
+        'living_area': _number(fields.get('living_area')),
+        'rooms': _number(fields.get('rooms')),
+        'price': _number(fields.get('price')),
+    }
+
+
+def fingerprint(attributes):
+    """Exact blocking key of well-described listings (None when postal code, area or price is missing)"""
+    if not (attributes['postal_code'] and attributes['living_area'] and attributes['price']):
+        return None
+    return '|'.join([
+        attributes['postal_code'],
+        str(round(attributes['living_area'] / 5)),
+        str(round(attributes['rooms'] * 2) if attributes['rooms'] else ''),
+        str(round(math.log(attributes['price']) / math.log(1 + STRONG_PRICE_TOLERANCE))),
+    ])
+
+
+class Record:
+    """What dedup compares for one listing"""
+
+    __slots__ = ('attributes', 'signature', 'fingerprint')
+
+    def __init__(self, attributes, signature):
+        self.attributes = attributes
+        self.signature = signature
+        self.fingerprint = fingerprint(attributes)
+
+    @classmethod
+    def from_fields(cls, fields):
+        text = ' '.join(filter(None, [fields.get('title'), fields.get('description')]))
+        return cls(listing_attributes(fields), minhash(shingles(text)))
+
+    def keys(self, scope=''):
+        """LSH bucket keys (63-bit ints): one per signature band plus the attribute fingerprint"""
+        keys = []
+        if self.signature is not None:
+            for band in range(BANDS):
+                values = self.signature[band * ROWS:(band + 1) * ROWS]
+                keys.append(_hash(f"{scope}|{band}|{values}") >> 1)
+        if self.fingerprint is not None:
+            keys.append(_hash(f"{scope}|fp|{self.fingerprint}") >> 1)
+        return keys
+
+    def conflicts(self, other):
+        a, b = self.attributes, other.attributes
+        if a['postal_code'] and b['postal_code'] and a['postal_code'] != b['postal_code']:
+            return True
+        if a['living_area'] and b['living_area'] and not _close(a['living_area'], b['living_area'], AREA_TOLERANCE):
+            return True
+        if a['price'] and b['price'] and not _close(a['price'], b['price'], PRICE_TOLERANCE):
+            return True
+        return bool(a['rooms'] and b['rooms'] and abs(a['rooms'] - b['rooms']) > ROOMS_TOLERANCE)
+
+    def similarity(self, other):
+        """Estimated text similarity, 0 when either listing has no text"""
+        if self.signature is None or other.signature is None:
+            return 0.0
+        return similarity(self.signature, other.signature)
+
+    def duplicate_score(self, other):
+        """Text similarity when `other` is a duplicate of this listing, else None"""
+        if self.conflicts(other):
+            return None
+        score = self.similarity(other)
+        if score >= SIMILARITY_THRESHOLD:
+            return score
+        a, b = self.attributes, other.attributes
+        if (self.fingerprint and other.fingerprint
+                and _close(a['living_area'], b['living_area'], STRONG_AREA_TOLERANCE)
+                and _close(a['price'], b['price'], STRONG_PRICE_TOLERANCE)):
+            return score
+        return None
+
+
+def candidate_ids(keys, buckets, exclude=()):
+    """Distinct items sharing a bucket with `keys`, most recent first, at most MAX_CANDIDATES"""
+    seen = set(exclude)
+    found = []
+    for key in keys:
+        for other in reversed(buckets.get(key, [])[-MAX_CANDIDATES:]):
+            if other not in seen:
+                seen.add(other)
+                found.append(other)
+                if len(found) == MAX_CANDIDATES:
+                    return found
+    return found
+
+
+class DuplicateIndex:
+    """
+    In-memory LSH index assigning every added item to a group (the id of its
+    first item). An item joins the group of its most similar duplicate unless
+    it contradicts one of that group's items.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.records = {}
+        self.groups = {}
+        self.members = {}
+
+    def add(self, item_id, record, scope=''):
+        """Index `record` and return its group id"""
+        keys = record.keys(scope)
+        best = None
+        for other in candidate_ids(keys, self.buckets):
+            score = record.duplicate_score(self.records[other])
+            if score is not None and (best is None or score > best[0]):
+                best = (score, self.groups[other])
+                if score == 1.0:
+                    break
+
+        group = item_id
+        if best is not None and not any(record.conflicts(self.records[m])
+                                        for m in self.members[best[1]][-MAX_CANDIDATES:]):
+            group = best[1]
+
+        self.records[item_id] = record
+        self.groups[item_id] = group
+        self.members.setdefault(group, []).append(item_id)
+        for key in keys:
+            self.buckets.setdefault(key, []).append(item_id)
+        return group
+
+
+def unique_contact_jobs(offer_rows, handlers):
+    """
+    Yield one (column, url, fields) contact job per property: rows are
+    walked in export order, the first link with a handler is used and rows
+    that duplicate an earlier row are skipped. `fields` are the row's
+    listing fields, for the message text.
+    """
+    index = DuplicateIndex()
+    duplicates = 0
+    for row_number, (fields, links) in enumerate(offer_rows):
+        link = next(((column, url) for column, url in links if column in handlers), None)
+        if link is None:
+            continue
+        group = index.add(row_number, Record.from_fields(fields))
+        if group != row_number:
+            duplicates += 1
+            continue
+        yield link + (fields,)
+
+    if duplicates:
+        print(f"↷ {duplicates} duplicate listing(s) skipped (same property as an earlier row)")
@@ -0,0 +1,163 @@
+"""
+Outreach message templates (Jinja2).
+
+Templates are plain text with {{ variables }} from VARIABLES, e.g.
+
+    Guten Tag{% if contact_name %} {{ contact_name }}{% endif %},
+    wir interessieren uns für Ihr Objekt "{{ title }}" in {{ city }}.
+
+A template source is compiled once and kept in an LRU cache keyed by its
+text, so editing a template (a new version in the message_templates table)
+naturally compiles the new text while old versions age out. Rendering only
+runs the compiled code: thousands of messages per second.
+
+Templates are saved through the API, so they run in Jinja's immutable
+sandbox: attributes starting with '_' and unsafe calls are refused at
+render time, and validate() rejects '__' attribute access on save.
+
+Only needs Jinja2 (a Flask dependency), so the contact bot uses it too: it
+reads a customer's template from the file `flask export-template` writes.
+"""
+
+import json
+from functools import lru_cache
+
+from jinja2 import StrictUndefined, TemplateSyntaxError, meta, nodes
+from jinja2.sandbox import ImmutableSandboxedEnvironment
+
+# Names a template may use; unknown names are rejected when a template is saved
+VARIABLES = (
+    'title', 'city', 'postal_code', 'address', 'price', 'platform', 'contact_name',
+    'customer_name', 'company_name', 'customer_phone', 'customer_email', 'signature',
+)
+
+COMPILED_CACHE_SIZE = 256
+
+# Built-in texts, used by the contact bot and to seed the database
+DEFAULT_TEMPLATES = {
+    'initial': {
+        'subject': 'Anfrage zu Ihrer Immobilie{% if title %}: {{ title }}{% endif %}',
+        'body': """Guten Tag{% if contact_name %} {{ contact_name }}{% endif %},
+
+Wir sind ein Immobilien Makler und Investor aus der Region und sind sehr an Ihrer Immobilie interessiert. Wir würden gerne mehr über diese erfahren. Sie passt zu mehreren unserer hinterlegten Suchprofile - welche wir bei Kunden aufgenommen haben, bei denen ein vorheriger Ankauf nicht geklappt hat. Daher würde ich mich
+sehr freuen, wenn Sie mir Ihre Telefonnummer und E-Mail
+zur Verfügung stellen könnten, damit wir uns kurz zu Ihrem Objekt austauschen können.
+
+Mit freundlichen Grüßen
+
+{% if signature %}{{ signature }}{% else %}René Grote
+
+Immo-VT GmbH / Mittelstr. 11 / 40789 Monheim am Rhein
+T: +49 2173 2950501
+F: +49 2173 8984977
+Interessent@immo-vt.de
+info@immo-vt.de{% endif %}""",
+    },
+    'followup_1': {
+        'subject': 'Nachfrage zu Ihrer Immobilie{% if title %}: {{ title }}{% endif %}',
+        'body': """Guten Tag{% if contact_name %} {{ contact_name }}{% endif %},
+
+vor einigen Tagen hatten wir Ihnen zu Ihrem Objekt{% if city %} in {{ city }}{% endif %} geschrieben. Wir sind weiterhin sehr interessiert und würden uns über eine kurze Rückmeldung mit Ihrer Telefonnummer freuen.
+
+Mit freundlichen Grüßen
+
+{{ signature }}""",
+    },
+    'followup_2': {
+        'subject': 'Letzte Nachfrage zu Ihrer Immobilie{% if title %}: {{ title }}{% endif %}',
+        'body': """Guten Tag{% if contact_name %} {{ contact_name }}{% endif %},
+
+wir möchten ein letztes Mal nachfragen, ob Ihr Objekt{% if city %} in {{ city }}{% endif %} noch verfügbar ist. Falls ja, melden Sie sich gerne jederzeit bei uns.
+
+Mit freundlichen Grüßen
+
+{{ signature }}""",
+    },
+}
+
+
+def _format_euro(value):
+    """1250000 -> '1.250.000 €'"""
+    if value in (None, ''):
+        return ''
+    return f"{float(value):,.0f} €".replace(',', '.')
+
+
+def _blank_none(value):
+    # Missing listing data renders as nothing instead of 'None'
+    return '' if value is None else value
+
+
+environment = ImmutableSandboxedEnvironment(
+    autoescape=False,
+    undefined=StrictUndefined,
+    finalize=_blank_none,
+    keep_trailing_newline=True,
+    auto_reload=False,
+)
+environment.filters['euro'] = _format_euro
+
+
+@lru_cache(maxsize=COMPILED_CACHE_SIZE)
+def compile_template(source):
+    """Compiled Jinja2 template for `source`, cached. Raises ValueError on syntax errors."""
+    try:
+        return environment.from_string(source or '')
+    except TemplateSyntaxError as e:
+        raise ValueError(f"Template syntax error on line {e.lineno}: {e.message}")
+
+
+def validate(source):
+    """Raise ValueError when `source` does not compile, uses names outside VARIABLES or '__' attributes"""
+    compile_template(source)
+    tree = environment.parse(source or '')
+    unknown = meta.find_undeclared_variables(tree) - set(VARIABLES)
+    if unknown:
+        raise ValueError(f"Unknown template variable(s): {', '.join(sorted(unknown))}. "
+                         f"Available: {', '.join(VARIABLES)}")
+
+    for node in tree.find_all((nodes.Getattr, nodes.Getitem, nodes.Filter)):
+        if isinstance(node, nodes.Getattr):
+            name = node.attr
+        elif isinstance(node, nodes.Getitem):
+            name = getattr(node.arg, 'value', None)
+        else:
+            name = getattr(node.args[0], 'value', None) if node.name == 'attr' and node.args else None
+        if isinstance(name, str) and '__' in name:
+            raise ValueError(f"Template may not access the attribute {name!r}")
+
+
+def render(source, context):
+    """Render one message; every name in VARIABLES is defined (None when unknown)"""
+    return compile_template(source).render(dict(dict.fromkeys(VARIABLES), **context))
+
+
+def render_many(source, contexts):
+    """Render one message per context, compiling `source` once"""
+    template = compile_template(source)
+    blank = dict.fromkeys(VARIABLES)
+    # A shared context skips copying the environment globals for every message
+    # (validated templates can't use them): about twice as fast as render()
+    return [environment.concat(template.root_render_func(template.new_context(dict(blank, **context), shared=True)))
+            for context in contexts]
+
+
+def customer_signature(first_name=None, last_name=None, company_name=None, phone=None, email=None):
+    """Signature block built from a customer's contact details"""
+    lines = [' '.join(filter(None, [first_name, last_name])), company_name,
+             f"T: {phone}" if phone else None, email]
+    return '\n'.join(line for line in lines if line)
+
+
+def load_template_file(path):
+    """
+    (body, context) of a template exported by `flask export-template`: the
+    template text and the customer's variables (name, company, signature)
+    """
+    with open(path, encoding='utf-8') as f:
+        exported = json.load(f)
+    if not exported.get('body'):
+        raise ValueError(f"{path} holds no template body")
+    validate(exported['body'])
+    context = {key: value for key, value in (exported.get('context') or {}).items() if key in VARIABLES}
+    return exported['body'], context
@@ -0,0 +1,210 @@
+"""
+Streaming readers for ImmoMetrica offers.csv exports.
+
+Everything here reads the file row by row with the csv module, so memory stays
+flat on 100k+ row exports and importing it does not pull in pandas or
+Selenium (the Flask CLI uses it too).
+
+Files are decoded as utf-8-sig by default: Excel saves UTF-8 CSVs with a
+byte order mark, which plain utf-8 would keep glued to the first header.
+"""
+
+import csv
+import json
+import re
+from pathlib import Path
+
+# Columns AC..AT hold the per-platform listing links
+LINK_START_COL = 28  # AC
+LINK_END_COL = 45    # AT
+
+URL_PATTERN = re.compile(r'https?://[^\s;]+')
+
+# Listing field -> accepted export header names (compared case-insensitively)
+OFFER_COLUMNS = {
+    'title': ['Titel', 'Title', 'Überschrift', 'Objekttitel'],
+    'description': ['Beschreibung', 'Description'],
+    'property_type': ['Objektart', 'Objekttyp', 'Immobilientyp', 'Property Type'],
+    'address': ['Adresse', 'Straße', 'Strasse', 'Address'],
+    'postal_code': ['PLZ', 'Postleitzahl', 'Postal Code'],
+    'city': ['Ort', 'Stadt', 'City'],
+    'location': ['Lage', 'Standort', 'Region', 'Location'],
+    'price': ['Kaufpreis', 'Preis', 'Price'],
+    'price_per_sqm': ['Preis/m²', 'Preis pro m²', 'Kaufpreis/m²', 'Price per sqm'],
+    'living_area': ['Wohnfläche', 'Wohnfläche (m²)', 'Living Area'],
+    'rooms': ['Zimmer', 'Anzahl Zimmer', 'Rooms'],
+    'units': ['Wohneinheiten', 'Anzahl Wohneinheiten', 'Einheiten', 'Units'],
+    'year_built': ['Baujahr', 'Year Built'],
+    'contact_name': ['Anbieter', 'Kontakt', 'Ansprechpartner', 'Contact'],
+    'contact_phone': ['Telefon', 'Phone'],
+    'contact_email': ['E-Mail', 'Email'],
+}
+NUMERIC_FIELDS = {'price': float, 'price_per_sqm': float, 'living_area': float, 'rooms': float, 'units': int,
+                  'year_built': int}
+
+
+def iter_csv_rows(csv_path, delimiter=';', encoding='utf-8-sig'):
+    """
+    Yield (header, row) for every data row.
+
+    Rows with more fields than the header are skipped (like pandas
+    on_bad_lines='skip'); short rows are padded with empty strings.
+    """
+    with open(csv_path, mode='r', encoding=encoding, newline='') as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header = next(reader, None)
+        if header is None:
+            return
+
+        width = len(header)
+        for row in reader:
+            if len(row) > width:
+                continue
+            if len(row) < width:
+                row = row + [''] * (width - len(row))
+            yield header, row
+
+
+def iter_url_jobs(csv_path, delimiter=';', encoding='utf-8-sig'):
+    """Lazily yield (column, url) contact jobs from the link columns AC..AT, row by row"""
+    link_columns = None
+
+    for header, row in iter_csv_rows(csv_path, delimiter, encoding):
+        if link_columns is None:
+            if len(header) <= LINK_END_COL:
+                raise ValueError("CSV does not contain columns up to AT")
+            link_columns = list(enumerate(header[LINK_START_COL:LINK_END_COL + 1], start=LINK_START_COL))
+
+        for position, column in link_columns:
+            cell = row[position]
+            if cell:
+                for url in URL_PATTERN.findall(cell):
+                    yield column, url
+
+
+def parse_number(value, cast=float):
+    """Parse German formatted numbers like '1.250.000,50 €' or '85,5 m²' (None when empty or invalid)"""
+    if not value:
+        return None
+    cleaned = re.sub(r'[^\d,.\-]', '', value)
+    if ',' in cleaned:
+        cleaned = cleaned.replace('.', '').replace(',', '.')
+    elif cleaned.count('.') > 1 or re.search(r'\.\d{3}$', cleaned):
+        cleaned = cleaned.replace('.', '')
+    try:
+        return cast(float(cleaned))
+    except ValueError:
+        return None
+
+
+def link_platform(column):
+    """Platform name for a link column without a known listing ID pattern ('Link Foo' -> 'foo')"""
+    return re.sub(r'^link\s*', '', column.strip(), flags=re.IGNORECASE).lower() or column
+
+
+def iter_offer_rows(csv_path, delimiter=';', encoding='utf-8-sig'):
+    """
+    Yield (fields, links) per export row: a dict of Listing fields and the
+    row's [(column, url)] links. A row linked on three platforms is one
+    property with three links.
+    """
+    field_positions = None
+    link_columns = None
+
+    for header, row in iter_csv_rows(csv_path, delimiter, encoding):
+        if field_positions is None:
+            if len(header) <= LINK_END_COL:
+                raise ValueError("CSV does not contain columns up to AT")
+            link_columns = list(enumerate(header[LINK_START_COL:LINK_END_COL + 1], start=LINK_START_COL))
+            lookup = {name.strip().lower(): position for position, name in enumerate(header)}
+            field_positions = {}
+            for field, names in OFFER_COLUMNS.items():
+                position = next((lookup[n.lower()] for n in names if n.lower() in lookup), None)
+                if position is not None:
+                    field_positions[field] = position
+
+        fields = {}
+        for field, position in field_positions.items():
+            value = row[position].strip()
+            if field in NUMERIC_FIELDS:
+                value = parse_number(value, NUMERIC_FIELDS[field])
+            fields[field] = value or None
+
+        links = [(column, url) for position, column in link_columns if row[position]
+                 for url in URL_PATTERN.findall(row[position])]
+        yield fields, links
+
+
+def iter_offers(csv_path, delimiter=';', encoding='utf-8-sig'):
+    """
+    Yield one offer per linked listing: a dict of Listing fields taken from the
+    row plus `column` and `url` of the link. A row linked on three platforms
+    yields three offers sharing the same field values.
+    """
+    for fields, links in iter_offer_rows(csv_path, delimiter, encoding):
+        for column, url in links:
+            yield dict(fields, column=column, url=url)
+
+
+def read_csv_by_columns(csv_path, jobs=None):
+    """Group the contact URLs of an export (or the given (column, url, ...) jobs) by link column"""
+    print(f"Reading CSV file: {csv_path}")
+
+    column_urls = {}
+    for column, url, *_ in jobs if jobs is not None else iter_url_jobs(csv_path):
+        column_urls.setdefault(column, []).append(url)
+
+    for column, urls in column_urls.items():
+        print(f"✓ {column}: {len(urls)} URLs")
+
+    return column_urls
+
+
+def iter_csv_records(csv_path, delimiter=',', encoding='utf-8-sig'):
+    """Yield each CSV row as a dict, stripped, with empty strings normalized to None"""
+    with open(csv_path, mode='r', encoding=encoding, newline='') as f:
+        reader = csv.DictReader(f, delimiter=delimiter)
+
+        for row in reader:
+            # Rows with more fields than the header are skipped, like iter_csv_rows
+            if None in row:
+                continue
+            yield {
+                key: (value.strip() if value and value.strip() else None)
+                for key, value in row.items()
+            }
+
+
+def csv_to_json(csv_path, json_path=None, encoding="utf-8-sig", delimiter=","):
+    """
+    Convert CSV file to JSON file, streaming one record at a time.
+
+    :param csv_path: Path to CSV file
+    :param json_path: Optional output JSON path
+    :param encoding: File encoding
+    :param delimiter: CSV field separator (ImmoMetrica exports use ';')
+    :return: Number of records written
+    """
+
+    csv_path = Path(csv_path)
+
+    if not csv_path.exists():
+        raise FileNotFoundError(f"CSV file not found: {csv_path}")
+
+    if json_path is None:
+        json_path = csv_path.with_suffix(".json")
+    else:
+        json_path = Path(json_path)
+
+    count = 0
+    with json_path.open(mode="w", encoding="utf-8") as f:
+        f.write("[")
+        for record in iter_csv_records(csv_path, delimiter=delimiter, encoding=encoding):
+            f.write(",\n" if count else "\n")
+            f.write(json.dumps(record, ensure_ascii=False))
+            count += 1
+        f.write("\n]\n")
+
+    print(f"✓ CSV converted to JSON → {json_path} ({count} records)")
+
+    return count
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Listing serialization benchmark.
+
+Measures rows/sec of the two read paths over the newest listings of the
+configured database:
+
+- ORM: hydrate Listing objects, to_dict(), encode with json
+- rows: select the columns as plain rows, listing_serializer, encode with
+  serializers.dumps (orjson when installed)
+
+    python scripts/benchmark_serializers.py [rows] [repeat]
+"""
+
+import json
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import select
+
+from app import create_app
+from app.database import db
+from app.models import Listing
+from app import serializers
+from app.serializers import listing_serializer
+
+
+def _best(step, repeat):
+    """Fastest of `repeat` runs of step() in seconds, with its result"""
+    best = None
+    for _ in range(repeat):
+        db.session.expunge_all()
+        started = time.perf_counter()
+        result = step()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def orm_path(limit):
+    listings = Listing.query.order_by(Listing.scraped_at.desc(), Listing.id.desc()).limit(limit).all()
+    payload = [listing.to_dict() for listing in listings]
+    return json.dumps(payload, ensure_ascii=False), len(listings)
+
+
+def row_path(limit):
+    rows = db.session.execute(
+        select(*listing_serializer.columns).order_by(Listing.scraped_at.desc(), Listing.id.desc()).limit(limit)
+    ).all()
+    return serializers.dumps(listing_serializer.many(rows)), len(rows)
+
+
+def serialize_only(rows, repeat):
+    """(to_dict rows/sec, listing_serializer rows/sec) without the database round trip"""
+    listings = Listing.query.order_by(Listing.scraped_at.desc(), Listing.id.desc()).limit(len(rows)).all()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        [listing.to_dict() for listing in listings]
+    orm = len(listings) * repeat / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        listing_serializer.many(rows)
+    compiled = len(rows) * repeat / (time.perf_counter() - started)
+    return orm, compiled
+
+
+def benchmark(limit=10000, repeat=3):
+    app = create_app()
+
+    with app.app_context():
+        print(f" Listing serialization, newest {limit} rows, best of {repeat}")
+        print(f" JSON encoder: {'orjson' if serializers.orjson else 'json'}")
+        print("=" * 60)
+
+        orm_seconds, (_, count) = _best(lambda: orm_path(limit), repeat)
+        if not count:
+            print(" No listings to serialize")
+            return
+        row_seconds, _ = _best(lambda: row_path(limit), repeat)
+
+        rows = db.session.execute(select(*listing_serializer.columns).limit(count)).all()
+        orm_rate, compiled_rate = serialize_only(rows, repeat)
+
+        print(f" {'end to end (query + dicts + JSON)':<40} {'rows/sec':>10}")
+        print(f"   ORM objects + to_dict + json          {count / orm_seconds:>10,.0f}")
+        print(f"   rows + listing_serializer + dumps     {count / row_seconds:>10,.0f}"
+              f"   x{orm_seconds / row_seconds:.1f}")
+        print(f" {'dicts only':<40}")
+        print(f"   to_dict                               {orm_rate:>10,.0f}")
+        print(f"   listing_serializer                    {compiled_rate:>10,.0f}"
+              f"   x{compiled_rate / orm_rate:.1f}")
+
+
+if __name__ == '__main__':
+    benchmark(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Query plan regression check.
+
+Runs EXPLAIN (MySQL) / EXPLAIN QUERY PLAN (SQLite) on the queries behind the
+listing, search, mailing and dashboard endpoints and exits with status 1 when
+one of them falls back to a full table scan. Run it after changing models,
+indexes or service queries:
+
+    python scripts/check_query_plans.py [-v] [--database-uri URI]
+
+By default it checks the database of the app config; --database-uri points
+it elsewhere, e.g. a scratch SQLite file (tables and indexes are created).
+"""
+
+import argparse
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from app import create_app
+from config import config
+from app.database import db
+from app.models import Appointment, Customer, Listing, Mailing, Search
+from app.pagination import DEFAULT_PER_PAGE, encode_cursor, keyset_query
+from app.services import CustomerService, ListingService, SearchService
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN wrapper that keeps the wrapped statement's bound parameters"""
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    prefix = 'EXPLAIN QUERY PLAN ' if compiler.dialect.name == 'sqlite' else 'EXPLAIN '
+    return prefix + compiler.process(element.statement, **kw)
+
+
+def _page(query, columns, descending=True, cursor=None):
+    """The statement keyset_paginate issues for a page"""
+    return keyset_query(query, columns, DEFAULT_PER_PAGE, cursor, descending).statement
+
+
+def service_queries():
+    """(label, statement) for every query whose plan is checked"""
+    now = datetime.now(timezone.utc)
+    listing_key = [Listing.scraped_at, Listing.id]
+
+    queries = [
+        ('listings page: customer', _page(ListingService._filtered_query({'customer_id': 1}), listing_key)),
+        ('listings page: customer + status',
+         _page(ListingService._filtered_query({'customer_id': 1, 'status': 'new'}), listing_key)),
+        ('listings page: status', _page(ListingService._filtered_query({'status': 'new'}), listing_key)),
+        ('listings page: platform', _page(ListingService._filtered_query({'platform': 'immoscout24'}), listing_key)),
+        ('listings page: search', _page(ListingService._filtered_query({'search_id': 1}), listing_key)),
+        ('listings page: customer, next page',
+         _page(ListingService._filtered_query({'customer_id': 1}), listing_key, cursor=encode_cursor([now, 10]))),
+        ('listings page: full-text search',
+         _page(ListingService._filtered_query({'search_text': 'mehrfamilienhaus bochum'}), listing_key)),
+        ('listings by postal code', select(Listing.id).where(Listing.postal_code == '44789')),
+        ('listings by city', select(Listing.id).where(Listing.city == 'Bochum')),
+        ('listings export', ListingService._filtered_query({'customer_id': 1}).order_by(
+            Listing.scraped_at.desc(), Listing.id.desc()).statement),
+        ('listing status counts: customer', select(Listing.status, func.count(Listing.id))
+         .where(Listing.customer_id == 1).group_by(Listing.status)),
+        ('searches page: customer',
+         _page(SearchService._filtered_query({'customer_id': 1}), [Search.created_at, Search.id])),
+        ('searches page', _page(SearchService._filtered_query(), [Search.created_at, Search.id])),
+        ('searches due', select(Search.id).where(Search.is_active.is_(True), Search.next_run_at <= now)
+         .order_by(Search.next_run_at)),
+        ('customers page', _page(CustomerService._filtered_query(),
+                                 [Customer.last_name, Customer.first_name, Customer.id], descending=False)),
+        ('customers page: status', _page(CustomerService._filtered_query({'status': 'ACTIVE'}),
+                                         [Customer.last_name, Customer.first_name, Customer.id],
+                                         descending=False)),
+        ('active customers count', select(func.count(Customer.id)).where(Customer.status == 'ACTIVE')),
+        ('recent customers count', select(func.count(Customer.id)).where(Customer.created_at >= now)),
+        ('active searches count', select(func.count(Search.id)).where(Search.is_active.is_(True))),
+        ('mailing status counts: customer', select(Mailing.status, func.count(Mailing.id))
+         .where(Mailing.customer_id == 1).group_by(Mailing.status)),
+        ('mailings: customer + status', select(Mailing.id).where(Mailing.customer_id == 1, Mailing.status == 'sent')),
+        ('appointments count: customer', select(func.count(Appointment.id)).where(Appointment.customer_id == 1)),
+    ]
+    return queries
+
+
+def full_scans(dialect, plan_rows):
+    """Plan lines that read a whole table instead of an index"""
+    scans = []
+    for row in plan_rows:
+        row = row._mapping
+        if dialect == 'sqlite':
+            detail = row['detail']
+            # Virtual tables (FTS5) are answered by their own index
+            if detail.startswith('SCAN') and 'USING' not in detail and 'VIRTUAL TABLE' not in detail:
+                scans.append(detail)
+        elif row.get('type') == 'ALL':
+            scans.append(f"{row['table']}: type=ALL, rows={row.get('rows')}")
+    return scans
+
+
+def format_plan(dialect, plan_rows):
+    if dialect == 'sqlite':
+        return [row._mapping['detail'] for row in plan_rows]
+    return [f"{r._mapping['table']}: type={r._mapping['type']} key={r._mapping['key']} rows={r._mapping['rows']}"
+            for r in plan_rows]
+
+
+def plan_check_config(database_uri=None, config_object=config):
+    """The app config (class or instance), pointed at `database_uri` when one is given"""
+    if database_uri is None:
+        return config_object
+    base = config_object if isinstance(config_object, type) else type(config_object)
+    return type('PlanCheckConfig', (base,), {
+        'SQLALCHEMY_DATABASE_URI': database_uri,
+        'SQLALCHEMY_ENGINE_OPTIONS': {},
+    })
+
+
+def check_query_plans(verbose=False, database_uri=None, config_object=config):
+    """Explain every service query; return the list of (label, scans) that regressed"""
+    app = create_app(plan_check_config(database_uri, config_object))
+    failures = []
+
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        print(f" Checking query plans on {dialect}")
+        print("=" * 60)
+
+        for label, statement in service_queries():
+            plan = db.session.execute(Explain(statement)).fetchall()
+            scans = full_scans(dialect, plan)
+            print(f" {'✗' if scans else '✓'} {label}")
+            if scans or verbose:
+                for line in format_plan(dialect, plan):
+                    print(f"     {line}")
+            if scans:
+                failures.append((label, scans))
+
+    print("=" * 60)
+    if failures:
+        print(f" {len(failures)} query plan(s) use a full table scan")
+    else:
+        print(" All query plans use indexes")
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fail when a service query plan uses a full table scan')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print every plan')
+    parser.add_argument('--database-uri', help='SQLAlchemy URI to check instead of the configured database')
+    args = parser.parse_args()
+    sys.exit(1 if check_query_plans(verbose=args.verbose, database_uri=args.database_uri) else 0)
@@ -14,6 +14,7 @@ sys.path.insert(0, str(project_root))
 from app import create_app
 from app.database import db
 from app.models import AccountManager, Customer, Search, Listing, Mailing, Appointment
+from app.services import CustomerService
 from sqlalchemy import inspect, text
 
 
@@ -35,6 +36,10 @@ def init_database():
                 columns = inspector.get_columns(table)
                 print(f"  - {table} ({len(columns)} columns)")
 
+            # Backfill the normalized customer platform table used by the dashboard
+            platform_rows = CustomerService.rebuild_platform_index()
+            print(f"\n Customer platform index rebuilt ({platform_rows} rows)")
+
             # Count existing records
             print(f"\n Current statistics:")
             print(f"   - Account Managers: {AccountManager.query.count()}")
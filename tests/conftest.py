@@ -0,0 +1,41 @@
+"""
+Shared test fixtures: the app on an in-memory SQLite database.
+
+    python -m pytest tests
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from config import Config
+from app import create_app
+from app.database import db
+
+
+class TestConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    TESTING = True
+
+    # No background refreshes: every request sees the same cache and index state
+    AUTOCOMPLETE_REFRESH_SECONDS = 0
+    MATCHING_REFRESH_SECONDS = 0
+    REFERENCE_CACHE_SYNC_SECONDS = 0
+
+
+@pytest.fixture
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
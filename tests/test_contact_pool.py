@@ -0,0 +1,155 @@
+"""
+contact_pool.run_worker_pool with a fake driver and stub handlers: results,
+per-platform pacing, and what happens to jobs when a worker process dies.
+
+Workers are spawned processes, so the fakes are module-level and picklable.
+"""
+
+import os
+
+import immometricabot
+from contact_journal import ContactJournal
+from contact_pool import RateLimiter, run_worker_pool
+
+
+class FakeElement:
+    def is_displayed(self):
+        return True
+
+
+class FakeDriver:
+    """The WebDriver calls contact_url makes, without a browser"""
+
+    def __init__(self):
+        self.current_url = None
+
+    def get(self, url):
+        self.current_url = url
+
+    def find_element(self, by, value):
+        return FakeElement()
+
+    def save_screenshot(self, path):
+        return True
+
+    def quit(self):
+        pass
+
+
+def fake_driver_factory():
+    return FakeDriver()
+
+
+def contact(driver, index, listing=None):
+    pass
+
+
+def crash_on_marked(driver, index, listing=None):
+    # Simulates a browser/worker crash mid-contact
+    if 'crash' in driver.current_url:
+        os._exit(1)
+
+
+def unconfirmed(driver, index, listing=None):
+    raise immometricabot.SubmitUnconfirmed("Form submit not confirmed within 20s")
+
+
+def broken(driver, index, listing=None):
+    raise RuntimeError("contact button not found")
+
+
+def render_message(driver, index, listing=None):
+    # What the real handlers type into the contact form
+    message = immometricabot.outreach_message(listing)
+    if message != f"Hallo {listing['contact_name']}, {listing['title']} in {listing['city']} ({listing['platform']})":
+        raise RuntimeError(f"unexpected message {message!r}")
+
+
+HANDLERS = {'A': contact, 'B': contact, 'Crash': crash_on_marked, 'Unconfirmed': unconfirmed, 'Broken': broken,
+            'Render': render_message}
+
+
+class RecordingRateLimiter(RateLimiter):
+    """RateLimiter noting when each platform slot was taken"""
+
+    def __init__(self, limits):
+        super().__init__(limits, default=0.0)
+        self.starts = []
+
+    def acquire(self, platform):
+        self.starts.append((platform, self.clock()))
+        super().acquire(platform)
+
+
+def run(jobs, **kwargs):
+    kwargs.setdefault('rate_limiter', RateLimiter({}, default=0.0))
+    return run_worker_pool(jobs, driver_factory=fake_driver_factory, handlers=HANDLERS, poll_interval=0.05,
+                           **kwargs)
+
+
+def jobs_for(column, count):
+    return [(column, f'https://example.com/{column.lower()}/{i}') for i in range(count)]
+
+
+def test_every_job_gets_a_result_and_is_journaled(tmp_path):
+    journal = ContactJournal(str(tmp_path / 'jobs.sqlite3'))
+    jobs = jobs_for('A', 4) + jobs_for('B', 3) + jobs_for('Broken', 1) + jobs_for('Unconfirmed', 1)
+
+    results = run(iter(jobs), workers=3, journal=journal)
+
+    assert sorted((r['column'], r['url']) for r in results) == sorted(jobs)
+    statuses = {r['url']: r['status'] for r in results}
+    assert statuses['https://example.com/broken/0'] == 'failed'
+    assert statuses['https://example.com/unconfirmed/0'] == 'unknown'
+    assert journal.summary() == {'sent': 7, 'failed': 1, 'unknown': 1}
+    assert all(journal.is_done(url) for column, url in jobs if column != 'Broken')
+
+
+def test_platforms_are_paced_independently():
+    limiter = RecordingRateLimiter({'A': 1.0, 'B': 0.0})
+
+    results = run(jobs_for('A', 3) + jobs_for('B', 3), workers=3, rate_limiter=limiter)
+
+    assert all(r['status'] == 'sent' for r in results)
+    a_starts = [at for platform, at in limiter.starts if platform == 'A']
+    assert all(later - earlier >= 1.0 for earlier, later in zip(a_starts, a_starts[1:]))
+    # B's jobs go to idle workers while A waits for its slot, not after A's queue
+    b_starts = [at for platform, at in limiter.starts if platform == 'B']
+    assert max(b_starts) < a_starts[-1]
+
+
+def test_crashed_worker_is_replaced_and_its_job_held_for_review(tmp_path):
+    journal = ContactJournal(str(tmp_path / 'jobs.sqlite3'))
+    jobs = [('Crash', 'https://example.com/crash/1')] + jobs_for('A', 4)
+
+    results = run(jobs, workers=1, journal=journal, max_restarts=1)
+
+    statuses = {r['url']: r['status'] for r in results}
+    assert statuses.pop('https://example.com/crash/1') == 'unknown'
+    assert set(statuses.values()) == {'sent'} and len(statuses) == 4
+    # Not retried automatically: it may have reached the seller
+    assert journal.is_done('https://example.com/crash/1')
+    assert journal.unknown() == [('Crash', 'https://example.com/crash/1')]
+
+
+def test_jobs_left_without_workers_are_reported_failed():
+    jobs = [('Crash', f'https://example.com/crash/{i}') for i in range(2)] + jobs_for('A', 3)
+
+    results = run(iter(jobs), workers=1, max_restarts=1, buffer_size=2)
+
+    assert sorted(r['url'] for r in results) == sorted(url for _, url in jobs)
+    statuses = [r['status'] for r in results]
+    assert statuses.count('unknown') == 2
+    assert statuses.count('failed') == 3
+    assert all(r['error'] == 'no worker left' for r in results if r['status'] == 'failed')
+
+
+def test_workers_render_the_template_with_each_row():
+    template = "Hallo {{ contact_name }}, {{ title }} in {{ city }} ({{ platform }})"
+    jobs = [('Render', f'https://example.com/render/{i}',
+             {'title': f'Wohnung {i}', 'city': 'Bochum', 'contact_name': f'Frau {i}', 'description': 'x'})
+            for i in range(3)]
+
+    results = run(jobs, workers=2, initializer=immometricabot.use_outreach_template, initargs=(template, {}))
+
+    assert [r['status'] for r in results] == ['sent'] * 3, [r.get('error') for r in results]
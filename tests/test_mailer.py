@@ -0,0 +1,171 @@
+"""
+app/mailer.py against a stub SMTP server: claiming, permanent and temporary
+failures, retry scheduling and the customer_stats counters record() keeps.
+
+The stub answers RCPT for @bounce.example with 550 and for @busy.example
+with 451, and accepts everything else.
+"""
+
+import socketserver
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.database import db
+from app.mailer import RETRY_BASE, MailSender, SMTPPool, claim_due_mailings
+from app.models import Customer, Listing, Mailing
+from app.services import StatsService
+
+
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.reply('220 stub ESMTP')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 stub')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                if 'bounce.example' in command:
+                    self.reply('550 5.1.1 No such user')
+                elif 'busy.example' in command:
+                    self.reply('451 4.7.1 Try again later')
+                else:
+                    recipients.append(command.partition(':')[2].strip('<> '))
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while (line := self.rfile.readline()) not in (b'.\r\n', b''):
+                    data.append(line)
+                self.server.received.append((recipients, b''.join(data)))
+                self.reply('250 Queued')
+            elif verb in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubSMTPHandler)
+        self.received = []
+
+
+@pytest.fixture
+def smtp_server():
+    server = StubSMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_sender(app, server, **kwargs):
+    pool = SMTPPool('127.0.0.1', server.server_address[1], timeout=5)
+    return MailSender(app, pool, 'kontakt@example.com', connections=2, poll_interval=0, log=lambda *_: None,
+                      **kwargs)
+
+
+@pytest.fixture
+def customer(app):
+    customer = Customer(first_name='Test', last_name='Customer', email='customer@example.com', status='ACTIVE')
+    db.session.add(customer)
+    db.session.commit()
+    return customer
+
+
+def queue(customer, recipient, **fields):
+    fields.setdefault('attempts', 0)
+    listing = Listing(customer=customer, title='Wohnung', platform='immoscout24',
+                      url=f'https://example.com/expose/{recipient}', status='new')
+    mailing = Mailing(listing=listing, customer=customer, type='initial', recipient=recipient,
+                      subject='Ihre Immobilie', content='Guten Tag', status='queued', **fields)
+    db.session.add_all([listing, mailing])
+    db.session.commit()
+    return mailing
+
+
+def reload(mailing):
+    db.session.expire_all()
+    return db.session.get(Mailing, mailing.id)
+
+
+def test_claim_takes_due_mailings_once(customer):
+    due = queue(customer, 'a@example.com')
+    later = queue(customer, 'b@example.com', next_attempt_at=datetime.utcnow() + timedelta(hours=1))
+    queue(customer, 'c@example.com').status = 'sent'
+    db.session.commit()
+
+    claimed = claim_due_mailings(10)
+
+    assert [row.id for row in claimed] == [due.id]
+    # The lease hides claimed mailings from other senders
+    assert claim_due_mailings(10) == []
+    assert reload(later).next_attempt_at > datetime.utcnow()
+
+
+def test_permanent_and_temporary_failures(app, smtp_server, customer):
+    sent = queue(customer, 'seller@example.com')
+    bounced = queue(customer, 'seller@bounce.example')
+    busy = queue(customer, 'seller@busy.example')
+
+    before = datetime.utcnow()
+    make_sender(app, smtp_server).run(once=True)
+
+    assert [recipients for recipients, _ in smtp_server.received] == [['seller@example.com']]
+
+    sent = reload(sent)
+    assert (sent.status, sent.attempts, sent.error) == ('sent', 1, None)
+    assert sent.sent_at is not None
+
+    bounced = reload(bounced)
+    assert (bounced.status, bounced.attempts, bounced.next_attempt_at) == ('error', 1, None)
+    assert '550' in bounced.error
+
+    # 4xx: back to the queue after the first backoff step (plus up to 20% jitter)
+    busy = reload(busy)
+    assert (busy.status, busy.attempts) == ('queued', 1)
+    assert '451' in busy.error
+    assert before + RETRY_BASE <= busy.next_attempt_at <= datetime.utcnow() + RETRY_BASE * 1.2
+
+
+def test_temporary_failure_gives_up_after_max_attempts(app, smtp_server, customer):
+    busy = queue(customer, 'seller@busy.example', attempts=2)
+
+    make_sender(app, smtp_server, max_attempts=3).run(once=True)
+
+    busy = reload(busy)
+    assert (busy.status, busy.attempts, busy.next_attempt_at) == ('error', 3, None)
+
+
+def test_record_moves_stats_out_of_queued(app, smtp_server, customer):
+    for recipient in ('one@example.com', 'two@example.com', 'seller@bounce.example', 'seller@busy.example'):
+        queue(customer, recipient)
+    StatsService.rebuild()
+    assert StatsService.get_counters('mailing_status', customer.id) == {'queued': 4}
+
+    make_sender(app, smtp_server).run(once=True)
+
+    # Retries stay counted as queued
+    assert StatsService.get_counters('mailing_status', customer.id) == {'queued': 1, 'sent': 2, 'error': 1}
+    StatsService.rebuild()
+    assert StatsService.get_counters('mailing_status', customer.id) == {'queued': 1, 'sent': 2, 'error': 1}
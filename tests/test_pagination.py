@@ -0,0 +1,38 @@
+"""
+Cursor tokens come from clients: malformed or mistyped ones are a 400, not a 500.
+"""
+
+import pytest
+
+from app.pagination import decode_cursor, encode_cursor
+from app.models import Listing
+
+LISTING_KEY = [Listing.scraped_at, Listing.id]
+
+
+@pytest.mark.parametrize('values', [
+    [123, 4],                                  # id where the datetime belongs
+    ['2026-01-01T00:00:00', 'x'],              # non-integer id
+    ['2026-01-01T00:00:00', True],
+    ['2026-01-01T00:00:00', 4.5],
+    ['not a date', 4],
+    [['2026-01-01T00:00:00'], 4],
+    ['2026-01-01T00:00:00'],                   # wrong length
+])
+def test_mistyped_cursor_is_rejected(app, client, values):
+    cursor = encode_cursor(values)
+
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        decode_cursor(cursor, LISTING_KEY)
+
+    response = client.get(f'/api/v1/listings?cursor={cursor}')
+    assert response.status_code == 400
+    assert 'Invalid cursor' in response.get_data(as_text=True)
+
+
+def test_cursor_round_trip(app, client):
+    cursor = encode_cursor(['2026-01-01T00:00:00', 4])
+
+    assert decode_cursor(cursor, LISTING_KEY)[1] == 4
+    assert decode_cursor(encode_cursor([None, 4]), LISTING_KEY) == [None, 4]
+    assert client.get(f'/api/v1/listings?cursor={cursor}').status_code == 200
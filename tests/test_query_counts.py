@@ -0,0 +1,86 @@
+"""
+The list endpoints run a fixed number of SQL statements per request, however
+many rows a page holds (no N+1 loads of relationships or counts).
+"""
+
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app.database import db
+from app.models import AccountManager, Customer, Listing, Search
+
+LIST_ENDPOINTS = [
+    '/api/v1/account-managers',
+    '/api/v1/customers?per_page=100',
+    '/api/v1/searches?per_page=100',
+    '/api/v1/listings?per_page=100',
+    '/api/v1/listings?per_page=100&fields=id,title,status',
+    '/api/v1/listings/export?format=csv',
+]
+
+
+@contextmanager
+def count_queries():
+    """Collects the statements executed inside the block into the yielded list"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def seed(start, count):
+    """`count` customers, each with its own account manager, a search and two listings"""
+    for i in range(start, start + count):
+        manager = AccountManager(first_name='Test', last_name=f'Manager {i}', email=f'manager{i}@example.com',
+                                 role='ACCOUNT_MANAGER', is_active=True)
+        customer = Customer(first_name='Test', last_name=f'Customer {i}', email=f'customer{i}@example.com',
+                            status='ACTIVE')
+        customer.account_managers.append(manager)
+        search = Search(customer=customer, account_manager=manager, name=f'Search {i}',
+                        location_postcode='44789')
+        db.session.add_all([manager, customer, search])
+        for j in range(2):
+            db.session.add(Listing(customer=customer, search=search, title=f'Listing {i}-{j}',
+                                   platform='immoscout24', url=f'https://example.com/expose/{i}{j}',
+                                   postal_code='44789', status='new'))
+    db.session.commit()
+
+
+def request_queries(app, client, url):
+    """Statements run by one cold request (empty reference cache, no ETag)"""
+    app.extensions.pop('reference_cache', None)
+    db.session.expunge_all()
+    with count_queries() as statements:
+        response = client.get(url)
+        response.get_data()  # streamed responses query while they are read
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return statements
+
+
+@pytest.mark.parametrize('url', LIST_ENDPOINTS)
+def test_query_count_does_not_grow_with_rows(app, client, url):
+    seed(0, 3)
+    few = request_queries(app, client, url)
+
+    seed(3, 30)
+    many = request_queries(app, client, url)
+
+    assert len(many) == len(few), '\n'.join(many)
+
+
+@pytest.mark.parametrize('url', [url for url in LIST_ENDPOINTS if 'per_page' in url])
+def test_query_count_does_not_grow_with_page_size(app, client, url):
+    seed(0, 30)
+    small = request_queries(app, client, url.replace('per_page=100', 'per_page=2'))
+    large = request_queries(app, client, url)
+
+    assert len(large) == len(small), '\n'.join(large)
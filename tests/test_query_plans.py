@@ -0,0 +1,27 @@
+"""
+scripts/check_query_plans.py against SQLite: every service query uses an index.
+"""
+
+import sys
+from pathlib import Path
+
+from sqlalchemy import select
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'scripts'))
+
+import check_query_plans
+from app.database import db
+from app.models import Listing
+
+
+def test_service_queries_use_indexes():
+    failures = check_query_plans.check_query_plans(database_uri='sqlite://')
+
+    assert failures == []
+
+
+def test_full_table_scan_is_reported(app):
+    statement = select(Listing.id).where(Listing.description == 'x')
+    plan = db.session.execute(check_query_plans.Explain(statement)).fetchall()
+
+    assert check_query_plans.full_scans('sqlite', plan)
@@ -0,0 +1,19 @@
+"""
+German text normalisation shared by full-text search (app/search.py) and
+near-duplicate detection (listing_dedup.py), so both split and fold words
+the same way.
+
+Plain stdlib, so the contact bot can use it without the Flask app.
+"""
+
+import re
+import unicodedata
+
+# Umlauts and ß as written without them: 'Müller' -> 'mueller'
+UMLAUTS = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+WORD = re.compile(r'\w+')
+
+
+def strip_accents(word):
+    """Drop combining marks: 'café' -> 'cafe', 'müller' -> 'muller'"""
+    return ''.join(c for c in unicodedata.normalize('NFKD', word) if not unicodedata.combining(c))